@@ -0,0 +1,163 @@
+import asyncio
+import atexit
+import threading
+import weakref
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+DEFAULT_TIMEOUT = (3.05, 15)  # (connect, read) seconds
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_IN_FLIGHT = 100
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+_open_clients = weakref.WeakSet()
+
+
+class EventLoopThread:
+    """
+    Цикл событий asyncio в фоновом потоке. Синхронный код отправляет
+    в него корутины и ждёт результата, а запросы всех потоков
+    выполняются в одном цикле и ждут сеть, не занимая по потоку каждый.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name='async-http', daemon=True,
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5):
+        """Закрывает сессии клиентов и останавливает цикл событий."""
+        async def close_clients():
+            await asyncio.gather(
+                *(client.close() for client in list(_open_clients)),
+                return_exceptions=True,
+            )
+
+        try:
+            self.submit(close_clients()).result(timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def submit(self, coroutine):
+        """Запускает корутину и возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+        return self.submit(coroutine).result()
+
+
+def get_event_loop_thread() -> EventLoopThread:
+    global _loop_thread
+    if _loop_thread is None:
+        with _loop_thread_lock:
+            if _loop_thread is None:
+                _loop_thread = EventLoopThread()
+    return _loop_thread
+
+
+def run(coroutine):
+    """Выполняет корутину в общем цикле событий и возвращает её результат."""
+    return get_event_loop_thread().run(coroutine)
+
+
+def _form_data(files: dict) -> aiohttp.FormData:
+    """files в формате requests: {name: (filename, value)}."""
+    form = aiohttp.FormData(default_to_multipart=True)
+    for name, (filename, value) in files.items():
+        form.add_field(name, value, filename=filename)
+    return form
+
+
+def _to_response(method: str, url: str, response, body: bytes) -> requests.Response:
+    """
+    Ответ aiohttp в виде requests.Response, чтобы raise_for_status()
+    и json() вели себя так же, как у синхронного клиента.
+    """
+    result = requests.Response()
+    result.status_code = response.status
+    result.reason = response.reason
+    result.headers = CaseInsensitiveDict(response.headers)
+    result.encoding = get_encoding_from_headers(result.headers)
+    result.url = str(response.url)
+    result.request = requests.Request(method, url).prepare()
+    result._content = body
+    return result
+
+
+class AsyncHTTPClient:
+    """
+    Общий пул соединений aiohttp с ограничением числа одновременных
+    запросов. Сессия создаётся при первом запросе внутри цикла событий.
+
+    Каждый выполняющийся запрос занимает соединение, поэтому пул
+    открывает до max(pool_size, max_in_flight) соединений: число
+    одновременных запросов ограничивает max_in_flight, а pool_size -
+    только нижняя граница размера пула.
+    """
+
+    def __init__(
+            self, pool_size: int = DEFAULT_POOL_SIZE,
+            max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+            timeout=DEFAULT_TIMEOUT, headers: dict = None,
+    ):
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._session = None
+        self._in_flight = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connect_timeout, read_timeout = self.timeout
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=max(self.pool_size, self.max_in_flight),
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout, sock_read=read_timeout,
+                ),
+                headers=self.headers,
+            )
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            _open_clients.add(self)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Принимает те же аргументы, что requests: params, data, json,
+        files, headers. Сетевые ошибки и таймауты поднимаются как
+        requests.ConnectionError и requests.Timeout.
+        """
+        session = self._get_session()
+        if kwargs.get('params'):
+            # requests skips parameters set to None, aiohttp rejects them.
+            kwargs['params'] = {
+                name: value for name, value in kwargs['params'].items()
+                if value is not None
+            }
+        files = kwargs.pop('files', None)
+        if files:
+            kwargs['data'] = _form_data(files)
+        async with self._in_flight:
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    body = await response.read()
+            except asyncio.TimeoutError as err:
+                raise requests.Timeout(f'{method} {url} timed out') from err
+            except aiohttp.ClientError as err:
+                raise requests.ConnectionError(f'{method} {url}: {err}') from err
+        return _to_response(method, url, response, body)
@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import numpy as np
+
+from geofunctions import get_distance, get_distances
+
+
+ORIGIN = (55.751244, 37.618423)
+
+
+def random_points(count: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        np.degrees(np.arcsin(rng.uniform(-1, 1, count))),
+        rng.uniform(-180, 180, count),
+    ])
+
+
+def report(title: str, count: int, seconds: float):
+    print(
+        f'{title:<22} {count:>9} точек  {seconds * 1000:10.1f} мс  '
+        f'{count / seconds:14,.0f} точек/с'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Пропускная способность пакетного расчёта расстояний'
+    )
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10_000, 1_000_000]
+    )
+    parser.add_argument(
+        '--geopy-limit', type=int, default=10_000,
+        help='максимум точек для поточечного расчёта через geopy',
+    )
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        points = random_points(size)
+        for method in ('haversine', 'vincenty'):
+            started_at = time.perf_counter()
+            get_distances(ORIGIN, points, method)
+            report(method, size, time.perf_counter() - started_at)
+        if size <= args.geopy_limit:
+            started_at = time.perf_counter()
+            for point in points:
+                get_distance(ORIGIN, point)
+            report('geopy (по одной)', size, time.perf_counter() - started_at)
+
+    sample = random_points(1000, seed=1)
+    reference = np.array([get_distance(ORIGIN, point) for point in sample])
+    vincenty_error = np.abs(get_distances(ORIGIN, sample) - reference)
+    haversine_error = np.abs(
+        get_distances(ORIGIN, sample, 'haversine') - reference
+    ) / reference
+    print(f'vincenty: макс. отклонение от geopy {vincenty_error.max() * 1e6:.3f} мм')
+    print(f'haversine: макс. отклонение от geopy {haversine_error.max():.3%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import requests
+from telegram import Update
+
+import moltin
+import tgbot
+from fake_redis import FakeRedis
+from fake_telegram import FakeBot, FakeJobQueue, make_callback, parse_action
+from load_test_data import load_pizzerias
+
+
+DEFAULT_BUDGETS_PATH = 'journey_budgets.json'
+TEXT_ADDRESS = 'Москва, ул. Тверская, д. 1'
+
+# press:<текст> нажимает кнопку, текст которой начинается с <текст>,
+# press:#<n> - n-ю кнопку на последнем экране бота с inline-клавиатурой.
+JOURNEYS = {
+    'browse_menu': {
+        'actions': [
+            '/start', 'press:>>>', 'press:<<<', 'press:#0', 'press:Назад',
+        ],
+        'state': 'HANDLE_MENU',
+    },
+    'edit_cart': {
+        'actions': [
+            '/start', 'press:#0', 'press:Купить', 'press:Корзина',
+            'press:Изменить', 'press:+', 'press:+', 'press:-',
+            'press:Готово', 'press:Очистить корзину',
+        ],
+        'state': 'HANDLE_MENU',
+    },
+    'order_pickup': {
+        'actions': [
+            '/start', 'press:#0', 'press:Купить', 'press:Корзина',
+            'press:Оформить заказ', 'text:{address}', 'press:Самовывоз',
+        ],
+        'state': 'START',
+    },
+    'order_delivery': {
+        'actions': [
+            '/start', 'press:#0', 'press:Купить', 'press:Назад', 'press:#1',
+            'press:Купить', 'press:Корзина', 'press:Оформить заказ',
+            'location:{pizzeria}', 'press:Доставка', 'precheckout', 'payment',
+        ],
+        'state': 'HANDLE_FEEDBACK',
+    },
+}
+
+
+class JourneyError(Exception):
+    pass
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(latency: float) -> tuple:
+    port = find_free_port()
+    process = subprocess.Popen(
+        [sys.executable, 'stub_server.py', '--port', str(port),
+         '--latency', str(latency), '--seed', '0'],
+        stdout=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{url}/__stats').raise_for_status()
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('stub server did not start')
+
+
+def press(bot: FakeBot, chat_id: int, button: str) -> dict:
+    message = bot.screen(chat_id)
+    if message is None:
+        raise JourneyError(f'no keyboard to press {button!r}')
+    buttons = [
+        item for row in message['reply_markup']['inline_keyboard']
+        for item in row
+    ]
+    if button.startswith('#'):
+        data = buttons[int(button[1:])]['callback_data']
+    else:
+        matching = [item for item in buttons if item['text'].startswith(button)]
+        if not matching:
+            raise JourneyError(f'no button {button!r} on the screen')
+        data = matching[0]['callback_data']
+    return make_callback(chat_id, data, message=message)
+
+
+def build_update(bot: FakeBot, chat_id: int, action: str, pizzeria: dict) -> dict:
+    kind, _, argument = action.partition(':')
+    if kind == 'press':
+        return press(bot, chat_id, argument)
+    if kind in ('precheckout', 'payment'):
+        return parse_action(chat_id, f'{kind}:{bot.invoices[chat_id]}')
+    if argument == '{address}':
+        # A new address on every run, so the geocode cache never hides
+        # the geocoder call.
+        action = f'text:{TEXT_ADDRESS}, кв. {chat_id}'
+    if argument == '{pizzeria}':
+        # A point about 300 m from the pizzeria.
+        action = f"location:{pizzeria['lat'] + 0.002},{pizzeria['lon'] + 0.002}"
+    return parse_action(chat_id, action)
+
+
+def run_journey(bot, job_queue, chat_id: int, journey: dict, pizzeria) -> float:
+    elapsed = 0.0
+    for action in journey['actions']:
+        update = Update.de_json(
+            build_update(bot, chat_id, action, pizzeria), bot
+        )
+        started_at = time.perf_counter()
+        tgbot.handle_users_reply(bot, update, job_queue).result()
+        elapsed += time.perf_counter() - started_at
+        # Background steps are not part of the latency, but their calls count.
+        tgbot.get_task_executor().wait()
+    return elapsed
+
+
+def check_state(chat_id: int, journey: dict):
+    state = tgbot.get_session_store().load(chat_id).state
+    if state != journey['state']:
+        raise JourneyError(
+            f'ended in {state} instead of {journey["state"]}, '
+            f'see the error printed above'
+        )
+
+
+class CallCounter:
+    def __init__(self, stub_url: str, bot: FakeBot, redis_client: FakeRedis):
+        self.stub_url = stub_url
+        self.bot = bot
+        self.redis = redis_client
+
+    def reset(self):
+        requests.get(f'{self.stub_url}/__reset')
+        self.bot.reset_stats()
+        self.redis.reset_stats()
+
+    def read(self) -> dict:
+        stub_calls = requests.get(f'{self.stub_url}/__stats').json()
+        geocoder_calls = sum(
+            count for endpoint, count in stub_calls.items()
+            if 'geocoder' in endpoint
+        )
+        return {
+            'moltin': sum(stub_calls.values()) - geocoder_calls,
+            'geocoder': geocoder_calls,
+            'telegram': sum(self.bot.calls.values()),
+            'redis': self.redis.round_trips,
+            'moltin_endpoints': stub_calls,
+        }
+
+
+def measure(journey, iterations, bot, job_queue, counter, chat_ids, pizzeria):
+    latencies, counts = [], []
+    for _ in range(iterations):
+        chat_id = next(chat_ids)
+        counter.reset()
+        latencies.append(
+            run_journey(bot, job_queue, chat_id, journey, pizzeria) * 1000
+        )
+        counts.append(counter.read())
+        check_state(chat_id, journey)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    allocated_before, _ = tracemalloc.get_traced_memory()
+    run_journey(bot, job_queue, next(chat_ids), journey, pizzeria)
+    allocated_after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    result = {
+        'p50': statistics.median(latencies),
+        'p99': latencies[max(int(len(latencies) * 0.99) - 1, 0)],
+        'updates': len(journey['actions']),
+        'alloc_peak_kib': (peak - allocated_before) / 1024,
+        'alloc_retained_kib': (allocated_after - allocated_before) / 1024,
+    }
+    for backend in ('moltin', 'geocoder', 'telegram', 'redis'):
+        result[backend] = max(count[backend] for count in counts)
+    result['moltin_endpoints'] = max(
+        counts, key=lambda count: count['moltin']
+    )['moltin_endpoints']
+    return result
+
+
+def check_budgets(results: dict, budgets: dict) -> list:
+    violations = []
+    for name, result in results.items():
+        for backend, budget in budgets.get(name, {}).items():
+            if result[backend] > budget:
+                violations.append(
+                    f'{name}: {backend} {result[backend]} > budget {budget} '
+                    f'{result["moltin_endpoints"] if backend == "moltin" else ""}'
+                )
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Прогоняет сценарии заказа через handle_users_reply '
+                    'с заглушками Telegram, Moltin и Redis'
+    )
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='задержка ответов заглушки Moltin, мс')
+    parser.add_argument('--journeys', nargs='+', choices=JOURNEYS,
+                        default=list(JOURNEYS))
+    parser.add_argument('--budgets', default=DEFAULT_BUDGETS_PATH,
+                        help='JSON с допустимым числом вызовов на сценарий')
+    parser.add_argument('--save-budgets', action='store_true',
+                        help='записать текущие числа вызовов как бюджет')
+    args = parser.parse_args()
+
+    stub_process, stub_url = start_stub_server(args.latency)
+    os.environ['YANDEX_GEOCODER_URL'] = f'{stub_url}/geocoder/1.x'
+    moltin.configure(base_url=stub_url)
+    redis_client = FakeRedis()
+    tgbot._database = redis_client
+    bot, job_queue = FakeBot(), FakeJobQueue()
+    counter = CallCounter(stub_url, bot, redis_client)
+    chat_ids = iter(range(10_000_000, 20_000_000))
+    pizzeria = load_pizzerias()[0]
+
+    results = {}
+    try:
+        for name in args.journeys:
+            # Warm up process caches: token, catalog, keyboards, photos.
+            chat_id = next(chat_ids)
+            run_journey(bot, job_queue, chat_id, JOURNEYS[name], pizzeria)
+            check_state(chat_id, JOURNEYS[name])
+        for name in args.journeys:
+            results[name] = measure(
+                JOURNEYS[name], args.iterations, bot, job_queue,
+                counter, chat_ids, pizzeria,
+            )
+    except JourneyError as err:
+        print(f'Сценарий {name} не прошёл: {err}')
+        sys.exit(1)
+    finally:
+        stub_process.terminate()
+
+    print(
+        f'{"сценарий":<16}{"шагов":>6}{"p50, мс":>10}{"p99, мс":>10}'
+        f'{"moltin":>8}{"геокод":>8}{"telegram":>10}{"redis":>7}'
+        f'{"пик, КиБ":>10}{"осталось, КиБ":>15}'
+    )
+    for name, result in results.items():
+        print(
+            f'{name:<16}{result["updates"]:>6}{result["p50"]:>10.1f}'
+            f'{result["p99"]:>10.1f}{result["moltin"]:>8}'
+            f'{result["geocoder"]:>8}{result["telegram"]:>10}'
+            f'{result["redis"]:>7}{result["alloc_peak_kib"]:>10.0f}'
+            f'{result["alloc_retained_kib"]:>15.0f}'
+        )
+
+    if args.save_budgets:
+        budgets = {
+            name: {backend: result[backend]
+                   for backend in ('moltin', 'geocoder', 'telegram', 'redis')}
+            for name, result in results.items()
+        }
+        with open(args.budgets, 'w', encoding='utf-8') as file:
+            json.dump(budgets, file, indent=2)
+            file.write('\n')
+        print(f'Бюджеты записаны в {args.budgets}')
+        return
+    if not os.path.exists(args.budgets):
+        print(f'Файла {args.budgets} нет, бюджеты не проверялись')
+        return
+    with open(args.budgets, encoding='utf-8') as file:
+        violations = check_budgets(results, json.load(file))
+    for violation in violations:
+        print(f'Превышен бюджет: {violation}')
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import moltin
+
+
+PRODUCT = {
+    'data': {
+        'id': 'product-1', 'type': 'product', 'name': 'Пицца',
+        'price': [{'amount': 395, 'currency': 'RUB', 'includes_tax': True}],
+    },
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like api.moltin.com
+    # Headers and body go out as separate writes; without this the
+    # keep-alive client waits for Nagle + delayed ACK on every call.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps(PRODUCT).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(call, calls: int) -> list:
+    latencies = []
+    for _ in range(calls):
+        started_at = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return latencies
+
+
+def report(title: str, latencies: list):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f'{title:<28} mean {statistics.mean(latencies):7.3f} ms  '
+        f'p50 {statistics.median(latencies):7.3f} ms  p99 {p99:7.3f} ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Сравнение задержки вызовов Moltin без пула и с пулом'
+    )
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument(
+        '--url', help='адрес уже запущенной заглушки Moltin API'
+    )
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server = start_stub_server()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def unpooled_call():
+        response = requests.get(
+            f'{base_url}/v2/products/product-1',
+            headers={'Authorization': 'Bearer token'},
+        )
+        response.raise_for_status()
+        return response.json()['data']
+
+    client = moltin.MoltinClient(base_url=base_url)
+
+    def pooled_call():
+        return client.get_product('token', 'product-1')
+
+    report('requests.get (before)', measure(unpooled_call, args.calls))
+    report('MoltinClient (after)', measure(pooled_call, args.calls))
+
+    client.close()
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
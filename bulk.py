@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+logger = logging.getLogger(__file__)
+
+
+class RateLimiter:
+    """Ограничивает частоту запросов (token bucket), потокобезопасен."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(int(rate), 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ImportJournal:
+    """
+    Журнал выполненных шагов импорта в формате JSON Lines.
+    По ключу (например, `product:<sku>`) хранит накопленное состояние
+    элемента, чтобы повторный запуск пропускал уже сделанное.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._entries.setdefault(record['key'], {}).update(
+                            record['state']
+                        )
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return dict(self._entries.get(key, {}))
+
+    def record(self, key: str, **state):
+        with self._lock:
+            self._entries.setdefault(key, {}).update(state)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(
+                    json.dumps({'key': key, 'state': state}, ensure_ascii=False)
+                    + '\n'
+                )
+
+
+def run_parallel(title: str, items: list, func, workers: int = 8) -> dict:
+    """
+    Выполняет func для каждого элемента в пуле потоков и печатает
+    отчёт о пропускной способности. Возвращает счётчики результатов.
+    """
+    counters = {'done': 0, 'skipped': 0, 'failed': 0}
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except Exception:
+                logger.exception('%s: failed on %s', title, futures[future])
+                outcome = 'failed'
+            counters[outcome or 'done'] += 1
+    elapsed = time.perf_counter() - started_at
+    print(
+        f'{title}: {len(items)} шт. за {elapsed:.1f} с '
+        f'({len(items) / elapsed if elapsed else 0:.1f} шт./с), '
+        f'выполнено {counters["done"]}, пропущено {counters["skipped"]}, '
+        f'ошибок {counters["failed"]}'
+    )
+    return counters
@@ -0,0 +1,120 @@
+"""
+Копия корзины Moltin в сессии чата (поле `cart`).
+
+Копия обновляется ответами Moltin на добавление и изменение товаров,
+поэтому для показа корзины не нужно запрашивать её заново. Сверка
+с Moltin выполняется один раз - перед выставлением счёта.
+"""
+import copy
+import logging
+
+import moltin
+from token_manager import get_access_token
+
+
+logger = logging.getLogger(__file__)
+
+
+def _fingerprint(cart: dict) -> tuple:
+    items = sorted(
+        (item['id'], item['quantity'], item['value']['amount'])
+        for item in cart['data']
+    )
+    return tuple(items), cart['meta']['display_price']['with_tax']['amount']
+
+
+def get_cart(session, chat_id) -> dict:
+    cart = session.get('cart')
+    if cart is None:
+        cart = moltin.get_cart_items(get_access_token(), chat_id)
+        session.set('cart', cart)
+    return cart
+
+
+def add_product(session, chat_id, product_id: str, quantity: int) -> dict:
+    response = moltin.add_product_to_cart(
+        get_access_token(), chat_id, product_id, quantity
+    )
+    if response.get('data'):
+        session.set('cart', response)
+    return response
+
+
+def update_item(session, chat_id, item_id: str, quantity: int) -> dict:
+    response = moltin.update_cart_item(
+        get_access_token(), chat_id, item_id, quantity
+    )
+    session.set('cart', response)
+    return response
+
+
+def clear(session, chat_id):
+    moltin.delete_cart_items(get_access_token(), chat_id)
+    session.set('cart', None)
+
+
+def verify(session, chat_id) -> dict:
+    """Сверяет копию с корзиной в Moltin и возвращает актуальную корзину."""
+    cart = moltin.get_cart_items(get_access_token(), chat_id)
+    mirrored_cart = session.get('cart')
+    if mirrored_cart is not None \
+            and _fingerprint(mirrored_cart) != _fingerprint(cart):
+        logger.warning('chat %s: cart mirror was out of date', chat_id)
+    session.set('cart', cart)
+    return cart
+
+
+def _format_price(amount) -> str:
+    return f'₽{amount:.2f}'
+
+
+def set_quantity_locally(
+        session, chat_id, item_id: str, quantity: int
+) -> dict:
+    """
+    Меняет количество товара только в копии корзины и запоминает
+    изменение до отправки в Moltin функцией flush_pending.
+    Если копии нет (например, после неудачной отправки), она
+    сначала загружается из Moltin.
+    """
+    cart = copy.deepcopy(get_cart(session, chat_id))
+    items = []
+    for item in cart['data']:
+        if item['id'] == item_id:
+            if quantity <= 0:
+                continue
+            unit_amount = item['unit_price']['amount']
+            item['quantity'] = quantity
+            item['value']['amount'] = unit_amount * quantity
+            item['meta']['display_price']['with_tax']['value'] = {
+                'amount': unit_amount * quantity,
+                'formatted': _format_price(unit_amount * quantity),
+            }
+        items.append(item)
+    cart['data'] = items
+    total = sum(item['value']['amount'] for item in items)
+    cart['meta']['display_price']['with_tax'].update(
+        amount=total, formatted=_format_price(total)
+    )
+    session.set('cart', cart)
+
+    pending_edits = dict(session.get('pending_cart_edits') or {})
+    pending_edits[item_id] = max(quantity, 0)
+    session.set('pending_cart_edits', pending_edits)
+    return cart
+
+
+def flush_pending(session, chat_id):
+    """Отправляет в Moltin итоговое количество по каждому изменённому товару."""
+    pending_edits = session.get('pending_cart_edits')
+    if not pending_edits:
+        return
+    try:
+        for item_id, quantity in pending_edits.items():
+            update_item(session, chat_id, item_id, quantity)
+    except Exception:
+        # The mirror is unreliable now, re-read the cart on next access.
+        session.set('cart', None)
+        raise
+    finally:
+        session.set('pending_cart_edits', None)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import moltin
+from token_manager import get_access_token
+
+
+logger = logging.getLogger(__file__)
+
+PAGE_SIZE = 8
+
+
+def is_visible(product: dict) -> bool:
+    return bool(product['price'][0]['amount']) and product['status'] == 'live'
+
+
+class ProductCatalog:
+    """
+    Кэш каталога товаров в памяти процесса с TTL.
+    При наличии Redis копия каталога хранится и там, чтобы все процессы
+    бота разделяли один прогретый каталог.
+    """
+
+    def __init__(
+            self, ttl: int = 600, redis_client=None,
+            redis_key: str = 'catalog:products', page_size: int = PAGE_SIZE
+    ):
+        self.ttl = ttl
+        self.page_size = page_size
+        self._redis = redis_client
+        self._redis_key = redis_key
+        self._lock = threading.Lock()
+        self._products = {}
+        self._pages = []
+        self._versioned_pages = (None, [])
+        self._loaded_at = 0
+        self.version = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'reloads': 0}
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _is_expired(self) -> bool:
+        return self._loaded_at + self.ttl < time.time()
+
+    def _fetch_products(self) -> list:
+        return list(moltin.iter_products(get_access_token()))
+
+    def _read_shared_copy(self):
+        if self._redis is None:
+            return None
+        raw_catalog = self._redis.get(self._redis_key)
+        return json.loads(raw_catalog) if raw_catalog else None
+
+    def _write_shared_copy(self, catalog: dict):
+        if self._redis is not None:
+            self._redis.set(
+                self._redis_key, json.dumps(catalog), ex=self.ttl
+            )
+
+    def _build_pages(self, products: list) -> list:
+        visible = [product for product in products if is_visible(product)]
+        total_pages = max(
+            (len(visible) + self.page_size - 1) // self.page_size, 1
+        )
+        pages = []
+        for number in range(total_pages):
+            offset = number * self.page_size
+            pages.append({
+                'data': visible[offset:offset + self.page_size],
+                'meta': {
+                    'page': {
+                        'limit': self.page_size,
+                        'offset': offset,
+                        'current': number + 1,
+                        'total': total_pages,
+                    },
+                    'results': {'total': len(visible)},
+                },
+            })
+        return pages
+
+    def _apply(self, catalog: dict):
+        self._products = {
+            product['id']: product for product in catalog['products']
+        }
+        self._pages = self._build_pages(catalog['products'])
+        self._versioned_pages = (catalog['version'], self._pages)
+        self._loaded_at = catalog['loaded_at']
+        self.version = catalog['version']
+
+    def _reload(self):
+        catalog = self._read_shared_copy()
+        if catalog is None or catalog['loaded_at'] + self.ttl < time.time():
+            products = self._fetch_products()
+            catalog = {
+                'products': products,
+                'loaded_at': time.time(),
+                'version': hashlib.sha1(
+                    json.dumps(products, sort_keys=True).encode()
+                ).hexdigest(),
+            }
+            self._write_shared_copy(catalog)
+        self._apply(catalog)
+        self._count('reloads')
+
+    def _ensure_loaded(self) -> bool:
+        """Возвращает True, если каталог отдан из памяти без загрузки."""
+        if not self._is_expired():
+            return True
+        with self._lock:
+            if not self._is_expired():
+                return True
+            if not self._products:
+                self._reload()
+                return False
+            try:
+                self._reload()
+            except Exception as err:
+                # Serve the stale copy rather than failing the user's tap.
+                logger.warning('catalog reload failed: %s', err)
+                self._count('stale')
+                self._loaded_at = time.time() - self.ttl + 30
+            return False
+
+    def invalidate(self):
+        """
+        Сбрасывает каталог этого процесса и общую копию в Redis.
+        Другие процессы бота продолжают отдавать свою копию из памяти,
+        пока у неё не истечёт ttl.
+        """
+        with self._lock:
+            self._loaded_at = 0
+            if self._redis is not None:
+                self._redis.delete(self._redis_key)
+
+    def get_page(self, offset: int = 0) -> dict:
+        self._count('hits' if self._ensure_loaded() else 'misses')
+        number = min(offset // self.page_size, len(self._pages) - 1)
+        return self._pages[max(number, 0)]
+
+    def get_pages(self) -> tuple:
+        """Возвращает версию каталога и все страницы меню этой версии."""
+        self._count('hits' if self._ensure_loaded() else 'misses')
+        return self._versioned_pages
+
+    def get_product(self, product_id: str) -> dict:
+        warm = self._ensure_loaded()
+        product = self._products.get(product_id)
+        if product is None:
+            self._count('misses')
+            return moltin.get_product(get_access_token(), product_id)
+        self._count('hits' if warm else 'misses')
+        return product
@@ -0,0 +1,132 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__file__)
+
+
+class ChatScheduler:
+    """
+    Распределяет задачи по дорожкам (lanes) по хэшу chat_id.
+    Задачи одного чата выполняются строго по порядку в одной дорожке,
+    разные чаты обрабатываются параллельно. Когда очередь дорожки
+    заполнена, submit сразу бросает queue.Full: он вызывается из потока
+    диспетчера и не должен его блокировать.
+    """
+
+    def __init__(self, lanes: int = 4, queue_size: int = 100):
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(lanes)]
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+            'queue_wait_total': 0.0, 'queue_wait_max': 0.0,
+            'handler_time_total': 0.0, 'handler_time_max': 0.0,
+        }
+        self._threads = []
+        for lane in self._queues:
+            thread = threading.Thread(
+                target=self._work, args=(lane,), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def lane_for(self, chat_id) -> int:
+        return zlib.crc32(str(chat_id).encode()) % len(self._queues)
+
+    def submit(self, chat_id, func, *args, **kwargs) -> Future:
+        future = Future()
+        task = (future, func, args, kwargs, time.perf_counter())
+        try:
+            self._queues[self.lane_for(chat_id)].put_nowait(task)
+        except queue.Full:
+            self._add_stats(rejected=1)
+            raise
+        self._add_stats(submitted=1)
+        return future
+
+    def _work(self, lane: queue.Queue):
+        while True:
+            task = lane.get()
+            if task is None:
+                return
+            future, func, args, kwargs, submitted_at = task
+            started_at = time.perf_counter()
+            try:
+                future.set_result(func(*args, **kwargs))
+                outcome = 'completed'
+            except Exception as err:
+                logger.exception('scheduled task failed')
+                future.set_exception(err)
+                outcome = 'failed'
+            finished_at = time.perf_counter()
+            self._add_stats(
+                queue_wait=started_at - submitted_at,
+                handler_time=finished_at - started_at,
+                **{outcome: 1},
+            )
+
+    def _add_stats(self, queue_wait=None, handler_time=None, **counters):
+        with self._stats_lock:
+            for name, value in counters.items():
+                self._stats[name] += value
+            for name, value in (
+                    ('queue_wait', queue_wait), ('handler_time', handler_time)
+            ):
+                if value is not None:
+                    self._stats[f'{name}_total'] += value
+                    self._stats[f'{name}_max'] = max(
+                        self._stats[f'{name}_max'], value
+                    )
+
+    def queue_depths(self) -> list:
+        return [lane.qsize() for lane in self._queues]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depths'] = self.queue_depths()
+        return stats
+
+    def stop(self):
+        for lane in self._queues:
+            lane.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class Debouncer:
+    """
+    Откладывает вызов на delay секунд после последнего schedule
+    с тем же ключом: серия быстрых событий даёт один вызов.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._timers = {}
+
+    def schedule(self, key, func, *args):
+        def fire():
+            with self._lock:
+                if self._timers.get(key) is timer:
+                    del self._timers[key]
+            func(*args)
+
+        timer = threading.Timer(self.delay, fire)
+        timer.daemon = True
+        with self._lock:
+            previous_timer = self._timers.get(key)
+            if previous_timer is not None:
+                previous_timer.cancel()
+            self._timers[key] = timer
+        timer.start()
+
+    def cancel(self, key):
+        with self._lock:
+            timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
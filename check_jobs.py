@@ -0,0 +1,98 @@
+"""
+Проверка планировщика задач: прогоняет JobScheduler через одни и те же
+сценарии на FakeRedis и, если задан --redis-url, на настоящем Redis,
+где CLAIM_SCRIPT выполняется как Lua. Результаты должны совпасть
+с ожидаемыми; иначе команда завершается с ошибкой.
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+
+import redis
+
+from fake_redis import FakeRedis
+from job_scheduler import JobScheduler
+
+
+def claimed_kwargs(scheduler: JobScheduler) -> list:
+    return [
+        json.loads(raw_job)['kwargs'] if raw_job is not None else None
+        for _, raw_job in scheduler.claim()
+    ]
+
+
+def run_scenarios(redis_client, key_prefix: str) -> dict:
+    def make_scheduler(**kwargs):
+        return JobScheduler(redis_client, key_prefix=key_prefix, **kwargs)
+
+    observed = {}
+    scheduler = make_scheduler(batch_size=2, visibility_timeout=3600)
+    for number in range(3):
+        scheduler.schedule('job', number=number)
+    scheduler.schedule('job', delay=3600, number='later')
+    observed['batches'] = [claimed_kwargs(scheduler) for _ in range(3)]
+
+    expiring = make_scheduler(batch_size=10, visibility_timeout=0)
+    job_id = expiring.schedule('job', number='expired')
+    observed['first_claim'] = claimed_kwargs(expiring)
+    time.sleep(0.01)
+    observed['reclaimed'] = claimed_kwargs(expiring)
+
+    expiring.ack(job_id)
+    time.sleep(0.01)
+    observed['after_ack'] = claimed_kwargs(expiring)
+
+    job_id = expiring.schedule('job', number='acked elsewhere')
+    redis_client.hdel(f'{key_prefix}data', job_id)
+    observed['missing_data'] = claimed_kwargs(expiring)
+    return observed
+
+
+EXPECTED = {
+    'batches': [[{'number': 0}, {'number': 1}], [{'number': 2}], []],
+    'first_claim': [{'number': 'expired'}],
+    'reclaimed': [{'number': 'expired'}],
+    'after_ack': [],
+    'missing_data': [None],
+}
+
+
+def check(name: str, redis_client, key_prefix: str) -> list:
+    observed = run_scenarios(redis_client, key_prefix)
+    return [
+        f'{name}: {scenario}: got {observed[scenario]}, expected {expected}'
+        for scenario, expected in EXPECTED.items()
+        if observed[scenario] != expected
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Сверяет работу JobScheduler на FakeRedis и на Redis'
+    )
+    parser.add_argument('--redis-url',
+                        help='например, redis://localhost:6379/15')
+    args = parser.parse_args()
+
+    errors = check('FakeRedis', FakeRedis(), 'jobs:')
+    if args.redis_url:
+        redis_client = redis.Redis.from_url(args.redis_url)
+        key_prefix = f'check_jobs:{uuid.uuid4().hex}:'
+        try:
+            errors += check('Redis', redis_client, key_prefix)
+        finally:
+            redis_client.delete(
+                *(f'{key_prefix}{name}' for name in ('due', 'processing', 'data'))
+            )
+
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+    print('OK' if args.redis_url else 'OK, настоящий Redis не проверялся')
+
+
+if __name__ == '__main__':
+    main()
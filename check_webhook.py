@@ -0,0 +1,115 @@
+"""
+Проверка вебхука: поднимает WebhookServer на свободном порту, отправляет
+на него обновления через fake_telegram.post_update и сверяет, что
+диспетчер получил их без искажений, а запросы с неверным секретом
+отклонены. Завершается с ошибкой, если что-то не совпало.
+"""
+import queue
+import sys
+import urllib.error
+
+from telegram import Update
+
+from fake_telegram import FakeBot, parse_action, post_update
+from webhook import WebhookServer
+
+
+SECRET = 'webhook-secret'
+CHAT_ID = 100500
+ACTIONS = ('/start', 'callback:menu', 'text:Москва, Тверская 1',
+           'location:55.75,37.61')
+
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.bot = FakeBot()
+        self.updates = queue.Queue()
+
+    def process_update(self, update):
+        self.updates.put(update)
+
+
+def post(url: str, update: dict, secret: str = None) -> int:
+    try:
+        return post_update(url, update, secret=secret)
+    except urllib.error.HTTPError as err:
+        return err.code
+
+
+def describe(update) -> tuple:
+    if update.callback_query:
+        return 'callback', update.callback_query.data
+    message = update.message
+    if message.location:
+        return 'location', (message.location.latitude,
+                            message.location.longitude)
+    return 'text', message.text
+
+
+def check_round_trip(dispatcher, base_url: str) -> list:
+    errors = []
+    for action in ACTIONS:
+        for url, secret in (
+                (f'{base_url}/{SECRET}', None),
+                (base_url, SECRET),
+        ):
+            sent = parse_action(CHAT_ID, action)
+            status = post(url, sent, secret=secret)
+            if status != 200:
+                errors.append(f'{action}: HTTP {status}, expected 200')
+                continue
+            try:
+                received = dispatcher.updates.get(timeout=5)
+            except queue.Empty:
+                errors.append(f'{action}: update did not reach dispatcher')
+                continue
+            expected = describe(Update.de_json(sent, dispatcher.bot))
+            if received.update_id != sent['update_id'] \
+                    or describe(received) != expected:
+                errors.append(f'{action}: got {describe(received)}, '
+                              f'expected {expected}')
+    return errors
+
+
+def check_rejected(server, dispatcher, base_url: str) -> list:
+    errors = []
+    # urllib only sends ASCII paths, so check a non-ASCII one directly.
+    if server.is_authorized(f'{server.path}/секрет', {}):
+        errors.append('non-ASCII path accepted')
+    update = parse_action(CHAT_ID, '/start')
+    for url, secret in (
+            (f'{base_url}/wrong-secret', None),
+            (base_url, 'wrong-secret'),
+            (base_url, 'sécret'),
+            (base_url, None),
+    ):
+        status = post(url, update, secret=secret)
+        if status != 403:
+            errors.append(f'{url} secret={secret!r}: HTTP {status}, '
+                          f'expected 403')
+    if not dispatcher.updates.empty():
+        errors.append('rejected update reached dispatcher')
+    return errors
+
+
+def main():
+    dispatcher = RecordingDispatcher()
+    server = WebhookServer(dispatcher, SECRET, port=0, workers=2)
+    server.start()
+    host, port = server.server_address
+    base_url = f'http://{host}:{port}{server.path}'
+    try:
+        errors = check_round_trip(dispatcher, base_url)
+        errors += check_rejected(server, dispatcher, base_url)
+    finally:
+        server.stop()
+
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+    print(f'OK: {len(ACTIONS) * 2} updates delivered, forged requests rejected')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import collections
+import threading
+import time
+
+from job_scheduler import CLAIM_SCRIPT
+
+
+COMMANDS = (
+    'get', 'mget', 'set', 'delete', 'expire', 'hget', 'hgetall', 'hset', 'hdel',
+    'zadd', 'zrem', 'evalsha',
+)
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode('utf-8')
+
+
+class FakeRedis:
+    """
+    Redis в памяти процесса для бенчмарков: только команды, которые
+    использует бот. Считает обращения к серверу: каждая команда вне
+    pipeline и каждый pipeline.execute() - один round trip.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expires = {}
+        self.commands = collections.Counter()
+        self.round_trips = 0
+
+    def __getattr__(self, command: str):
+        if command not in COMMANDS:
+            raise AttributeError(command)
+        return lambda *args, **kwargs: self.execute_command(
+            command, *args, **kwargs
+        )
+
+    def execute_command(self, command: str, *args, **kwargs):
+        with self._lock:
+            self.commands[command] += 1
+            self.round_trips += 1
+            return getattr(self, f'_{command}')(*args, **kwargs)
+
+    def execute_pipeline(self, commands: list) -> list:
+        with self._lock:
+            self.round_trips += 1
+            results = []
+            for command, args, kwargs in commands:
+                self.commands[command] += 1
+                results.append(getattr(self, f'_{command}')(*args, **kwargs))
+            return results
+
+    def reset_stats(self):
+        with self._lock:
+            self.commands.clear()
+            self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script: str):
+        """
+        Lua не выполняется: поддержан только CLAIM_SCRIPT планировщика
+        задач, повторённый на Python. Вызов скрипта - один round trip,
+        как EVALSHA в Redis.
+        """
+        if script != CLAIM_SCRIPT:
+            raise ValueError(
+                'FakeRedis can only register job_scheduler.CLAIM_SCRIPT'
+            )
+        return lambda keys=(), args=(): self.execute_command(
+            'evalsha', keys, args
+        )
+
+    def _get_value(self, key: bytes):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return self._data.get(key)
+
+    def _get_hash(self, key: bytes) -> dict:
+        value = self._get_value(key)
+        return value if isinstance(value, dict) else {}
+
+    def _get(self, key):
+        value = self._get_value(_encode(key))
+        return value if isinstance(value, bytes) else None
+
+    def _mget(self, *keys):
+        return [self._get(key) for key in keys]
+
+    def _set(self, key, value, ex=None, nx=False):
+        key = _encode(key)
+        if nx and self._get_value(key) is not None:
+            return None
+        self._data[key] = _encode(value)
+        self._expires.pop(key, None)
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        return True
+
+    def _delete(self, *keys):
+        deleted = 0
+        for key in map(_encode, keys):
+            if self._get_value(key) is not None:
+                deleted += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return deleted
+
+    def _expire(self, key, seconds):
+        key = _encode(key)
+        if self._get_value(key) is None:
+            return False
+        self._expires[key] = time.monotonic() + seconds
+        return True
+
+    def _hget(self, key, field):
+        return self._get_hash(_encode(key)).get(_encode(field))
+
+    def _hgetall(self, key) -> dict:
+        return dict(self._get_hash(_encode(key)))
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        key = _encode(key)
+        fields = self._get_hash(key)
+        added = sum(_encode(name) not in fields for name in items)
+        fields.update(
+            (_encode(name), _encode(item)) for name, item in items.items()
+        )
+        self._data[key] = fields
+        return added
+
+    def _hdel(self, key, *fields):
+        hash_fields = self._get_hash(_encode(key))
+        return sum(
+            hash_fields.pop(_encode(field), None) is not None
+            for field in fields
+        )
+
+    def _get_sorted_set(self, key: bytes) -> dict:
+        value = self._get_value(key)
+        return value if isinstance(value, dict) else {}
+
+    def _zadd(self, key, mapping: dict):
+        key = _encode(key)
+        members = self._get_sorted_set(key)
+        added = sum(_encode(member) not in members for member in mapping)
+        members.update(
+            (_encode(member), float(score)) for member, score in mapping.items()
+        )
+        self._data[key] = members
+        return added
+
+    @staticmethod
+    def _range_by_score(sorted_set: dict, max_score: float, count: int) -> list:
+        members = sorted(
+            (score, member) for member, score in sorted_set.items()
+            if score <= max_score
+        )
+        return [member for _, member in members[:count]]
+
+    def _evalsha(self, keys, args) -> list:
+        due_key, processing_key, data_key = map(_encode, keys)
+        now, count, deadline = float(args[0]), int(args[1]), float(args[2])
+        due = self._get_sorted_set(due_key)
+        processing = self._get_sorted_set(processing_key)
+        for member in self._range_by_score(processing, now, count):
+            del processing[member]
+            due[member] = now
+        claimed_ids = self._range_by_score(due, now, count)
+        for member in claimed_ids:
+            del due[member]
+            processing[member] = deadline
+        self._data[due_key], self._data[processing_key] = due, processing
+        data = self._get_hash(data_key)
+        claimed = []
+        for member in claimed_ids:
+            claimed += [member, data.get(member)]
+        return claimed
+
+    def _zrem(self, key, *members):
+        sorted_set = self._get_sorted_set(_encode(key))
+        return sum(
+            sorted_set.pop(_encode(member), None) is not None
+            for member in members
+        )
+
+
+class FakePipeline:
+    def __init__(self, redis_client: FakeRedis):
+        self._redis = redis_client
+        self._commands = []
+
+    def __getattr__(self, command: str):
+        if command not in COMMANDS:
+            raise AttributeError(command)
+
+        def queue_command(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue_command
+
+    def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        if not commands:
+            return []
+        return self._redis.execute_pipeline(commands)
@@ -0,0 +1,308 @@
+import argparse
+import collections
+import itertools
+import json
+import threading
+import time
+import urllib.request
+import zlib
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from webhook import SECRET_HEADER
+
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(chat_id: int) -> dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'}
+
+
+def _message(chat_id: int, **fields) -> dict:
+    return {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': _user(chat_id),
+        **fields,
+    }
+
+
+def make_command(chat_id: int, command: str = '/start') -> dict:
+    return {
+        'update_id': next(_update_ids),
+        'message': _message(
+            chat_id, text=command,
+            entities=[{'type': 'bot_command', 'offset': 0,
+                       'length': len(command)}],
+        ),
+    }
+
+
+def make_text(chat_id: int, text: str) -> dict:
+    return {'update_id': next(_update_ids), 'message': _message(chat_id, text=text)}
+
+
+def make_location(chat_id: int, latitude: float, longitude: float) -> dict:
+    return {
+        'update_id': next(_update_ids),
+        'message': _message(
+            chat_id, location={'latitude': latitude, 'longitude': longitude}
+        ),
+    }
+
+
+def make_callback(
+        chat_id: int, data: str, message_id: int = None,
+        message: dict = None
+) -> dict:
+    bot_message = message or _message(chat_id, text='...')
+    bot_message['from'] = {'id': 1, 'is_bot': True, 'first_name': 'PizzaBot'}
+    if message_id is not None:
+        bot_message['message_id'] = message_id
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': _user(chat_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': bot_message,
+        },
+    }
+
+
+def make_pre_checkout(chat_id: int, total_amount: int) -> dict:
+    return {
+        'update_id': next(_update_ids),
+        'pre_checkout_query': {
+            'id': str(next(_update_ids)),
+            'from': _user(chat_id),
+            'currency': 'RUB',
+            'total_amount': total_amount,
+            'invoice_payload': str(chat_id),
+        },
+    }
+
+
+def make_successful_payment(chat_id: int, total_amount: int) -> dict:
+    return {
+        'update_id': next(_update_ids),
+        'message': _message(chat_id, successful_payment={
+            'currency': 'RUB',
+            'total_amount': total_amount,
+            'invoice_payload': str(chat_id),
+            'telegram_payment_charge_id': f'tg-{next(_update_ids)}',
+            'provider_payment_charge_id': f'provider-{next(_update_ids)}',
+        }),
+    }
+
+
+def parse_action(chat_id: int, action: str) -> dict:
+    """
+    Превращает описание действия в обновление Telegram:
+    `/start`, `callback:<data>`, `text:<текст>`, `location:<lat>,<lon>`,
+    `precheckout:<сумма в копейках>`, `payment:<сумма в копейках>`.
+    """
+    kind, _, argument = action.partition(':')
+    if kind.startswith('/'):
+        return make_command(chat_id, kind)
+    if kind == 'callback':
+        return make_callback(chat_id, argument)
+    if kind == 'text':
+        return make_text(chat_id, argument)
+    if kind == 'location':
+        latitude, longitude = argument.split(',')
+        return make_location(chat_id, float(latitude), float(longitude))
+    if kind == 'precheckout':
+        return make_pre_checkout(chat_id, int(argument))
+    if kind == 'payment':
+        return make_successful_payment(chat_id, int(argument))
+    raise ValueError(f'Unknown action: {action}')
+
+
+def _markup_as_dict(reply_markup):
+    return reply_markup.to_dict() if reply_markup else None
+
+
+class FakeBot:
+    """
+    Заменяет telegram.Bot в бенчмарках: ничего не отправляет, а хранит
+    сообщения каждого чата и считает вызовы методов Bot API.
+    latency - сколько секунд имитировать каждый вызов.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._messages = collections.defaultdict(dict)
+        self.calls = collections.Counter()
+        self.invoices = {}
+        self.id = 1
+        self.username = 'PizzaBot'
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _store(self, method: str, chat_id, message_id=None, **fields):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+            messages = self._messages[chat_id]
+            if message_id is None:
+                message = _message(chat_id)
+                message['from'] = {
+                    'id': self.id, 'is_bot': True, 'first_name': self.username,
+                }
+            elif message_id in messages:
+                message = messages[message_id]
+            else:
+                raise BadRequest('Message to edit not found')
+            message.update(fields)
+            messages[message['message_id']] = message
+            return Message.de_json(json.loads(json.dumps(message)), self)
+
+    def _count(self, method: str):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+
+    def screen(self, chat_id) -> dict:
+        """Последнее сообщение бота в чате с inline-клавиатурой."""
+        with self._lock:
+            for message in reversed(list(self._messages[chat_id].values())):
+                if 'inline_keyboard' in (message.get('reply_markup') or {}):
+                    return json.loads(json.dumps(message))
+        return None
+
+    def send_message(
+            self, chat_id, text, parse_mode=None, reply_markup=None, **kwargs
+    ):
+        return self._store(
+            'send_message', chat_id, text=text,
+            reply_markup=_markup_as_dict(reply_markup),
+        )
+
+    def send_photo(
+            self, chat_id, photo, caption=None, reply_markup=None,
+            parse_mode=None, **kwargs
+    ):
+        if isinstance(photo, str) and photo.startswith('http'):
+            photo = f'photo-{zlib.crc32(photo.encode())}'
+        return self._store(
+            'send_photo', chat_id, caption=caption,
+            photo=[{'file_id': photo, 'width': 600, 'height': 600}],
+            reply_markup=_markup_as_dict(reply_markup),
+        )
+
+    def edit_message_text(
+            self, text, chat_id=None, message_id=None, parse_mode=None,
+            reply_markup=None, **kwargs
+    ):
+        return self._store(
+            'edit_message_text', chat_id, message_id, text=text,
+            reply_markup=_markup_as_dict(reply_markup),
+        )
+
+    def edit_message_caption(
+            self, chat_id=None, message_id=None, caption=None,
+            reply_markup=None, parse_mode=None, **kwargs
+    ):
+        return self._store(
+            'edit_message_caption', chat_id, message_id, caption=caption,
+            reply_markup=_markup_as_dict(reply_markup),
+        )
+
+    def edit_message_media(
+            self, chat_id=None, message_id=None, media=None,
+            reply_markup=None, **kwargs
+    ):
+        return self._store(
+            'edit_message_media', chat_id, message_id, caption=media.caption,
+            photo=[{'file_id': media.media, 'width': 600, 'height': 600}],
+            reply_markup=_markup_as_dict(reply_markup),
+        )
+
+    def edit_message_reply_markup(
+            self, chat_id=None, message_id=None, reply_markup=None, **kwargs
+    ):
+        return self._store(
+            'edit_message_reply_markup', chat_id, message_id,
+            reply_markup=_markup_as_dict(reply_markup),
+        )
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        self._count('delete_message')
+        with self._lock:
+            self._messages[chat_id].pop(message_id, None)
+        return True
+
+    def send_location(self, chat_id, latitude=None, longitude=None, **kwargs):
+        return self._store(
+            'send_location', chat_id,
+            location={'latitude': latitude, 'longitude': longitude},
+        )
+
+    def send_invoice(self, chat_id, title, description, payload,
+                     provider_token, start_parameter, currency, prices,
+                     **kwargs):
+        with self._lock:
+            self.invoices[chat_id] = sum(price.amount for price in prices)
+        return self._store('send_invoice', chat_id, text=title)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self._count('answer_callback_query')
+        return True
+
+    def answer_pre_checkout_query(self, pre_checkout_query_id, ok, **kwargs):
+        self._count('answer_pre_checkout_query')
+        return True
+
+
+class FakeJobQueue:
+    """Запоминает отложенные задачи вместо того, чтобы их выполнять."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, context=None, name=None):
+        self.jobs.append((callback, when, context))
+
+
+def post_update(url: str, update: dict, secret: str = None) -> int:
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode(), headers=headers, method='POST'
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Отправляет обновления Telegram на локальный вебхук бота'
+    )
+    parser.add_argument('url', help='например, http://127.0.0.1:8443/telegram/<secret>')
+    parser.add_argument('actions', nargs='+', help='/start, callback:menu, '
+                        'text:Москва, Тверская 1, location:55.75,37.61')
+    parser.add_argument('--chat-id', type=int, default=100500)
+    parser.add_argument('--delay', type=float, default=0.5)
+    args = parser.parse_args()
+
+    for action in args.actions:
+        update = parse_action(args.chat_id, action)
+        status = post_update(args.url, update)
+        print(f'{action}: HTTP {status}')
+        time.sleep(args.delay)
+
+
+if __name__ == '__main__':
+    main()
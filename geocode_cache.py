@@ -0,0 +1,122 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import Future
+
+import redis
+from dotenv import load_dotenv
+
+import moltin
+from geofunctions import fetch_coordinates
+from token_manager import get_access_token
+
+
+ABBREVIATIONS = {
+    'г': 'город',
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'просп': 'проспект',
+    'пр-кт': 'проспект',
+    'пер': 'переулок',
+    'пр-д': 'проезд',
+    'наб': 'набережная',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'туп': 'тупик',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'д': 'дом',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+}
+
+
+def normalize_address(address: str) -> str:
+    words = re.findall(r'\w+(?:-\w+)*', address.lower().replace('ё', 'е'))
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+class GeocodeCache:
+    """
+    Кэш геокодера в Redis по нормализованному адресу.
+    Ненайденные адреса тоже кэшируются (на меньший срок), а одновременные
+    запросы одного адреса объединяются в один вызов геокодера.
+    """
+
+    def __init__(
+            self, redis_client, geocode=fetch_coordinates,
+            ttl: int = 30 * 24 * 3600, negative_ttl: int = 24 * 3600,
+            key_prefix: str = 'geocode:'
+    ):
+        self._redis = redis_client
+        self._geocode = geocode
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _key(self, address: str) -> str:
+        return f'{self._key_prefix}{normalize_address(address)}'
+
+    def get_coordinates(self, address: str):
+        key = self._key(address)
+        cached = self._redis.get(key)
+        if cached is not None:
+            coordinates = json.loads(cached)
+            return tuple(coordinates) if coordinates else None
+
+        with self._lock:
+            lookup = self._in_flight.get(key)
+            is_leader = lookup is None
+            if is_leader:
+                lookup = self._in_flight[key] = Future()
+        if not is_leader:
+            return lookup.result()
+
+        try:
+            coordinates = self._geocode(address)
+            self._redis.set(
+                key, json.dumps(coordinates),
+                ex=self.ttl if coordinates else self.negative_ttl,
+            )
+            lookup.set_result(coordinates)
+        except Exception as err:
+            lookup.set_exception(err)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return lookup.result()
+
+    def seed(self, address_entries) -> int:
+        seeded = 0
+        for entry in address_entries:
+            address = entry.get('address')
+            if not address or address == 'not provided':
+                continue
+            coordinates = (str(entry['lat']), str(entry['lon']))
+            if self._redis.set(
+                    self._key(address), json.dumps(coordinates),
+                    ex=self.ttl, nx=True
+            ):
+                seeded += 1
+        return seeded
+
+
+def main():
+    load_dotenv()
+    geocode_cache = GeocodeCache(redis.Redis.from_url(os.environ['REDIS_URL']))
+    address_entries = moltin.iter_flow_entries(
+        get_access_token(), 'customer_address'
+    )
+    seeded = geocode_cache.seed(address_entries)
+    print(f'Добавлено адресов в кэш геокодера: {seeded}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import os
+
+import metrics
+from async_http import (
+    AsyncHTTPClient, DEFAULT_MAX_IN_FLIGHT, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT,
+)
+
+
+DEFAULT_GEOCODER_URL = 'https://geocode-maps.yandex.ru/1.x'
+
+
+class AsyncGeocoder(AsyncHTTPClient):
+    """Асинхронный клиент Яндекс.Геокодера с общим пулом соединений."""
+
+    def __init__(
+            self, base_url: str = None, pool_size: int = DEFAULT_POOL_SIZE,
+            max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, timeout=DEFAULT_TIMEOUT
+    ):
+        super().__init__(pool_size, max_in_flight, timeout)
+        self.base_url = base_url
+
+    async def fetch_coordinates(self, address, apikey=None):
+        base_url = self.base_url or os.getenv(
+            'YANDEX_GEOCODER_URL', DEFAULT_GEOCODER_URL
+        )
+        with metrics.track('geocoder', 'geocode'):
+            response = await self.request(
+                'GET', base_url, params={
+                    "geocode": address,
+                    "apikey": apikey or os.getenv('YANDEX_GEOCODER_APIKEY'),
+                    "format": "json",
+                }
+            )
+            response.raise_for_status()
+        found_places = response.json()['response']['GeoObjectCollection'][
+            'featureMember']
+
+        if not found_places:
+            return None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+        return lat, lon
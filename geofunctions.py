@@ -1,28 +1,166 @@
-import requests
-import os
+import math
+import numpy as np
 from geopy import distance
 
+import async_http
+import metrics
+from geocoder_async import AsyncGeocoder
+
+
+EARTH_MEAN_RADIUS = 6371.0088  # km
+WGS84_A = 6378.137  # km
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+_geocoder = None
+
+
+def get_geocoder() -> AsyncGeocoder:
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = AsyncGeocoder()
+    return _geocoder
 
-def fetch_coordinates(address, apikey=os.getenv('YANDEX_GEOCODER_APIKEY')):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(
-        base_url, params={
-            "geocode": address,
-            "apikey": apikey,
-            "format": "json",
-        }
-        )
-    response.raise_for_status()
-    found_places = response.json()['response']['GeoObjectCollection'][
-        'featureMember']
 
-    if not found_places:
-        return None
+def configure(**geocoder_kwargs) -> AsyncGeocoder:
+    """
+    Пересоздаёт общий клиент геокодера, например, чтобы задать число
+    одновременных запросов, как moltin.configure.
+    """
+    global _geocoder
+    old_geocoder, _geocoder = _geocoder, AsyncGeocoder(**geocoder_kwargs)
+    if old_geocoder is not None:
+        async_http.run(old_geocoder.close())
+    return _geocoder
 
-    most_relevant = found_places[0]
-    lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-    return lat, lon
+
+def fetch_coordinates(address, apikey=None):
+    return async_http.run(get_geocoder().fetch_coordinates(address, apikey))
 
 
 def get_distance(location1: tuple, location2: tuple) -> float:
-    return distance.distance(location1, location2).km
+    with metrics.track('geo', 'geopy'):
+        return distance.distance(location1, location2).km
+
+
+def to_unit_vector(location: tuple) -> tuple:
+    lat, lon = (math.radians(float(coordinate)) for coordinate in location)
+    return (
+        math.cos(lat) * math.cos(lon),
+        math.cos(lat) * math.sin(lon),
+        math.sin(lat),
+    )
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    hav = np.sin((lat2 - lat1) / 2) ** 2 \
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_MEAN_RADIUS * np.arcsin(np.sqrt(np.clip(hav, 0, 1)))
+
+
+def _vincenty(lat1, lon1, lat2, lon2, max_iterations=200, tolerance=1e-12):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(lat1, lon1, lat2, lon2)
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = (
+        np.ravel(array) for array in (lat1, lon1, lat2, lon2)
+    )
+    reduced_lat1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    reduced_lat2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_u2, cos_u2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+    lon_diff = lon2 - lon1
+    lambda_ = lon_diff.copy()
+    sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m = (
+        np.zeros_like(lon_diff) for _ in range(6)
+    )
+    # Only pairs that have not converged yet take part in each iteration.
+    active = np.arange(lon_diff.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            if not active.size:
+                break
+            sin_lambda = np.sin(lambda_[active])
+            cos_lambda = np.cos(lambda_[active])
+            su1, cu1 = sin_u1[active], cos_u1[active]
+            su2, cu2 = sin_u2[active], cos_u2[active]
+            sin_sigma[active] = np.hypot(
+                cu2 * sin_lambda, cu1 * su2 - su1 * cu2 * cos_lambda
+            )
+            cos_sigma[active] = su1 * su2 + cu1 * cu2 * cos_lambda
+            sigma[active] = np.arctan2(sin_sigma[active], cos_sigma[active])
+            sin_alpha[active] = np.where(
+                sin_sigma[active] == 0, 0,
+                cu1 * cu2 * sin_lambda / sin_sigma[active]
+            )
+            cos2_alpha[active] = 1 - sin_alpha[active] ** 2
+            cos_2sigma_m[active] = np.where(
+                cos2_alpha[active] == 0, 0,
+                cos_sigma[active] - 2 * su1 * su2 / cos2_alpha[active]
+            )
+            c = WGS84_F / 16 * cos2_alpha[active] \
+                * (4 + WGS84_F * (4 - 3 * cos2_alpha[active]))
+            previous_lambda = lambda_[active]
+            lambda_[active] = lon_diff[active] \
+                + (1 - c) * WGS84_F * sin_alpha[active] * (
+                    sigma[active] + c * sin_sigma[active] * (
+                        cos_2sigma_m[active] + c * cos_sigma[active]
+                        * (-1 + 2 * cos_2sigma_m[active] ** 2)
+                    )
+                )
+            active = active[
+                ~(np.abs(lambda_[active] - previous_lambda) < tolerance)
+            ]
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    a = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    b = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = b * sin_sigma * (
+        cos_2sigma_m + b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2)
+            * (-3 + 4 * cos_2sigma_m ** 2)
+        )
+    )
+    distances = WGS84_B * a * (sigma - delta_sigma)
+    # Vincenty does not converge for nearly antipodal points, those few
+    # pairs are computed one by one with geopy.
+    failed = np.union1d(active, np.nonzero(~np.isfinite(distances))[0])
+    for index in failed:
+        distances[index] = get_distance(
+            np.degrees((lat1[index], lon1[index])),
+            np.degrees((lat2[index], lon2[index])),
+        )
+    return distances.reshape(shape)
+
+
+_DISTANCE_METHODS = {'haversine': _haversine, 'vincenty': _vincenty}
+
+
+def get_distances(origin: tuple, coords, method='vincenty') -> np.ndarray:
+    """
+    Расстояния в км от точки origin до каждой точки массива coords
+    (форма (N, 2): широта, долгота в градусах).
+
+    Погрешность относительно geopy.distance.distance (геодезическая
+    на WGS-84): vincenty - меньше 1 мм, haversine (сфера со средним
+    радиусом Земли) - до 0.5% от расстояния.
+    """
+    with metrics.track('geo', method):
+        coords = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+        lat, lon = np.radians(np.asarray(origin, dtype=float))
+        return _DISTANCE_METHODS[method](lat, lon, coords[:, 0], coords[:, 1])
+
+
+def get_distance_matrix(origins, destinations, method='vincenty') -> np.ndarray:
+    """
+    Матрица расстояний в км формы (M, N) между точками origins (M, 2)
+    и destinations (N, 2). Погрешность та же, что у get_distances.
+    """
+    with metrics.track('geo', f'{method} matrix'):
+        origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+        destinations = np.radians(
+            np.asarray(destinations, dtype=float).reshape(-1, 2)
+        )
+        return _DISTANCE_METHODS[method](
+            origins[:, 0, np.newaxis], origins[:, 1, np.newaxis],
+            destinations[np.newaxis, :, 0], destinations[np.newaxis, :, 1],
+        )
@@ -1,6 +1,6 @@
 import moltin
 import os
-from tgbot import get_access_token
+from token_manager import get_access_token
 from dotenv import load_dotenv
 
 
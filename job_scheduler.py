@@ -0,0 +1,177 @@
+"""
+Отложенные задачи в Redis, общие для всех процессов бота.
+
+* `jobs:due` - sorted set: id задачи -> время, когда её пора выполнить;
+* `jobs:processing` - sorted set: id взятой задачи -> время, до которого
+  её должен подтвердить взявший процесс;
+* `jobs:data` - хэш: id задачи -> JSON с типом, аргументами и попытками.
+
+Задачи забираются пачками Lua-скриптом, поэтому два процесса не возьмут
+одну задачу. Если процесс упал, не подтвердив задачу, она вернётся
+в `jobs:due` после visibility_timeout: каждая задача выполняется
+хотя бы один раз, но в редких случаях - больше одного раза.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+logger = logging.getLogger(__file__)
+
+# KEYS: due, processing, data. ARGV: now, batch size, visibility deadline.
+# Returns a flat list: id1, data1, id2, data2, ...
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1],
+                           'LIMIT', 0, ARGV[2])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], ARGV[1], id)
+end
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                       'LIMIT', 0, ARGV[2])
+if #ids == 0 then
+    return {}
+end
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+end
+local data = redis.call('HMGET', KEYS[3], unpack(ids))
+local claimed = {}
+for number, id in ipairs(ids) do
+    table.insert(claimed, id)
+    table.insert(claimed, data[number])
+end
+return claimed
+"""
+
+
+class JobScheduler:
+    def __init__(
+            self, redis_client, key_prefix: str = 'jobs:',
+            batch_size: int = 100, poll_interval: float = 1,
+            visibility_timeout: float = 60, max_attempts: int = 5,
+            retry_delay: float = 30, workers: int = 4,
+    ):
+        self._redis = redis_client
+        self._due_key = f'{key_prefix}due'
+        self._processing_key = f'{key_prefix}processing'
+        self._data_key = f'{key_prefix}data'
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.workers = workers
+        self._handlers = {}
+        self._claim = None
+        self._stopped = threading.Event()
+        self._poller = None
+        self._executor = None
+
+    def register(self, job_type: str, handler):
+        """handler вызывается с аргументами задачи как с именованными."""
+        self._handlers[job_type] = handler
+
+    def schedule(self, job_type: str, delay: float = 0, **kwargs) -> str:
+        job_id = uuid.uuid4().hex
+        job = json.dumps({'type': job_type, 'kwargs': kwargs, 'attempts': 0})
+        pipeline = self._redis.pipeline()
+        pipeline.hset(self._data_key, job_id, job)
+        pipeline.zadd(self._due_key, {job_id: time.time() + delay})
+        pipeline.execute()
+        return job_id
+
+    def claim(self) -> list:
+        """Забирает до batch_size задач, которые пора выполнить."""
+        if self._claim is None:
+            self._claim = self._redis.register_script(CLAIM_SCRIPT)
+        now = time.time()
+        claimed = self._claim(
+            keys=[self._due_key, self._processing_key, self._data_key],
+            args=[now, self.batch_size, now + self.visibility_timeout],
+        )
+        return [
+            (job_id.decode(), raw_job)
+            for job_id, raw_job in zip(claimed[::2], claimed[1::2])
+        ]
+
+    def ack(self, job_id):
+        pipeline = self._redis.pipeline()
+        pipeline.zrem(self._processing_key, job_id)
+        pipeline.hdel(self._data_key, job_id)
+        pipeline.execute()
+
+    def retry(self, job_id, job: dict):
+        job['attempts'] += 1
+        if job['attempts'] >= self.max_attempts:
+            logger.error('job %s %s dropped after %s attempts',
+                         job['type'], job_id, job['attempts'])
+            self.ack(job_id)
+            return
+        delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+        pipeline = self._redis.pipeline()
+        pipeline.zrem(self._processing_key, job_id)
+        pipeline.hset(self._data_key, job_id, json.dumps(job))
+        pipeline.zadd(self._due_key, {job_id: time.time() + delay})
+        pipeline.execute()
+
+    def run_job(self, job_id, raw_job):
+        if raw_job is None:
+            # Already acknowledged by a process that claimed it earlier.
+            self._redis.zrem(self._processing_key, job_id)
+            return
+        job = json.loads(raw_job)
+        handler = self._handlers.get(job['type'])
+        if handler is None:
+            logger.error('job %s %s has no handler', job['type'], job_id)
+            self.retry(job_id, job)
+            return
+        try:
+            handler(**job['kwargs'])
+        except Exception:
+            logger.exception('job %s %s failed', job['type'], job_id)
+            self.retry(job_id, job)
+        else:
+            self.ack(job_id)
+
+    def poll(self) -> int:
+        """
+        Забирает пачку задач и ждёт, пока они выполнятся, чтобы взятые
+        задачи не простаивали в очереди дольше visibility_timeout.
+        """
+        jobs = self.claim()
+        wait([
+            self._executor.submit(self.run_job, job_id, raw_job)
+            for job_id, raw_job in jobs
+        ])
+        return len(jobs)
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='jobs',
+        )
+        self._poller = threading.Thread(
+            target=self._poll_forever, name='jobs-poller', daemon=True,
+        )
+        self._poller.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._executor.shutdown(wait=True)
+
+    def _poll_forever(self):
+        while not self._stopped.is_set():
+            try:
+                claimed = self.poll()
+            except Exception:
+                logger.exception('job polling failed')
+                claimed = 0
+            # A full batch means more jobs are probably due already.
+            if claimed < self.batch_size:
+                self._stopped.wait(self.poll_interval)
@@ -0,0 +1,460 @@
+import argparse
+import collections
+import csv
+import logging
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+import moltin
+import tgbot
+from bench_journeys import JourneyError, press, start_stub_server
+from chat_scheduler import ChatScheduler
+from fake_redis import FakeRedis
+from fake_telegram import (
+    FakeBot, FakeJobQueue, make_command, make_location,
+    make_pre_checkout, make_successful_payment, make_text,
+)
+from load_test_data import load_pizzerias
+
+
+TEXT_ADDRESSES = [
+    'Москва, ул. Тверская, д. 1',
+    'Москва, Ленинский пр-т, 30',
+    'Москва, ул. Арбат, 10',
+    'Москва, Кутузовский пр-т, 2',
+    'Москва, ул. Профсоюзная, 56',
+]
+# Вероятности нажатий на каждом экране бота.
+SCREEN_CHOICES = {
+    'menu': [('#product', 0.6), ('>>>', 0.2), ('<<<', 0.05), ('Корзина', 0.15)],
+    'product': [('Купить', 0.5), ('Назад', 0.3), ('Корзина', 0.2)],
+    'cart': [('Оформить заказ', 0.45), ('Изменить', 0.1),
+             ('Очистить корзину', 0.05), ('В магазин', 0.4)],
+    'change_cart': [('+', 0.4), ('-', 0.2), ('Готово', 0.4)],
+    'delivery': [('Доставка', 0.7), ('Самовывоз', 0.25), ('Отмена', 0.05)],
+}
+RESTART_PROBABILITY = 0.02
+LOCATION_PROBABILITY = 0.4
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(int(len(values) * share) - 1, 0)]
+
+
+def screen_type(buttons: list) -> str:
+    texts = [button['text'] for button in buttons]
+    if 'Самовывоз' in texts:
+        return 'delivery'
+    if 'Купить' in texts:
+        return 'product'
+    if 'Готово' in texts:
+        return 'change_cart'
+    if 'В магазин' in texts:
+        return 'cart'
+    return 'menu'
+
+
+class VirtualUser:
+    """
+    Покупатель, который нажимает кнопки на последнем экране бота
+    с вероятностями из SCREEN_CHOICES и доходит до оплаты.
+    """
+
+    def __init__(self, chat_id: int, rng: random.Random, pizzerias: list):
+        self.chat_id = chat_id
+        self.rng = rng
+        self.pizzerias = pizzerias
+        self.phase = 'new'
+
+    def restart(self) -> dict:
+        self.phase = 'browsing'
+        return make_command(self.chat_id)
+
+    def next_update(self, bot: FakeBot) -> dict:
+        if self.phase == 'new' or self.rng.random() < RESTART_PROBABILITY:
+            return self.restart()
+        if self.phase == 'address':
+            self.phase = 'delivery'
+            if self.rng.random() < LOCATION_PROBABILITY:
+                pizzeria = self.rng.choice(self.pizzerias)
+                return make_location(
+                    self.chat_id,
+                    pizzeria['lat'] + self.rng.uniform(-0.05, 0.05),
+                    pizzeria['lon'] + self.rng.uniform(-0.05, 0.05),
+                )
+            return make_text(self.chat_id, self.rng.choice(TEXT_ADDRESSES))
+        if self.phase == 'precheckout':
+            self.phase = 'payment'
+            return make_pre_checkout(self.chat_id, bot.invoices[self.chat_id])
+        if self.phase == 'payment':
+            self.phase = 'new'
+            return make_successful_payment(
+                self.chat_id, bot.invoices[self.chat_id]
+            )
+
+        screen = bot.screen(self.chat_id)
+        if screen is None:
+            return self.restart()
+        buttons = [
+            button for row in screen['reply_markup']['inline_keyboard']
+            for button in row
+        ]
+        kind = screen_type(buttons)
+        if self.phase == 'delivery' and kind != 'delivery':
+            raise JourneyError('no delivery options after the address')
+        texts = [button['text'] for button in buttons]
+        choices = [
+            (choice, weight) for choice, weight in SCREEN_CHOICES[kind]
+            if choice == '#product'
+            or any(text.startswith(choice) for text in texts)
+        ]
+        choice = self.rng.choices(
+            [choice for choice, _ in choices],
+            [weight for _, weight in choices],
+        )[0]
+        if choice == '#product':
+            products = [
+                number for number, button in enumerate(buttons)
+                if ':' in button['callback_data']
+            ]
+            choice = f'#{self.rng.choice(products)}'
+        if choice == 'Оформить заказ':
+            self.phase = 'address'
+        elif choice == 'Доставка':
+            self.phase = 'precheckout'
+        elif kind == 'delivery':
+            self.phase = 'new'
+        return press(bot, self.chat_id, choice)
+
+
+class LoadStats:
+    """
+    Счётчики и задержки, собранные с момента последнего снимка.
+    Задержки дополнительно разложены по ступеням, на которых были
+    отправлены обновления (step_latencies).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._window = self._empty_window()
+
+    @staticmethod
+    def _empty_window() -> dict:
+        return {'sent': 0, 'completed': 0, 'errors': 0,
+                'latencies': [], 'step_latencies': {}, 'idle_misses': 0}
+
+    def add(self, latency: float = None, step=None, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self._window[name] += value
+            if latency is not None:
+                self._window['latencies'].append(latency)
+                if step is not None:
+                    self._window['step_latencies'].setdefault(
+                        step, []
+                    ).append(latency)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            window, self._window = self._window, self._empty_window()
+        return window
+
+
+class TimedScheduler(ChatScheduler):
+    """ChatScheduler, который сообщает о завершении обработки обновлений."""
+
+    def __init__(self, on_accepted, on_done, on_rejected, **kwargs):
+        super().__init__(**kwargs)
+        self._on_accepted = on_accepted
+        self._on_done = on_done
+        self._on_rejected = on_rejected
+
+    def submit(self, chat_id, func, *args, **kwargs):
+        update = args[1] if func is tgbot.process_users_reply else None
+        try:
+            future = super().submit(chat_id, func, *args, **kwargs)
+        except queue.Full:
+            if update is not None:
+                self._on_rejected(update)
+            raise
+        if update is not None:
+            self._on_accepted(update)
+            future.add_done_callback(lambda future: self._on_done(update, future))
+        return future
+
+
+class LoadGenerator:
+    def __init__(self, users: int, workers: int, lanes: int,
+                 telegram_latency: float, seed: int = 0):
+        self.bot = FakeBot(latency=telegram_latency)
+        self.stats = LoadStats()
+        self.scheduler = TimedScheduler(
+            self._on_accepted, self._on_done, self._on_rejected, lanes=lanes,
+        )
+        tgbot._scheduler = self.scheduler
+        tgbot._database = FakeRedis()
+        self.dispatcher = Dispatcher(
+            self.bot, queue.Queue(), workers=0, job_queue=FakeJobQueue()
+        )
+        tgbot.setup_dispatcher(self.dispatcher)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        rng = random.Random(seed)
+        pizzerias = load_pizzerias()
+        self._lock = threading.Lock()
+        self._idle = collections.deque(
+            VirtualUser(20_000_000 + number, random.Random(rng.random()),
+                        pizzerias)
+            for number in range(users)
+        )
+        self._pending = {}
+        self._accepted = set()
+        self._step_rate = None
+
+    def _finish(self, update, errors: int = 0):
+        with self._lock:
+            user, sent_at, step_rate = self._pending.pop(update.update_id)
+            self._accepted.discard(update.update_id)
+            self._idle.append(user)
+        self.stats.add(
+            latency=(time.perf_counter() - sent_at) * 1000, step=step_rate,
+            completed=1, errors=errors,
+        )
+
+    def _on_accepted(self, update):
+        with self._lock:
+            self._accepted.add(update.update_id)
+
+    def _on_done(self, update, future):
+        self._finish(update, errors=int(future.exception() is not None))
+
+    def _on_rejected(self, update):
+        self._finish(update, errors=1)
+
+    def _feed(self, update):
+        self.dispatcher.process_update(update)
+        # An update no handler matched never reaches the scheduler.
+        with self._lock:
+            unhandled = update.update_id in self._pending \
+                and update.update_id not in self._accepted
+        if unhandled:
+            self._finish(update, errors=1)
+
+    def send_next(self) -> bool:
+        with self._lock:
+            if not self._idle:
+                return False
+            user = self._idle.popleft()
+        try:
+            update = Update.de_json(user.next_update(self.bot), self.bot)
+        except (JourneyError, KeyError):
+            self.stats.add(errors=1)
+            update = Update.de_json(user.restart(), self.bot)
+        with self._lock:
+            self._pending[update.update_id] = (
+                user, time.perf_counter(), self._step_rate
+            )
+        self.stats.add(sent=1)
+        self.executor.submit(self._feed, update)
+        return True
+
+    def stop(self, timeout: float = 30):
+        """
+        Перестаёт подавать обновления и ждёт, пока дорожки обработают
+        уже принятые, а фоновые шаги после оплаты завершатся.
+        """
+        # Updates not yet handed to the dispatcher are dropped.
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.scheduler.stop()
+        if not tgbot.get_task_executor().wait(timeout):
+            print('Фоновые шаги не завершились за отведённое время')
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def run_step(self, rate: float, duration: float, sample):
+        self._step_rate = rate
+        started_at = next_at = time.perf_counter()
+        next_sample_at = started_at + 1
+        while True:
+            now = time.perf_counter()
+            if now >= started_at + duration:
+                break
+            if now >= next_sample_at:
+                sample(rate)
+                next_sample_at += 1
+            if now < next_at:
+                time.sleep(min(next_at, next_sample_at) - now)
+                continue
+            if not self.send_next():
+                self.stats.add(idle_misses=1)
+            next_at += 1 / rate
+        sample(rate)
+
+
+class Report:
+    columns = ['time', 'target_rate', 'sent', 'throughput', 'in_flight',
+               'queue_depth', 'p50_ms', 'p99_ms', 'errors', 'idle_misses']
+
+    def __init__(self, generator: LoadGenerator, timeline_path: str = None):
+        self.generator = generator
+        self.started_at = self.sampled_at = time.perf_counter()
+        self.samples = []
+        # Latencies of updates sent during each step, whenever they finish.
+        self.step_latencies = collections.defaultdict(list)
+        self._file = None
+        if timeline_path:
+            self._file = open(timeline_path, 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.columns)
+        print(''.join(f'{column:>12}' for column in self.columns))
+
+    def sample(self, rate: float):
+        now = time.perf_counter()
+        window = self.generator.stats.snapshot()
+        self._add_step_latencies(window)
+        elapsed = max(now - self.sampled_at, 1e-9)
+        self.sampled_at = now
+        sample = {
+            'time': round(now - self.started_at, 1),
+            'target_rate': rate,
+            'sent': window['sent'],
+            'throughput': round(window['completed'] / elapsed, 1),
+            'in_flight': self.generator.in_flight(),
+            'queue_depth': sum(self.generator.scheduler.queue_depths()),
+            'p50_ms': round(percentile(window['latencies'], 0.5), 1),
+            'p99_ms': round(percentile(window['latencies'], 0.99), 1),
+            'errors': window['errors'],
+            'idle_misses': window['idle_misses'],
+            'elapsed': elapsed,
+        }
+        self.samples.append(sample)
+        print(''.join(f'{sample[column]:>12}' for column in self.columns))
+        if self._file:
+            self._writer.writerow([sample[column] for column in self.columns])
+
+    def _add_step_latencies(self, window: dict):
+        for rate, latencies in window['step_latencies'].items():
+            self.step_latencies[rate].extend(latencies)
+
+    def saturation(self, min_throughput_share: float = 0.95):
+        """
+        Ступень насыщена, если обработано меньше min_throughput_share
+        от целевой частоты или очередь к концу ступени длиннее, чем
+        к концу предыдущей. Пропускная способность - последняя ступень
+        перед первой насыщенной.
+        """
+        # Updates that finished after the last sample, e.g. while draining.
+        self._add_step_latencies(self.generator.stats.snapshot())
+        steps = collections.OrderedDict()
+        for sample in self.samples:
+            steps.setdefault(sample['target_rate'], []).append(sample)
+
+        print('\nНасыщение:')
+        print(f'{"цель/с":>8}{"обработано/с":>14}{"p50, мс":>10}'
+              f'{"p99, мс":>10}{"очередь":>10}{"ошибки, %":>11}'
+              f'{"насыщение":>11}')
+        capacity, saturated_at = None, None
+        previous_queue_depth = 0
+        for rate, samples in steps.items():
+            elapsed = sum(sample['elapsed'] for sample in samples)
+            completed = sum(
+                sample['throughput'] * sample['elapsed'] for sample in samples
+            )
+            latencies = self.step_latencies[rate]
+            sent = sum(sample['sent'] for sample in samples)
+            errors = sum(sample['errors'] for sample in samples)
+            throughput = completed / elapsed if elapsed else 0
+            queue_depth = samples[-1]['queue_depth']
+            saturated = throughput < rate * min_throughput_share \
+                or queue_depth > previous_queue_depth
+            previous_queue_depth = queue_depth
+            print(
+                f'{rate:>8.0f}{throughput:>14.1f}'
+                f'{statistics.median(latencies) if latencies else 0:>10.1f}'
+                f'{percentile(latencies, 0.99):>10.1f}'
+                f'{queue_depth:>10}'
+                f'{errors / sent * 100 if sent else 0:>11.1f}'
+                f'{"да" if saturated else "нет":>11}'
+            )
+            if saturated_at is not None:
+                continue
+            if saturated:
+                saturated_at = rate
+            else:
+                capacity = (rate, throughput)
+        if saturated_at is None:
+            print(f'Насыщения нет до конца: {capacity[1]:.1f} обновлений/с, '
+                  f'увеличьте --max-rate')
+        elif capacity is None:
+            print(f'Насыщение уже на первой ступени ({saturated_at:.0f}/с), '
+                  f'уменьшите --start-rate')
+        else:
+            print(f'Пропускная способность - {capacity[1]:.1f} обновлений/с '
+                  f'(цель {capacity[0]:.0f}/с), насыщение на '
+                  f'{saturated_at:.0f}/с')
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест: виртуальные покупатели шлют обновления '
+                    'в диспетчер бота со ступенчато растущей частотой'
+    )
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--start-rate', type=float, default=50,
+                        help='обновлений в секунду на первой ступени')
+    parser.add_argument('--step', type=float, default=50)
+    parser.add_argument('--max-rate', type=float, default=400)
+    parser.add_argument('--step-duration', type=float, default=10, help='с')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('TGBOT_WORKERS', 4)),
+                        help='потоки диспетчера')
+    parser.add_argument('--lanes', type=int,
+                        default=int(os.getenv('SCHEDULER_LANES', 4)))
+    parser.add_argument('--moltin-latency', type=float, default=50, help='мс')
+    parser.add_argument('--telegram-latency', type=float, default=30, help='мс')
+    parser.add_argument('--timeline', help='CSV с показателями по секундам')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    stub_process, stub_url = start_stub_server(args.moltin_latency)
+    os.environ['YANDEX_GEOCODER_URL'] = f'{stub_url}/geocoder/1.x'
+    moltin.configure(base_url=stub_url, pool_size=args.lanes)
+    generator = LoadGenerator(
+        args.users, args.workers, args.lanes,
+        args.telegram_latency / 1000, args.seed,
+    )
+    report = Report(generator, args.timeline)
+    try:
+        rate = args.start_rate
+        while rate <= args.max_rate:
+            generator.run_step(rate, args.step_duration, report.sample)
+            rate += args.step
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generator.stop()
+        report.close()
+    report.saturation()
+    stub_process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,125 @@
+import argparse
 import json
 import moltin
-from tgbot import get_access_token
+from bulk import ImportJournal, RateLimiter, run_parallel
+from token_manager import get_access_token
 from dotenv import load_dotenv
 
 
-def import_products_from_json():
-    with open('menu.json', encoding="utf-8") as file:
+def load_products(path='menu.json'):
+    with open(path, encoding="utf-8") as file:
         menu = json.load(file)
-    for item in menu:
-        product_data = {
+    return [
+        {
             "name": item.get('name'),
             "sku": str(item.get('id')),
             "description": f"{item.get('description', 'no description available')}, вес: {item.get('food_value').get('weight', '?')}г",
             "price": item.get('price'),
+            "image_url": item.get('product_image').get('url'),
         }
-        image_url = item.get('product_image').get('url')
-        product_id = moltin.create_product(get_access_token(), product_data)
-        image_id = moltin.create_file(get_access_token(), image_url)
-        moltin.set_main_image_relationship(
-            get_access_token(), product_id, image_id
-        )
+        for item in menu
+    ]
 
 
-def import_addresses_from_json():
-    with open('addresses.json', encoding="utf-8") as file:
+def load_pizzerias(path='addresses.json'):
+    with open(path, encoding="utf-8") as file:
         pizzerias = json.load(file)
-    for pizzeria in pizzerias:
-        pizzeria_data = {
+    return [
+        {
             'address': pizzeria['address']['full'],
             'alias': pizzeria['alias'],
             'lat': float(pizzeria['coordinates']['lat']),
             'lon': float(pizzeria['coordinates']['lon']),
         }
+        for pizzeria in pizzerias
+    ]
+
+
+def import_products_from_json(
+        journal, rate_limiter, workers=8, dry_run=False, path='menu.json'
+):
+    def import_product(product_data):
+        key = f"product:{product_data['sku']}"
+        state = journal.get(key)
+        if state.get('done'):
+            return 'skipped'
+        if dry_run:
+            print(f"создать товар {product_data['sku']} {product_data['name']}")
+            return 'done'
+        if 'product_id' not in state:
+            rate_limiter.acquire()
+            state['product_id'] = moltin.create_product(
+                get_access_token(), product_data
+            )
+            journal.record(key, product_id=state['product_id'])
+        if 'image_id' not in state:
+            rate_limiter.acquire()
+            state['image_id'] = moltin.create_file(
+                get_access_token(), product_data['image_url']
+            )
+            journal.record(key, image_id=state['image_id'])
+        rate_limiter.acquire()
+        moltin.set_main_image_relationship(
+            get_access_token(), state['product_id'], state['image_id']
+        )
+        journal.record(key, done=True)
+
+    return run_parallel('Товары', load_products(path), import_product, workers)
+
+
+def import_addresses_from_json(
+        journal, rate_limiter, workers=8, dry_run=False, path='addresses.json'
+):
+    def import_pizzeria(pizzeria_data):
+        key = f"pizzeria:{pizzeria_data['alias']}"
+        if journal.get(key).get('done'):
+            return 'skipped'
+        if dry_run:
+            print(f"создать пиццерию {pizzeria_data['alias']}")
+            return 'done'
+        rate_limiter.acquire()
         moltin.create_pizzeria(get_access_token(), pizzeria_data)
+        journal.record(key, done=True)
+
+    return run_parallel(
+        'Пиццерии', load_pizzerias(path), import_pizzeria, workers
+    )
 
 
 def main():
     load_dotenv()
-    import_products_from_json()
-    import_addresses_from_json()
+    parser = argparse.ArgumentParser(
+        description='Загрузка меню и пиццерий в Moltin'
+    )
+    parser.add_argument('--menu', default='menu.json')
+    parser.add_argument('--addresses', default='addresses.json')
+    parser.add_argument(
+        '--workers', type=int, default=8, help='число параллельных потоков'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=20,
+        help='не больше стольких запросов к Moltin в секунду',
+    )
+    parser.add_argument(
+        '--journal', default='.import_journal.jsonl',
+        help='журнал выполненных шагов, повторный запуск их пропускает',
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='только показать, что будет создано',
+    )
+    args = parser.parse_args()
+
+    journal = ImportJournal(args.journal)
+    rate_limiter = RateLimiter(args.rate)
+    moltin.configure(pool_size=args.workers)
+    import_products_from_json(
+        journal, rate_limiter, args.workers, args.dry_run, args.menu
+    )
+    import_addresses_from_json(
+        journal, rate_limiter, args.workers, args.dry_run, args.addresses
+    )
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,96 @@
+import json
+import threading
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def build_menu_keyboard(page: dict, page_number: int, pages_total: int):
+    keyboard = []
+    for product in page['data']:
+        price = product['price'][0]['amount']
+        keyboard.append(
+            [InlineKeyboardButton(
+                f"{product['name']}: ₽{price:.2f}",
+                callback_data=f"{product['id']}:{price:.2f}"
+            )]
+        )
+    offset, limit = page['meta']['page']['offset'], page['meta']['page']['limit']
+    navigation = []
+    if page_number > 0:
+        navigation.append(
+            InlineKeyboardButton('<<<', callback_data=str(offset - limit))
+        )
+    if page_number < pages_total - 1:
+        navigation.append(
+            InlineKeyboardButton('>>>', callback_data=str(offset + limit))
+        )
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton('Корзина', callback_data='cart')])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def _markup_from_dict(data: dict):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(**button) for button in row]
+        for row in data['inline_keyboard']
+    ])
+
+
+class MenuKeyboards:
+    """
+    Клавиатуры страниц меню, собранные один раз на версию каталога.
+    Хранятся в памяти и в Redis, пересобираются при смене версии.
+    """
+
+    def __init__(
+            self, catalog, redis_client=None,
+            key_prefix: str = 'menu_keyboards:'
+    ):
+        self._catalog = catalog
+        self._redis = redis_client
+        self._key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._version = None
+        self._keyboards = {}
+        self._page_size = catalog.page_size
+
+    def _load_shared(self, key: str) -> dict:
+        if self._redis is None:
+            return {}
+        return {
+            int(offset): _markup_from_dict(json.loads(markup))
+            for offset, markup in self._redis.hgetall(key).items()
+        }
+
+    def _save_shared(self, key: str, keyboards: dict):
+        if self._redis is None:
+            return
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.hset(key, mapping={
+            offset: markup.to_json() for offset, markup in keyboards.items()
+        })
+        pipeline.expire(key, self._catalog.ttl * 2)
+        pipeline.execute()
+
+    def _rebuild(self, version: str, pages: list):
+        key = f'{self._key_prefix}{version}'
+        keyboards = self._load_shared(key)
+        if len(keyboards) != len(pages):
+            keyboards = {
+                page['meta']['page']['offset']: build_menu_keyboard(
+                    page, number, len(pages)
+                )
+                for number, page in enumerate(pages)
+            }
+            self._save_shared(key, keyboards)
+        self._keyboards, self._version = keyboards, version
+
+    def get(self, offset: int = 0):
+        version, pages = self._catalog.get_pages()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._rebuild(version, pages)
+        offset = offset // self._page_size * self._page_size
+        return self._keyboards.get(offset) or self._keyboards[0]
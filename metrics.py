@@ -0,0 +1,317 @@
+import contextvars
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+from redis.client import Pipeline
+
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+ID_PATTERN = re.compile(
+    r'/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+)(?=/|$)'
+)
+
+_enabled = False
+_registry = []
+# A context variable rather than threading.local, so that coroutines
+# started from a thread (see async_http.EventLoopThread) log into it too.
+_call_log = contextvars.ContextVar('call_log', default=None)
+
+
+def path_template(path: str) -> str:
+    """/v2/carts/100500/items -> /v2/carts/{id}/items"""
+    return ID_PATTERN.sub('/{id}', path)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def render(self) -> list:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(
+                f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+            )
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Per-bucket counts with +Inf, then sum and count.
+                counts = self._values[labels] = [0] * (len(self.buckets) + 3)
+            for number, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[number] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self) -> list:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(
+                    f'{self.name}_bucket'
+                    f'{_format_labels(self.labelnames, labels, le)} {cumulative}'
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {counts[-2]}')
+            lines.append(f'{self.name}_count{label_text} {counts[-1]}')
+        return lines
+
+
+STATE_SECONDS = Histogram(
+    'pizzabot_state_handler_seconds', 'State handler latency', ('state',),
+)
+STATE_ERRORS = Counter(
+    'pizzabot_state_handler_errors_total', 'State handler exceptions', ('state',),
+)
+STATE_IN_FLIGHT = Gauge(
+    'pizzabot_state_handler_in_flight', 'State handlers running now', ('state',),
+)
+BACKEND_SECONDS = Histogram(
+    'pizzabot_backend_request_seconds', 'Outbound call latency',
+    ('backend', 'endpoint'),
+)
+BACKEND_ERRORS = Counter(
+    'pizzabot_backend_errors_total',
+    'Outbound calls that raised or returned an HTTP error',
+    ('backend', 'endpoint'),
+)
+BACKEND_IN_FLIGHT = Gauge(
+    'pizzabot_backend_in_flight', 'Outbound calls running now',
+    ('backend', 'endpoint'),
+)
+TASK_STEP_SECONDS = Histogram(
+    'pizzabot_task_step_seconds', 'Background task step latency',
+    ('graph', 'step'),
+)
+TASK_STEP_ERRORS = Counter(
+    'pizzabot_task_step_errors_total', 'Background task step exceptions',
+    ('graph', 'step'),
+)
+TASK_STEP_IN_FLIGHT = Gauge(
+    'pizzabot_task_step_in_flight', 'Background task steps running now',
+    ('graph', 'step'),
+)
+
+
+class _Tracker:
+    __slots__ = (
+        '_families', '_labels', '_calls', '_failed', '_started_at',
+    )
+
+    def __init__(self, families, labels: tuple, calls: list = None):
+        # families - (histogram, errors, in_flight) or None when only
+        # the call log of the current thread is being recorded.
+        self._families = families
+        self._labels = labels
+        self._calls = calls
+        self._failed = False
+
+    def __enter__(self):
+        if self._families:
+            self._families[2].inc(self._labels)
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._started_at
+        failed = self._failed or exc_type is not None
+        if self._families:
+            seconds, errors, in_flight = self._families
+            seconds.observe(self._labels, duration)
+            in_flight.dec(self._labels)
+            if exc_type is not None:
+                errors.inc(self._labels)
+        if self._calls is not None:
+            self._calls.append((self._labels, duration, failed))
+
+    def fail(self):
+        """Считает ошибкой вызов, который завершился без исключения."""
+        self._failed = True
+        if self._families:
+            self._families[1].inc(self._labels)
+
+
+class _NoopTracker:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def fail(self):
+        pass
+
+
+_NOOP = _NoopTracker()
+
+
+STATE_FAMILIES = (STATE_SECONDS, STATE_ERRORS, STATE_IN_FLIGHT)
+BACKEND_FAMILIES = (BACKEND_SECONDS, BACKEND_ERRORS, BACKEND_IN_FLIGHT)
+TASK_STEP_FAMILIES = (TASK_STEP_SECONDS, TASK_STEP_ERRORS, TASK_STEP_IN_FLIGHT)
+
+
+def track_state(state: str):
+    if not _enabled:
+        return _NOOP
+    return _Tracker(STATE_FAMILIES, (state,))
+
+
+def track_step(graph: str, step: str):
+    if not _enabled:
+        return _NOOP
+    return _Tracker(TASK_STEP_FAMILIES, (graph, step))
+
+
+def track(backend: str, endpoint: str):
+    calls = _call_log.get()
+    if not _enabled and calls is None:
+        return _NOOP
+    return _Tracker(
+        BACKEND_FAMILIES if _enabled else None, (backend, endpoint), calls
+    )
+
+
+class record_calls:
+    """
+    Записывает вызовы внешних сервисов, сделанные в текущем потоке
+    и в запущенных из него корутинах:
+    список ((backend, endpoint), секунды, была ли ошибка).
+    """
+
+    def __enter__(self) -> list:
+        calls = []
+        self._token = _call_log.set(calls)
+        return calls
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _call_log.reset(self._token)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentedRedis(redis.Redis):
+    """redis.Redis, который замеряет каждую команду и каждый pipeline."""
+
+    def execute_command(self, *args, **options):
+        with track('redis', str(args[0]).lower()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction,
+            shard_hint,
+        )
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        with track('redis', 'pipeline'):
+            return super().execute(raise_on_error)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Включает сбор метрик и отдаёт их по адресу http://host:port/metrics."""
+    enable()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
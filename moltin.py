@@ -1,294 +1,356 @@
-import os
-from requests import get, post, delete, put
-from slugify import slugify
+from collections import deque
+from itertools import islice
+
+import async_http
+from moltin_async import (
+    AsyncMoltinClient, DEFAULT_MAX_IN_FLIGHT, DEFAULT_PAGE_LIMIT,
+    DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT,
+)
+
+
+class MoltinClient:
+    """
+    Синхронный фасад над moltin_async.AsyncMoltinClient: запросы
+    выполняются в общем цикле событий async_http, а вызывающий поток
+    ждёт ответа. Соединения к api.moltin.com переиспользуются между
+    запросами всех потоков.
+    """
+
+    def __init__(
+            self, base_url: str = None, pool_size: int = DEFAULT_POOL_SIZE,
+            timeout=DEFAULT_TIMEOUT, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+    ):
+        self.async_client = AsyncMoltinClient(
+            base_url, pool_size, max_in_flight, timeout,
+        )
+        self.base_url = self.async_client.base_url
+
+    @staticmethod
+    def _run(coroutine):
+        return async_http.run(coroutine)
+
+    def close(self):
+        self._run(self.async_client.close())
+
+    @staticmethod
+    def _iter_pages(fetch_page, limit: int, concurrency: int = 1):
+        """
+        Отдаёт записи всех страниц по порядку. Пока обрабатывается текущая
+        страница, следующие concurrency страниц уже загружаются в фоне,
+        поэтому в памяти одновременно не больше concurrency + 1 страниц.
+        """
+        loop_thread = async_http.get_event_loop_thread()
+        first_page = loop_thread.run(fetch_page(limit=limit, offset=0))
+        total = first_page['meta']['results']['total']
+        offsets = iter(range(limit, total, limit))
+        pending_pages = deque(
+            loop_thread.submit(fetch_page(limit=limit, offset=offset))
+            for offset in islice(offsets, max(concurrency, 1))
+        )
+        try:
+            yield from first_page['data']
+            del first_page
+            while pending_pages:
+                page = pending_pages.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending_pages.append(loop_thread.submit(
+                        fetch_page(limit=limit, offset=offset)
+                    ))
+                yield from page['data']
+        finally:
+            for pending_page in pending_pages:
+                pending_page.cancel()
+
+    def iter_products(
+            self, access_token: str, limit=DEFAULT_PAGE_LIMIT, concurrency=1
+    ):
+        return self._iter_pages(
+            lambda limit, offset: self.async_client.get_products(
+                access_token, limit, offset
+            ),
+            limit, concurrency,
+        )
+
+    def iter_flow_entries(
+            self, access_token: str, slug: str, limit=DEFAULT_PAGE_LIMIT,
+            concurrency=1
+    ):
+        return self._iter_pages(
+            lambda limit, offset: self.async_client.get_flow_entries(
+                access_token, slug, limit, offset
+            ),
+            limit, concurrency,
+        )
+
+    def get_token(self) -> dict:
+        return self._run(self.async_client.get_token())
+
+    def get_products(self, access_token: str, limit=8, offset=0) -> dict:
+        return self._run(
+            self.async_client.get_products(access_token, limit, offset)
+        )
+
+    def get_product(self, access_token: str, product_id: str) -> dict:
+        return self._run(
+            self.async_client.get_product(access_token, product_id)
+        )
+
+    def get_image_url(self, access_token: str, file_id: str) -> str:
+        return self._run(
+            self.async_client.get_image_url(access_token, file_id)
+        )
+
+    def add_product_to_cart(
+            self, access_token: str, cart_ref: str, product_id: str,
+            quantity: int
+    ) -> dict:
+        return self._run(self.async_client.add_product_to_cart(
+            access_token, cart_ref, product_id, quantity
+        ))
+
+    def get_cart_items(self, access_token: str, cart_ref: str) -> dict:
+        return self._run(
+            self.async_client.get_cart_items(access_token, cart_ref)
+        )
+
+    def delete_cart_items(self, access_token: str, cart_id: str) -> None:
+        self._run(self.async_client.delete_cart_items(access_token, cart_id))
+
+    def update_cart_item(
+            self, access_token: str, cart_id: str, item_id: str, quantity: int
+    ) -> dict:
+        return self._run(self.async_client.update_cart_item(
+            access_token, cart_id, item_id, quantity
+        ))
+
+    def create_customer(self, access_token: str, name: str, email: str) -> int:
+        return self._run(
+            self.async_client.create_customer(access_token, name, email)
+        )
+
+    def get_customer_by_email(self, access_token: str, email: str) -> dict:
+        return self._run(
+            self.async_client.get_customer_by_email(access_token, email)
+        )
+
+    def create_product(self, access_token: str, product_data: dict) -> str:
+        return self._run(
+            self.async_client.create_product(access_token, product_data)
+        )
+
+    def update_product(
+            self, access_token: str, product_id: str, product_data: dict
+    ) -> dict:
+        return self._run(self.async_client.update_product(
+            access_token, product_id, product_data
+        ))
+
+    def delete_product(self, access_token: str, product_id: str) -> None:
+        self._run(self.async_client.delete_product(access_token, product_id))
+
+    def create_file(self, access_token: str, file_url: str) -> str:
+        return self._run(self.async_client.create_file(access_token, file_url))
+
+    def set_main_image_relationship(
+            self, access_token: str, product_id: str, image_id: str
+    ):
+        return self._run(self.async_client.set_main_image_relationship(
+            access_token, product_id, image_id
+        ))
+
+    def get_flows(self, access_token: str):
+        return self._run(self.async_client.get_flows(access_token))
+
+    def create_flow(
+            self, access_token: str, name: str, slug: str, description: str
+    ):
+        return self._run(self.async_client.create_flow(
+            access_token, name, slug, description
+        ))
+
+    def create_field(
+            self, access_token: str, name: str, slug: str, type: str,
+            flow_id: str, **kwargs
+    ):
+        self._run(self.async_client.create_field(
+            access_token, name, slug, type, flow_id, **kwargs
+        ))
+
+    def create_pizzeria(self, access_token: str, pizzeria_data: dict):
+        self._run(
+            self.async_client.create_pizzeria(access_token, pizzeria_data)
+        )
+
+    def get_flow_entries(
+            self, access_token: str, slug: str, limit=100, offset=0
+    ) -> dict:
+        return self._run(self.async_client.get_flow_entries(
+            access_token, slug, limit, offset
+        ))
+
+    def update_flow_entry(
+            self, access_token: str, slug: str, entry_id: str, fields: dict
+    ) -> dict:
+        return self._run(self.async_client.update_flow_entry(
+            access_token, slug, entry_id, fields
+        ))
+
+    def delete_flow_entry(
+            self, access_token: str, slug: str, entry_id: str
+    ) -> None:
+        self._run(
+            self.async_client.delete_flow_entry(access_token, slug, entry_id)
+        )
+
+    def get_pizzerias(self, access_token: str):
+        return self._run(self.async_client.get_pizzerias(access_token))
+
+    def create_customer_address(
+            self, access_token: str, tg_id: str, lat: float, lon: float,
+            address: str
+    ):
+        return self._run(self.async_client.create_customer_address(
+            access_token, tg_id, lat, lon, address
+        ))
+
+
+_client = MoltinClient()
+
+
+def configure(**client_kwargs) -> MoltinClient:
+    """
+    Пересоздаёт общий клиент модуля, например, чтобы подогнать размер
+    пула соединений под число воркеров диспетчера.
+    """
+    global _client
+    old_client, _client = _client, MoltinClient(**client_kwargs)
+    old_client.close()
+    return _client
+
+
+def get_client() -> MoltinClient:
+    return _client
 
 
 def get_token() -> dict:
-    url = 'https://api.moltin.com/oauth/access_token'
-    data = {
-        'client_id': os.getenv('CLIENT_ID'),
-        'client_secret': os.getenv('CLIENT_SECRET'),
-        'grant_type': 'client_credentials'
-    }
-    response = post(url, data=data)
-    response.raise_for_status()
-    return response.json()
+    return _client.get_token()
 
 
 def get_products(access_token: str, limit=8, offset=0) -> dict:
-    url = 'https://api.moltin.com/v2/products'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    params = {'page[limit]': limit, 'page[offset]': offset}
-    response = get(url, headers=headers, params=params)
-    response.raise_for_status()
-    return response.json()
+    return _client.get_products(access_token, limit, offset)
+
+
+def iter_products(access_token: str, limit=DEFAULT_PAGE_LIMIT, concurrency=1):
+    return _client.iter_products(access_token, limit, concurrency)
+
+
+def iter_flow_entries(
+        access_token: str, slug: str, limit=DEFAULT_PAGE_LIMIT, concurrency=1
+):
+    return _client.iter_flow_entries(access_token, slug, limit, concurrency)
 
 
 def get_product(access_token: str, product_id: str) -> dict:
-    url = f'https://api.moltin.com/v2/products/{product_id}'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    product_response = get(url, headers=headers)
-    product_response.raise_for_status()
-    return product_response.json()['data']
+    return _client.get_product(access_token, product_id)
 
 
 def get_image_url(access_token: str, file_id: str) -> str:
-    url = f'https://api.moltin.com/v2/files/{file_id}'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()['data']['link']['href']
+    return _client.get_image_url(access_token, file_id)
 
 
 def add_product_to_cart(
         access_token: str, cart_ref: str, product_id: str, quantity: int
 ) -> dict:
-    url = f'https://api.moltin.com/v2/carts/{cart_ref}/items'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "data": {
-            "id": product_id,
-            "type": "cart_item",
-            "quantity": quantity,
-        }
-    }
-    response = post(url, headers=headers, json=payload)
-    if response.status_code != 400:  # Insufficient stock returns status 400
-        response.raise_for_status()
-    return response.json()
+    return _client.add_product_to_cart(
+        access_token, cart_ref, product_id, quantity
+    )
 
 
 def get_cart_items(access_token: str, cart_ref: str) -> dict:
-    url = f'https://api.moltin.com/v2/carts/{cart_ref}/items'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return _client.get_cart_items(access_token, cart_ref)
 
 
 def delete_cart_items(access_token: str, cart_id: str) -> None:
-    url = f'https://api.moltin.com/v2/carts/{cart_id}/items'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = delete(url, headers=headers)
-    response.raise_for_status()
+    _client.delete_cart_items(access_token, cart_id)
 
 
 def update_cart_item(
         access_token: str, cart_id: str, item_id: str, quantity: int
 ) -> dict:
-    url = f'https://api.moltin.com/v2/carts/{cart_id}/items/{item_id}'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-        'quantity': quantity
-        }
-    }
-    response = put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()
+    return _client.update_cart_item(access_token, cart_id, item_id, quantity)
 
 
 def create_customer(access_token: str, name: str, email: str) -> int:
-    url = 'https://api.moltin.com/v2/customers'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            'type': 'customer',
-            'name': str(name),
-            'email': email,
-        },
-    }
-    response = post(url, headers=headers, json=payload)
-    if response.status_code != 422:  # Failed email validation returns code 422
-        response.raise_for_status()
-    return response.status_code
+    return _client.create_customer(access_token, name, email)
 
 
 def get_customer_by_email(access_token: str, email: str) -> dict:
-    url = 'https://api.moltin.com/v2/customers'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    params = {'filter': f'eq(email,{email})'}
-    response = get(url, headers=headers, params=params)
-    response.raise_for_status()
-    return response.json()
+    return _client.get_customer_by_email(access_token, email)
 
 
 def create_product(access_token: str, product_data: dict) -> str:
-    url = 'https://api.moltin.com/v2/products'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            "type": "product",
-            "name": product_data.get('name'),
-            "slug": product_data.get('slug', slugify(product_data.get('name'))),
-            "sku": product_data.get('sku'),
-            "description": product_data.get('description', 'no description available'),
-            "manage_stock": False,
-            "price": [
-                {
-                    "amount": product_data.get('price'),
-                    "currency": "RUB",
-                    "includes_tax": True
-                }
-            ],
-            "status": "live",
-            "commodity_type": "physical",
-        },
-    }
-    response = post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()['data']['id']
+    return _client.create_product(access_token, product_data)
+
+
+def update_product(access_token: str, product_id: str, product_data: dict) -> dict:
+    return _client.update_product(access_token, product_id, product_data)
+
+
+def delete_product(access_token: str, product_id: str) -> None:
+    _client.delete_product(access_token, product_id)
 
 
 def create_file(access_token: str, file_url: str) -> str:
-    url = 'https://api.moltin.com/v2/files'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-    }
-    files = {
-        'file_location': (None, file_url),
-    }
-    response = post(url, headers=headers, files=files)
-    response.raise_for_status()
-    return response.json()['data']['id']
+    return _client.create_file(access_token, file_url)
 
 
 def set_main_image_relationship(access_token: str, product_id: str, image_id: str):
-    url = f'https://api.moltin.com/v2/products/{product_id}/relationships/main-image'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            "type": "main_image",
-            "id": f'{image_id}'
-        },
-    }
-    response = post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()
+    return _client.set_main_image_relationship(
+        access_token, product_id, image_id
+    )
 
 
 def get_flows(access_token: str):
-    url = 'https://api.moltin.com/v2/flows'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return _client.get_flows(access_token)
 
 
 def create_flow(access_token: str, name: str, slug: str, description: str):
-    url = 'https://api.moltin.com/v2/flows'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            "type": "flow",
-            "name": f'{name}',
-            "slug": f'{slug}',
-            "description": f'{description}',
-            "enabled": True,
-        },
-    }
-    response = post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()['data']['id']
+    return _client.create_flow(access_token, name, slug, description)
 
 
 def create_field(
         access_token: str, name: str, slug: str, type: str, flow_id: str,
         **kwargs
 ):
-    url = 'https://api.moltin.com/v2/fields'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            "type": "field",
-            "name": f'{name}',
-            "slug": f'{slug}',
-            "field_type": f'{type}',
-            "description": "",
-            "required": True,
-            "enabled": True,
-            "relationships": {
-                "flow": {
-                    "data": {
-                        "type": "flow",
-                        "id": f'{flow_id}'
-                    }
-                }
-            }
-        },
-    }
-    for key, value in kwargs.items():
-        payload['data'][key] = value
-    response = post(url, headers=headers, json=payload)
-    response.raise_for_status()
+    _client.create_field(access_token, name, slug, type, flow_id, **kwargs)
 
 
 def create_pizzeria(access_token: str, pizzeria_data: dict):
-    url = 'https://api.moltin.com/v2/flows/pizzeria/entries'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            "type": "entry",
-            "address": pizzeria_data.get('address'),
-            "alias": pizzeria_data.get('alias'),
-            "lat": pizzeria_data.get('lat'),
-            "lon": pizzeria_data.get('lon'),
-        },
-    }
-    response = post(url, headers=headers, json=payload)
-    response.raise_for_status()
+    _client.create_pizzeria(access_token, pizzeria_data)
+
+
+def get_flow_entries(access_token: str, slug: str, limit=100, offset=0) -> dict:
+    return _client.get_flow_entries(access_token, slug, limit, offset)
+
+
+def update_flow_entry(
+        access_token: str, slug: str, entry_id: str, fields: dict
+) -> dict:
+    return _client.update_flow_entry(access_token, slug, entry_id, fields)
+
+
+def delete_flow_entry(access_token: str, slug: str, entry_id: str) -> None:
+    _client.delete_flow_entry(access_token, slug, entry_id)
 
 
 def get_pizzerias(access_token: str):
-    url = 'https://api.moltin.com/v2/flows/pizzeria/entries'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    params = {'page[limit]': 100}
-    response = get(url, headers=headers, params=params)
-    response.raise_for_status()
-    return response.json()
+    return _client.get_pizzerias(access_token)
 
 
 def create_customer_address(
         access_token: str, tg_id: str, lat: float, lon: float, address: str
 ):
-    url = 'https://api.moltin.com/v2/flows/customer_address/entries'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'data': {
-            "type": "entry",
-            "address": address,
-            "lat": lat,
-            "lon": lon,
-            "tg_id": tg_id
-        },
-    }
-    response = post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()['data']['id']
+    return _client.create_customer_address(
+        access_token, tg_id, lat, lon, address
+    )
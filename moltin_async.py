@@ -0,0 +1,419 @@
+import asyncio
+import os
+from collections import deque
+from itertools import islice
+
+import requests
+from slugify import slugify
+
+import metrics
+from async_http import (
+    AsyncHTTPClient, DEFAULT_MAX_IN_FLIGHT, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT,
+)
+
+
+DEFAULT_API_URL = 'https://api.moltin.com'
+DEFAULT_PAGE_LIMIT = 100
+RATE_LIMIT_RETRIES = 3
+
+
+class AsyncMoltinClient(AsyncHTTPClient):
+    """
+    Асинхронный клиент Moltin API с теми же методами и ответами,
+    что у moltin.MoltinClient. Все запросы идут через один пул
+    соединений aiohttp, одновременно - не больше max_in_flight.
+    """
+
+    def __init__(
+            self, base_url: str = None, pool_size: int = DEFAULT_POOL_SIZE,
+            max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, timeout=DEFAULT_TIMEOUT
+    ):
+        super().__init__(
+            pool_size, max_in_flight, timeout,
+            headers={'Accept': 'application/json'},
+        )
+        self.base_url = (
+            base_url or os.getenv('MOLTIN_API_URL', DEFAULT_API_URL)
+        ).rstrip('/')
+
+    async def _request(
+            self, method: str, path: str, access_token: str = None, **kwargs
+    ) -> requests.Response:
+        headers = kwargs.pop('headers', {})
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+        endpoint = f'{method} {metrics.path_template(path)}'
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            with metrics.track('moltin', endpoint) as tracker:
+                response = await self.request(
+                    method, f'{self.base_url}{path}', headers=headers,
+                    **kwargs
+                )
+                if response.status_code >= 400:
+                    tracker.fail()
+            if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                return response
+            try:
+                delay = float(response.headers.get('Retry-After', 2 ** attempt))
+            except ValueError:
+                delay = 2 ** attempt
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _iter_pages(fetch_page, limit: int, concurrency: int = 1):
+        """
+        Отдаёт записи всех страниц по порядку, заранее загружая
+        следующие concurrency страниц, как moltin.MoltinClient._iter_pages.
+        """
+        first_page = await fetch_page(limit=limit, offset=0)
+        total = first_page['meta']['results']['total']
+        offsets = iter(range(limit, total, limit))
+        pending_pages = deque(
+            asyncio.ensure_future(fetch_page(limit=limit, offset=offset))
+            for offset in islice(offsets, max(concurrency, 1))
+        )
+        try:
+            for entry in first_page['data']:
+                yield entry
+            del first_page
+            while pending_pages:
+                page = await pending_pages.popleft()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending_pages.append(asyncio.ensure_future(
+                        fetch_page(limit=limit, offset=offset)
+                    ))
+                for entry in page['data']:
+                    yield entry
+        finally:
+            for pending_page in pending_pages:
+                pending_page.cancel()
+
+    def iter_products(
+            self, access_token: str, limit=DEFAULT_PAGE_LIMIT, concurrency=1
+    ):
+        return self._iter_pages(
+            lambda limit, offset: self.get_products(access_token, limit, offset),
+            limit, concurrency,
+        )
+
+    def iter_flow_entries(
+            self, access_token: str, slug: str, limit=DEFAULT_PAGE_LIMIT,
+            concurrency=1
+    ):
+        return self._iter_pages(
+            lambda limit, offset: self.get_flow_entries(
+                access_token, slug, limit, offset
+            ),
+            limit, concurrency,
+        )
+
+    async def get_token(self) -> dict:
+        data = {
+            'client_id': os.getenv('CLIENT_ID'),
+            'client_secret': os.getenv('CLIENT_SECRET'),
+            'grant_type': 'client_credentials'
+        }
+        response = await self._request('POST', '/oauth/access_token', data=data)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_products(self, access_token: str, limit=8, offset=0) -> dict:
+        params = {'page[limit]': limit, 'page[offset]': offset}
+        response = await self._request(
+            'GET', '/v2/products', access_token, params=params
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def get_product(self, access_token: str, product_id: str) -> dict:
+        response = await self._request(
+            'GET', f'/v2/products/{product_id}', access_token
+        )
+        response.raise_for_status()
+        return response.json()['data']
+
+    async def get_image_url(self, access_token: str, file_id: str) -> str:
+        response = await self._request('GET', f'/v2/files/{file_id}', access_token)
+        response.raise_for_status()
+        return response.json()['data']['link']['href']
+
+    async def add_product_to_cart(
+            self, access_token: str, cart_ref: str, product_id: str,
+            quantity: int
+    ) -> dict:
+        payload = {
+            "data": {
+                "id": product_id,
+                "type": "cart_item",
+                "quantity": quantity,
+            }
+        }
+        response = await self._request(
+            'POST', f'/v2/carts/{cart_ref}/items', access_token, json=payload
+        )
+        if response.status_code != 400:  # Insufficient stock returns status 400
+            response.raise_for_status()
+        return response.json()
+
+    async def get_cart_items(self, access_token: str, cart_ref: str) -> dict:
+        response = await self._request(
+            'GET', f'/v2/carts/{cart_ref}/items', access_token
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def delete_cart_items(self, access_token: str, cart_id: str) -> None:
+        response = await self._request(
+            'DELETE', f'/v2/carts/{cart_id}/items', access_token
+        )
+        response.raise_for_status()
+
+    async def update_cart_item(
+            self, access_token: str, cart_id: str, item_id: str, quantity: int
+    ) -> dict:
+        payload = {
+            'data': {
+                'quantity': quantity
+            }
+        }
+        response = await self._request(
+            'PUT', f'/v2/carts/{cart_id}/items/{item_id}', access_token,
+            json=payload
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def create_customer(self, access_token: str, name: str, email: str) -> int:
+        payload = {
+            'data': {
+                'type': 'customer',
+                'name': str(name),
+                'email': email,
+            },
+        }
+        response = await self._request(
+            'POST', '/v2/customers', access_token, json=payload
+        )
+        if response.status_code != 422:  # Failed email validation returns code 422
+            response.raise_for_status()
+        return response.status_code
+
+    async def get_customer_by_email(self, access_token: str, email: str) -> dict:
+        params = {'filter': f'eq(email,{email})'}
+        response = await self._request(
+            'GET', '/v2/customers', access_token, params=params
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def create_product(self, access_token: str, product_data: dict) -> str:
+        payload = {
+            'data': {
+                "type": "product",
+                "name": product_data.get('name'),
+                "slug": product_data.get(
+                    'slug', slugify(product_data.get('name'))
+                ),
+                "sku": product_data.get('sku'),
+                "description": product_data.get(
+                    'description', 'no description available'
+                ),
+                "manage_stock": False,
+                "price": [
+                    {
+                        "amount": product_data.get('price'),
+                        "currency": "RUB",
+                        "includes_tax": True
+                    }
+                ],
+                "status": "live",
+                "commodity_type": "physical",
+            },
+        }
+        response = await self._request(
+            'POST', '/v2/products', access_token, json=payload
+        )
+        response.raise_for_status()
+        return response.json()['data']['id']
+
+    async def update_product(
+            self, access_token: str, product_id: str, product_data: dict
+    ) -> dict:
+        payload = {
+            'data': {
+                "type": "product",
+                "id": product_id,
+                **product_data,
+            },
+        }
+        response = await self._request(
+            'PUT', f'/v2/products/{product_id}', access_token, json=payload
+        )
+        response.raise_for_status()
+        return response.json()['data']
+
+    async def delete_product(self, access_token: str, product_id: str) -> None:
+        response = await self._request(
+            'DELETE', f'/v2/products/{product_id}', access_token
+        )
+        response.raise_for_status()
+
+    async def create_file(self, access_token: str, file_url: str) -> str:
+        files = {
+            'file_location': (None, file_url),
+        }
+        response = await self._request(
+            'POST', '/v2/files', access_token, files=files
+        )
+        response.raise_for_status()
+        return response.json()['data']['id']
+
+    async def set_main_image_relationship(
+            self, access_token: str, product_id: str, image_id: str
+    ):
+        payload = {
+            'data': {
+                "type": "main_image",
+                "id": f'{image_id}'
+            },
+        }
+        response = await self._request(
+            'POST', f'/v2/products/{product_id}/relationships/main-image',
+            access_token, json=payload
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def get_flows(self, access_token: str):
+        response = await self._request('GET', '/v2/flows', access_token)
+        response.raise_for_status()
+        return response.json()
+
+    async def create_flow(
+            self, access_token: str, name: str, slug: str, description: str
+    ):
+        payload = {
+            'data': {
+                "type": "flow",
+                "name": f'{name}',
+                "slug": f'{slug}',
+                "description": f'{description}',
+                "enabled": True,
+            },
+        }
+        response = await self._request(
+            'POST', '/v2/flows', access_token, json=payload
+        )
+        response.raise_for_status()
+        return response.json()['data']['id']
+
+    async def create_field(
+            self, access_token: str, name: str, slug: str, type: str,
+            flow_id: str, **kwargs
+    ):
+        payload = {
+            'data': {
+                "type": "field",
+                "name": f'{name}',
+                "slug": f'{slug}',
+                "field_type": f'{type}',
+                "description": "",
+                "required": True,
+                "enabled": True,
+                "relationships": {
+                    "flow": {
+                        "data": {
+                            "type": "flow",
+                            "id": f'{flow_id}'
+                        }
+                    }
+                }
+            },
+        }
+        for key, value in kwargs.items():
+            payload['data'][key] = value
+        response = await self._request(
+            'POST', '/v2/fields', access_token, json=payload
+        )
+        response.raise_for_status()
+
+    async def create_pizzeria(self, access_token: str, pizzeria_data: dict):
+        payload = {
+            'data': {
+                "type": "entry",
+                "address": pizzeria_data.get('address'),
+                "alias": pizzeria_data.get('alias'),
+                "lat": pizzeria_data.get('lat'),
+                "lon": pizzeria_data.get('lon'),
+            },
+        }
+        response = await self._request(
+            'POST', '/v2/flows/pizzeria/entries', access_token, json=payload
+        )
+        response.raise_for_status()
+
+    async def get_flow_entries(
+            self, access_token: str, slug: str, limit=100, offset=0
+    ) -> dict:
+        params = {'page[limit]': limit, 'page[offset]': offset}
+        response = await self._request(
+            'GET', f'/v2/flows/{slug}/entries', access_token, params=params
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def update_flow_entry(
+            self, access_token: str, slug: str, entry_id: str, fields: dict
+    ) -> dict:
+        payload = {
+            'data': {
+                "type": "entry",
+                "id": entry_id,
+                **fields,
+            },
+        }
+        response = await self._request(
+            'PUT', f'/v2/flows/{slug}/entries/{entry_id}', access_token,
+            json=payload
+        )
+        response.raise_for_status()
+        return response.json()['data']
+
+    async def delete_flow_entry(
+            self, access_token: str, slug: str, entry_id: str
+    ) -> None:
+        response = await self._request(
+            'DELETE', f'/v2/flows/{slug}/entries/{entry_id}', access_token
+        )
+        response.raise_for_status()
+
+    async def get_pizzerias(self, access_token: str):
+        return {
+            'data': [
+                entry async for entry in self.iter_flow_entries(
+                    access_token, 'pizzeria'
+                )
+            ],
+        }
+
+    async def create_customer_address(
+            self, access_token: str, tg_id: str, lat: float, lon: float,
+            address: str
+    ):
+        payload = {
+            'data': {
+                "type": "entry",
+                "address": address,
+                "lat": lat,
+                "lon": lon,
+                "tg_id": tg_id
+            },
+        }
+        response = await self._request(
+            'POST', '/v2/flows/customer_address/entries', access_token,
+            json=payload
+        )
+        response.raise_for_status()
+        return response.json()['data']['id']
+
@@ -0,0 +1,20 @@
+class PhotoCache:
+    """
+    Хранит в Redis соответствие id изображения в Moltin и file_id,
+    который Telegram выдал после первой отправки этой картинки.
+    Повторные отправки идут по file_id без скачивания картинки с CDN.
+    """
+
+    def __init__(self, redis_client, redis_key: str = 'tg_photo_file_ids'):
+        self._redis = redis_client
+        self._redis_key = redis_key
+
+    def get(self, image_id: str):
+        file_id = self._redis.hget(self._redis_key, image_id)
+        return file_id.decode('utf-8') if file_id else None
+
+    def set(self, image_id: str, file_id: str):
+        self._redis.hset(self._redis_key, image_id, file_id)
+
+    def forget(self, image_id: str):
+        self._redis.hdel(self._redis_key, image_id)
@@ -0,0 +1,137 @@
+import heapq
+import math
+import threading
+import time
+
+import moltin
+from geofunctions import get_distance, to_unit_vector
+from token_manager import get_access_token
+
+
+# Great-circle distance on a sphere differs from the WGS-84 geodesic by
+# less than 0.6%, so every pizzeria that can be geodesically nearer than
+# the chord-nearest one lies within this factor of its chord distance.
+REFINE_MARGIN = 1.02
+
+
+def _squared_distance(point1: tuple, point2: tuple) -> float:
+    return sum((a - b) ** 2 for a, b in zip(point1, point2))
+
+
+class KDTree:
+    """KD-дерево по трёхмерным точкам (единичным векторам на сфере)."""
+
+    def __init__(self, points: list):
+        self._points = points
+        self._root = self._build(list(range(len(points))), depth=0)
+
+    def _build(self, indexes: list, depth: int):
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda index: self._points[index][axis])
+        median = len(indexes) // 2
+        return (
+            indexes[median],
+            axis,
+            self._build(indexes[:median], depth + 1),
+            self._build(indexes[median + 1:], depth + 1),
+        )
+
+    def nearest(self, point: tuple, k: int = 1) -> list:
+        """Возвращает k пар (квадрат расстояния, индекс) по возрастанию."""
+        heap = []  # max-heap of (-squared distance, index)
+
+        def visit(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            squared_distance = _squared_distance(point, self._points[index])
+            if len(heap) < k:
+                heapq.heappush(heap, (-squared_distance, index))
+            elif squared_distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-squared_distance, index))
+            diff = point[axis] - self._points[index][axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if len(heap) < k or diff * diff < -heap[0][0]:
+                visit(far)
+
+        visit(self._root)
+        return sorted((-distance, index) for distance, index in heap)
+
+    def within(self, point: tuple, squared_radius: float) -> list:
+        found = []
+
+        def visit(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            if _squared_distance(point, self._points[index]) <= squared_radius:
+                found.append(index)
+            diff = point[axis] - self._points[index][axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if diff * diff <= squared_radius:
+                visit(far)
+
+        visit(self._root)
+        return found
+
+
+class PizzeriaLocator:
+    """
+    Поиск ближайших пиццерий. Пиццерии загружаются из Moltin один раз
+    за ttl секунд, кандидаты отбираются по KD-дереву, а итоговый порядок
+    определяется точным геодезическим расстоянием.
+    """
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Replaced as one tuple so that readers never pair new pizzerias
+        # with the tree built for the old ones.
+        self._index = ([], KDTree([]))
+        self._loaded_at = 0
+
+    def load(self, pizzerias: list):
+        tree = KDTree([
+            to_unit_vector((pizzeria['lat'], pizzeria['lon']))
+            for pizzeria in pizzerias
+        ])
+        self._index = (pizzerias, tree)
+        self._loaded_at = time.time()
+
+    def _ensure_loaded(self):
+        if self._loaded_at + self.ttl >= time.time():
+            return
+        with self._lock:
+            if self._loaded_at + self.ttl < time.time():
+                self.load(moltin.get_pizzerias(get_access_token())['data'])
+
+    def nearest(self, location: tuple, k: int = 1) -> list:
+        """Возвращает до k пар (пиццерия, расстояние в км) по возрастанию."""
+        self._ensure_loaded()
+        pizzerias, tree = self._index
+        point = to_unit_vector(location)
+        candidates = tree.nearest(point, k)
+        if not candidates:
+            return []
+        radius = math.sqrt(candidates[-1][0]) * REFINE_MARGIN
+        refined = [
+            (
+                get_distance(
+                    location,
+                    (pizzerias[index]['lat'], pizzerias[index]['lon'])
+                ),
+                index,
+            )
+            for index in tree.within(point, radius ** 2)
+        ]
+        refined.sort()
+        return [(pizzerias[index], distance) for distance, index in refined[:k]]
+
+    def find_nearest(self, location: tuple):
+        """Возвращает (пиццерия, расстояние в км) или None, если пиццерий нет."""
+        found = self.nearest(location, k=1)
+        return found[0] if found else None
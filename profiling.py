@@ -0,0 +1,329 @@
+import argparse
+import collections
+import cProfile
+import hmac
+import itertools
+import json
+import os
+import pstats
+import statistics
+import sys
+import threading
+import time
+
+import metrics
+
+
+DEFAULT_PROFILE_DIR = 'profiles'
+DEFAULT_MAX_FILES = 500
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds
+TOP_FUNCTIONS_SAVED = 200
+
+
+def hash_chat_id(chat_id, salt: bytes):
+    """
+    HMAC от chat_id с секретом salt. Без секрета возвращает None:
+    хэш без соли по небольшому пространству chat_id легко обратить.
+    """
+    if not salt:
+        return None
+    return hmac.new(salt, str(chat_id).encode(), 'sha256').hexdigest()[:16]
+
+
+def _function_name(filename: str, lineno: int, name: str) -> str:
+    return f'{os.path.basename(filename)}:{lineno}({name})'
+
+
+def summarize_calls(calls: list) -> dict:
+    backends = {}
+    for (backend, endpoint), duration, failed in calls:
+        summary = backends.setdefault(
+            f'{backend} {endpoint}', {'calls': 0, 'ms': 0.0, 'errors': 0}
+        )
+        summary['calls'] += 1
+        summary['ms'] += duration * 1000
+        summary['errors'] += failed
+    for summary in backends.values():
+        summary['ms'] = round(summary['ms'], 3)
+    return backends
+
+
+class ProfileStore:
+    """
+    Профили в каталоге, по одному JSON-файлу на обновление.
+    Когда файлов больше max_files, самые старые удаляются.
+    """
+
+    def __init__(self, path: str = DEFAULT_PROFILE_DIR,
+                 max_files: int = DEFAULT_MAX_FILES):
+        self.path = path
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._files = collections.deque(sorted(
+            name for name in os.listdir(path) if name.endswith('.json')
+        ))
+
+    def save(self, profile: dict):
+        name = f"{time.time_ns()}-{profile['state']}.json"
+        with open(os.path.join(self.path, name), 'w', encoding='utf-8') as file:
+            json.dump(profile, file, ensure_ascii=False)
+        with self._lock:
+            self._files.append(name)
+            expired = []
+            while len(self._files) > self.max_files:
+                expired.append(self._files.popleft())
+        for name in expired:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def load(self):
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.path, name), encoding='utf-8') as file:
+                        yield json.load(file)
+                except (OSError, ValueError):
+                    continue  # rotated away or still being written
+
+
+class StackSampler:
+    """
+    Раз в interval секунд снимает стеки потоков, которые сейчас
+    обрабатывают обновления, и считает, в каких функциях они были.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._buffers = {}
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def start(self, thread_id: int):
+        with self._lock:
+            self._buffers[thread_id] = {
+                'samples': 0,
+                'self': collections.Counter(),
+                'cumulative': collections.Counter(),
+            }
+
+    def stop(self, thread_id: int) -> dict:
+        with self._lock:
+            return self._buffers.pop(thread_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._buffers:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, buffer in self._buffers.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    buffer['samples'] += 1
+                    code = frame.f_code
+                    buffer['self'][
+                        (code.co_filename, code.co_firstlineno, code.co_name)
+                    ] += 1
+                    seen = set()
+                    while frame is not None:
+                        code = frame.f_code
+                        seen.add(
+                            (code.co_filename, code.co_firstlineno, code.co_name)
+                        )
+                        frame = frame.f_back
+                    buffer['cumulative'].update(seen)
+
+    def functions(self, buffer: dict) -> list:
+        interval_ms = self.interval * 1000
+        return [
+            {
+                'function': _function_name(*key),
+                'calls': None,
+                'self_ms': round(buffer['self'][key] * interval_ms, 3),
+                'cumulative_ms': round(count * interval_ms, 3),
+            }
+            for key, count in buffer['cumulative'].most_common(
+                TOP_FUNCTIONS_SAVED
+            )
+        ]
+
+
+def _cprofile_functions(profile: cProfile.Profile) -> list:
+    stats = pstats.Stats(profile).stats
+    top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            'function': _function_name(*key),
+            'calls': calls,
+            'self_ms': round(self_time * 1000, 3),
+            'cumulative_ms': round(cumulative_time * 1000, 3),
+        }
+        for key, (_, calls, self_time, cumulative_time, _) in top[:TOP_FUNCTIONS_SAVED]
+    ]
+
+
+class _NoopProfile:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NOOP = _NoopProfile()
+
+
+class _UpdateProfile:
+    def __init__(self, profiler, state: str, chat_id, use_cprofile: bool):
+        self._profiler = profiler
+        self._state = state
+        self._chat_id = chat_id
+        self._cprofile = cProfile.Profile() if use_cprofile else None
+        self._record_calls = metrics.record_calls()
+
+    def __enter__(self):
+        self._calls = self._record_calls.__enter__()
+        if self._cprofile:
+            self._cprofile.enable()
+        else:
+            self._profiler.sampler.start(threading.get_ident())
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._started_at
+        if self._cprofile:
+            self._cprofile.disable()
+        else:
+            buffer = self._profiler.sampler.stop(threading.get_ident())
+        self._record_calls.__exit__(exc_type, exc_value, traceback)
+
+        if not self._cprofile and duration < self._profiler.threshold:
+            return
+        self._profiler.store.save({
+            'time': time.time(),
+            'state': self._state,
+            'chat': hash_chat_id(self._chat_id, self._profiler.salt),
+            'duration_ms': round(duration * 1000, 3),
+            'mode': 'cprofile' if self._cprofile else 'sampler',
+            'error': exc_type.__name__ if exc_type else None,
+            'backends': summarize_calls(self._calls),
+            'functions': _cprofile_functions(self._cprofile) if self._cprofile
+            else self._profiler.sampler.functions(buffer),
+        })
+
+
+class Profiler:
+    """
+    Профилирует выборку обновлений: каждое every-е - через cProfile,
+    остальные - семплером стеков, но сохраняет их, только если
+    обработка заняла дольше threshold секунд. Чаты в профилях
+    обозначены HMAC от chat_id с секретом salt; без него - не обозначены.
+    """
+
+    def __init__(self, store: ProfileStore = None, every: int = 0,
+                 threshold: float = None,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+                 salt: bytes = None):
+        self.store = store
+        self.salt = salt
+        self.every = every
+        self.threshold = threshold
+        self.enabled = bool(every or threshold is not None)
+        self.sampler = StackSampler(sample_interval) \
+            if threshold is not None else None
+        self._counter = itertools.count(1)
+
+    @classmethod
+    def from_env(cls):
+        every = int(os.getenv('PROFILE_EVERY', 0))
+        slow_ms = os.getenv('PROFILE_SLOW_MS')
+        if not every and slow_ms is None:
+            return cls()
+        return cls(
+            ProfileStore(
+                os.getenv('PROFILE_DIR', DEFAULT_PROFILE_DIR),
+                int(os.getenv('PROFILE_MAX_FILES', DEFAULT_MAX_FILES)),
+            ),
+            every=every,
+            threshold=float(slow_ms) / 1000 if slow_ms is not None else None,
+            sample_interval=float(os.getenv(
+                'PROFILE_SAMPLE_INTERVAL_MS', DEFAULT_SAMPLE_INTERVAL * 1000
+            )) / 1000,
+            salt=os.getenv('PROFILE_SALT', '').encode() or None,
+        )
+
+    def profile(self, state: str, chat_id):
+        if not self.enabled:
+            return _NOOP
+        sampled = bool(self.every) and next(self._counter) % self.every == 0
+        if not sampled and self.sampler is None:
+            return _NOOP
+        return _UpdateProfile(self, state, chat_id, use_cprofile=sampled)
+
+
+def report(profiles, top: int, state_filter: str = None):
+    by_state = collections.defaultdict(list)
+    for profile in profiles:
+        if state_filter is None or profile['state'] == state_filter:
+            by_state[profile['state']].append(profile)
+
+    for state, state_profiles in sorted(by_state.items()):
+        durations = [profile['duration_ms'] for profile in state_profiles]
+        print(
+            f'\n{state}: профилей {len(state_profiles)}, '
+            f'медиана {statistics.median(durations):.1f} мс, '
+            f'максимум {max(durations):.1f} мс'
+        )
+        functions = collections.defaultdict(lambda: [0.0, 0.0])
+        for profile in state_profiles:
+            for function in profile['functions']:
+                functions[function['function']][0] += function['self_ms']
+                functions[function['function']][1] += function['cumulative_ms']
+        print(f'  {"собств., мс":>12}{"всего, мс":>12}  функция')
+        for name, (self_ms, cumulative_ms) in sorted(
+                functions.items(), key=lambda item: item[1][0], reverse=True
+        )[:top]:
+            print(f'  {self_ms:>12.1f}{cumulative_ms:>12.1f}  {name}')
+
+        backends = collections.defaultdict(lambda: [0, 0.0, 0])
+        for profile in state_profiles:
+            for endpoint, summary in profile['backends'].items():
+                backends[endpoint][0] += summary['calls']
+                backends[endpoint][1] += summary['ms']
+                backends[endpoint][2] += summary['errors']
+        if backends:
+            print(f'  {"вызовов":>12}{"всего, мс":>12}{"ошибок":>8}  сервис')
+            for endpoint, (calls, ms, errors) in sorted(
+                    backends.items(), key=lambda item: item[1][1], reverse=True
+            ):
+                print(f'  {calls:>12}{ms:>12.1f}{errors:>8}  {endpoint}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Самые горячие функции по состояниям бота '
+                    'из сохранённых профилей'
+    )
+    parser.add_argument('--dir', default=DEFAULT_PROFILE_DIR)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--state', help='только это состояние')
+    parser.add_argument('--mode', choices=['cprofile', 'sampler'],
+                        help='только профили cProfile или семплера')
+    args = parser.parse_args()
+
+    profiles = (
+        profile for profile in ProfileStore(args.dir).load()
+        if args.mode is None or profile['mode'] == args.mode
+    )
+    report(profiles, args.top, args.state)
+
+
+if __name__ == '__main__':
+    main()
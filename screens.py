@@ -0,0 +1,125 @@
+from collections import namedtuple
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+
+Screen = namedtuple(
+    'Screen', ['text', 'reply_markup', 'photo', 'parse_mode'],
+    defaults=[None, None, None],
+)
+
+
+def _markup_as_dict(reply_markup):
+    return reply_markup.to_dict() if reply_markup else None
+
+
+def _shown_screen(session, message_id):
+    """
+    Последний экран, показанный в сообщении message_id, из поля `screen`
+    сессии. Из самого сообщения его не восстановить: python-telegram-bot 11
+    не разбирает reply_markup, а текст приходит без разметки и пробелов
+    по краям.
+    """
+    shown = session.get('screen')
+    if shown is None or shown['message_id'] != message_id:
+        return None
+    return shown
+
+
+def _remember(session, message, screen: Screen):
+    session.set('screen', {
+        'message_id': message.message_id,
+        'text': screen.text,
+        'parse_mode': screen.parse_mode,
+        'photo': screen.photo,
+        'reply_markup': _markup_as_dict(screen.reply_markup),
+    })
+
+
+def _send(bot, chat_id, screen: Screen):
+    if screen.photo:
+        return bot.send_photo(
+            chat_id=chat_id, photo=screen.photo, caption=screen.text,
+            reply_markup=screen.reply_markup, parse_mode=screen.parse_mode,
+        )
+    return bot.send_message(
+        chat_id=chat_id, text=screen.text,
+        reply_markup=screen.reply_markup, parse_mode=screen.parse_mode,
+    )
+
+
+def _replace(bot, chat_id, message, screen: Screen):
+    new_message = _send(bot, chat_id, screen)
+    bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+    return new_message
+
+
+def _edit(bot, chat_id, session, message, screen: Screen):
+    shown = _shown_screen(session, message.message_id)
+    edit_kwargs = {'chat_id': chat_id, 'message_id': message.message_id}
+
+    if shown is None:
+        # Nothing is known about the message, so edit all of it.
+        shown_photo = message.photo[-1].file_id if message.photo else None
+        text_changed = markup_changed = True
+    else:
+        shown_photo = shown['photo']
+        text_changed = (shown['text'], shown['parse_mode']) \
+            != (screen.text, screen.parse_mode)
+        markup_changed = shown['reply_markup'] \
+            != _markup_as_dict(screen.reply_markup)
+
+    if screen.photo and shown_photo != screen.photo:
+        return bot.edit_message_media(
+            media=InputMediaPhoto(
+                screen.photo, caption=screen.text, parse_mode=screen.parse_mode
+            ),
+            reply_markup=screen.reply_markup,
+            **edit_kwargs,
+        )
+    if text_changed and screen.photo:
+        return bot.edit_message_caption(
+            caption=screen.text, reply_markup=screen.reply_markup,
+            parse_mode=screen.parse_mode, **edit_kwargs,
+        )
+    if text_changed:
+        return bot.edit_message_text(
+            text=screen.text, reply_markup=screen.reply_markup,
+            parse_mode=screen.parse_mode, **edit_kwargs,
+        )
+    if markup_changed:
+        return bot.edit_message_reply_markup(
+            reply_markup=screen.reply_markup, **edit_kwargs,
+        )
+    return message
+
+
+def render(bot, session, screen: Screen, message=None):
+    """
+    Показывает экран screen самым дешёвым способом.
+
+    message - сообщение бота, которое сейчас на экране. Если его нет,
+    отправляется новое сообщение. Если тип сообщения тот же (текст или
+    фото), оно редактируется, причём меняется только то, что отличается
+    от последнего экрана, показанного в этом сообщении; если экран
+    не изменился, запросов к Telegram нет. Показанный экран хранится
+    в сессии чата и сохраняется вместе с ней. Если тип другой -
+    отправляется новое сообщение, а старое удаляется.
+    """
+    chat_id = session.chat_id
+    if message is None:
+        shown_message = _send(bot, chat_id, screen)
+    elif bool(screen.photo) != bool(message.photo):
+        shown_message = _replace(bot, chat_id, message, screen)
+    else:
+        try:
+            shown_message = _edit(bot, chat_id, session, message, screen)
+        except BadRequest as err:
+            if 'not modified' in str(err):
+                shown_message = message
+            else:
+                # E.g. the message is too old to be edited.
+                shown_message = _replace(bot, chat_id, message, screen)
+    _remember(session, shown_message, screen)
+    return shown_message
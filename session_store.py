@@ -0,0 +1,104 @@
+import json
+
+
+class Session:
+    """
+    Данные одного чата: состояние диалога, данные доставки, корзина.
+    Запоминает, какие поля изменились, чтобы записать только их.
+    """
+
+    def __init__(self, chat_id, fields: dict, changed=(), legacy_keys=()):
+        self.chat_id = chat_id
+        self._fields = fields
+        self.changed = set(changed)
+        # Keys of earlier bot versions to delete once the hash is written.
+        self.legacy_keys = list(legacy_keys)
+
+    def get(self, name: str, default=None):
+        return self._fields.get(name, default)
+
+    def set(self, name: str, value):
+        if self._fields.get(name) != value or name not in self._fields:
+            self._fields[name] = value
+            self.changed.add(name)
+
+    @property
+    def state(self) -> str:
+        return self.get('state', 'START')
+
+    @state.setter
+    def state(self, value: str):
+        self.set('state', value)
+
+
+class SessionStore:
+    """
+    Хранит данные чата в одном хэше Redis `session:{chat_id}` с TTL.
+    Чтение и запись - по одному обращению к Redis (pipeline).
+    """
+
+    def __init__(
+            self, redis_client, ttl: int = 30 * 24 * 3600,
+            key_prefix: str = 'session:'
+    ):
+        self._redis = redis_client
+        self.ttl = ttl
+        self._key_prefix = key_prefix
+
+    def _key(self, chat_id) -> str:
+        return f'{self._key_prefix}{chat_id}'
+
+    def load(self, chat_id) -> Session:
+        raw_fields = self._redis.hgetall(self._key(chat_id))
+        fields = {
+            name.decode('utf-8'): json.loads(value)
+            for name, value in raw_fields.items()
+        }
+        if fields:
+            return Session(chat_id, fields)
+        return self._load_legacy(chat_id)
+
+    def _load_legacy(self, chat_id) -> Session:
+        """Читает ключи, которые писали прежние версии бота."""
+        legacy_state, legacy_delivery_data = self._redis.mget(
+            chat_id, f'{chat_id}_delivery_data'
+        )
+        fields = {}
+        legacy_keys = []
+        if legacy_state:
+            fields['state'] = legacy_state.decode('utf-8')
+            legacy_keys.append(chat_id)
+        if legacy_delivery_data:
+            fields['delivery_data'] = json.loads(legacy_delivery_data)
+            legacy_keys.append(f'{chat_id}_delivery_data')
+        return Session(
+            chat_id, fields, changed=fields, legacy_keys=legacy_keys
+        )
+
+    def save(self, session: Session):
+        if not session.changed:
+            return
+        self.save_fields(
+            session.chat_id,
+            legacy_keys=session.legacy_keys,
+            **{name: session.get(name) for name in session.changed}
+        )
+        session.changed.clear()
+        session.legacy_keys = []
+
+    def save_fields(self, chat_id, legacy_keys=(), **fields):
+        key = self._key(chat_id)
+        pipeline = self._redis.pipeline(transaction=False)
+        empty_fields = [name for name, value in fields.items() if value is None]
+        if empty_fields:
+            pipeline.hdel(key, *empty_fields)
+        mapping = {
+            name: json.dumps(value)
+            for name, value in fields.items() if value is not None
+        }
+        if mapping:
+            pipeline.hset(key, mapping=mapping)
+        pipeline.expire(key, self.ttl)
+        if legacy_keys:
+            pipeline.delete(*legacy_keys)
+        pipeline.execute()
@@ -0,0 +1,589 @@
+"""
+Локальная заглушка Moltin API и геокодера Яндекса для бенчмарков.
+
+Поддерживает эндпоинты, которые использует бот: oauth, products, files,
+carts, customers, flows/fields/entries и геокодер. Данные берутся из
+menu.json и addresses.json. Можно задать задержку и долю ошибок,
+записать реальный трафик (--record) и воспроизвести его (--replay).
+"""
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from load_test_data import load_pizzerias, load_products
+from metrics import path_template
+
+
+GEOCODER_PATH = '/geocoder/1.x'
+
+
+def _format_price(amount) -> str:
+    return f'₽{amount:.2f}'
+
+
+class StubData:
+    """Состояние заглушки в памяти: товары, файлы, корзины, flows."""
+
+    def __init__(self, menu_path='menu.json', addresses_path='addresses.json'):
+        self.lock = threading.Lock()
+        self.products = collections.OrderedDict()
+        self.files = {}
+        self.carts = collections.defaultdict(list)
+        self.customers = []
+        self.flows = {}
+        self.fields = []
+        self.entries = collections.defaultdict(collections.OrderedDict)
+        for product_data in load_products(menu_path):
+            product = self.create_product(product_data)
+            image_id = self.create_file(product_data['image_url'])['id']
+            product['relationships'] = {
+                'main_image': {'data': {'type': 'main_image', 'id': image_id}}
+            }
+        for slug in ('pizzeria', 'customer_address'):
+            self.create_flow({'slug': slug, 'name': slug})
+        for pizzeria in load_pizzerias(addresses_path):
+            self.create_entry('pizzeria', {
+                **pizzeria,
+                'couriertg': os.getenv('COURIER_TG_ID', '1'),
+            })
+
+    def create_product(self, fields: dict) -> dict:
+        product = {
+            'type': 'product',
+            'id': str(uuid.uuid4()),
+            'name': fields.get('name'),
+            'slug': fields.get('slug') or fields.get('sku'),
+            'sku': fields.get('sku'),
+            'description': fields.get('description'),
+            'manage_stock': False,
+            'price': fields.get('price') if isinstance(fields.get('price'), list)
+            else [{'amount': fields.get('price'), 'currency': 'RUB',
+                   'includes_tax': True}],
+            'status': fields.get('status', 'live'),
+            'commodity_type': 'physical',
+            'relationships': {},
+        }
+        self.products[product['id']] = product
+        return product
+
+    def create_file(self, url: str) -> dict:
+        file = {
+            'type': 'file',
+            'id': str(uuid.uuid4()),
+            'link': {'href': url},
+        }
+        self.files[file['id']] = file
+        return file
+
+    def create_flow(self, fields: dict) -> dict:
+        flow = {'type': 'flow', 'id': str(uuid.uuid4()), **fields}
+        self.flows[fields['slug']] = flow
+        return flow
+
+    def create_entry(self, slug: str, fields: dict) -> dict:
+        entry = {'type': 'entry', 'id': str(uuid.uuid4()), **fields}
+        entry.pop('relationships', None)
+        self.entries[slug][entry['id']] = entry
+        return entry
+
+    def cart_response(self, cart_ref: str) -> dict:
+        items = self.carts[cart_ref]
+        total = sum(item['value']['amount'] for item in items)
+        return {
+            'data': items,
+            'meta': {'display_price': {'with_tax': {
+                'amount': total, 'currency': 'RUB',
+                'formatted': _format_price(total),
+            }}},
+        }
+
+    def set_cart_quantity(self, item: dict, quantity: int):
+        unit_amount = item['unit_price']['amount']
+        item['quantity'] = quantity
+        item['value'] = {'amount': unit_amount * quantity, 'currency': 'RUB',
+                         'includes_tax': True}
+        item['meta'] = {'display_price': {'with_tax': {
+            'unit': {'amount': unit_amount, 'currency': 'RUB',
+                     'formatted': _format_price(unit_amount)},
+            'value': {'amount': unit_amount * quantity, 'currency': 'RUB',
+                      'formatted': _format_price(unit_amount * quantity)},
+        }}}
+
+    def add_to_cart(self, cart_ref: str, product_id: str, quantity: int):
+        product = self.products.get(product_id)
+        if product is None:
+            return None
+        for item in self.carts[cart_ref]:
+            if item['product_id'] == product_id:
+                self.set_cart_quantity(item, item['quantity'] + quantity)
+                return item
+        item = {
+            'type': 'cart_item',
+            'id': str(uuid.uuid4()),
+            'product_id': product_id,
+            'name': product['name'],
+            'sku': product['sku'],
+            'unit_price': {'amount': product['price'][0]['amount'],
+                           'currency': 'RUB', 'includes_tax': True},
+        }
+        self.set_cart_quantity(item, quantity)
+        self.carts[cart_ref].append(item)
+        return item
+
+
+def _page(items: list, query: dict) -> dict:
+    limit = int(query.get('page[limit]', ['100'])[0])
+    offset = int(query.get('page[offset]', ['0'])[0])
+    return {
+        'data': items[offset:offset + limit],
+        'meta': {
+            'page': {
+                'limit': limit, 'offset': offset,
+                'current': offset // limit + 1,
+                'total': max((len(items) + limit - 1) // limit, 1),
+            },
+            'results': {'total': len(items)},
+        },
+    }
+
+
+def _geocode(data: StubData, address: str) -> dict:
+    members = []
+    if 'nowhere' not in address.lower():
+        with data.lock:
+            pizzerias = list(data.entries['pizzeria'].values())
+        for pizzeria in pizzerias:
+            if pizzeria['address'].lower() == address.lower():
+                lat, lon = pizzeria['lat'], pizzeria['lon']
+                break
+        else:
+            # A stable point in Moscow derived from the address text.
+            digest = hashlib.sha1(address.encode()).digest()
+            lat = 55.55 + digest[0] / 255 * 0.4
+            lon = 37.35 + digest[1] / 255 * 0.5
+        members.append({'GeoObject': {'Point': {'pos': f'{lon} {lat}'}}})
+    return {'response': {'GeoObjectCollection': {'featureMember': members}}}
+
+
+class Routes:
+    """Обработчики эндпоинтов Moltin: (метод, шаблон пути) -> функция."""
+
+    def __init__(self, data: StubData):
+        self.data = data
+        self.table = [
+            ('POST', r'/oauth/access_token', self.token),
+            ('GET', r'/v2/products', self.list_products),
+            ('POST', r'/v2/products', self.create_product),
+            ('GET', r'/v2/products/(?P<id>[^/]+)', self.get_product),
+            ('PUT', r'/v2/products/(?P<id>[^/]+)', self.update_product),
+            ('DELETE', r'/v2/products/(?P<id>[^/]+)', self.delete_product),
+            ('POST', r'/v2/products/(?P<id>[^/]+)/relationships/main-image',
+             self.set_main_image),
+            ('GET', r'/v2/files/(?P<id>[^/]+)', self.get_file),
+            ('POST', r'/v2/files', self.create_file),
+            ('GET', r'/v2/carts/(?P<ref>[^/]+)/items', self.get_cart),
+            ('POST', r'/v2/carts/(?P<ref>[^/]+)/items', self.add_to_cart),
+            ('DELETE', r'/v2/carts/(?P<ref>[^/]+)/items', self.clear_cart),
+            ('PUT', r'/v2/carts/(?P<ref>[^/]+)/items/(?P<id>[^/]+)',
+             self.update_cart_item),
+            ('GET', r'/v2/customers', self.list_customers),
+            ('POST', r'/v2/customers', self.create_customer),
+            ('GET', r'/v2/flows', self.list_flows),
+            ('POST', r'/v2/flows', self.create_flow),
+            ('POST', r'/v2/fields', self.create_field),
+            ('GET', r'/v2/flows/(?P<slug>[^/]+)/entries', self.list_entries),
+            ('POST', r'/v2/flows/(?P<slug>[^/]+)/entries', self.create_entry),
+            ('PUT', r'/v2/flows/(?P<slug>[^/]+)/entries/(?P<id>[^/]+)',
+             self.update_entry),
+            ('DELETE', r'/v2/flows/(?P<slug>[^/]+)/entries/(?P<id>[^/]+)',
+             self.delete_entry),
+        ]
+        self.table = [
+            (method, re.compile(f'^{pattern}$'), handler)
+            for method, pattern, handler in self.table
+        ]
+
+    def resolve(self, method: str, path: str):
+        for route_method, pattern, handler in self.table:
+            match = pattern.match(path)
+            if route_method == method and match:
+                return handler, match.groupdict()
+        return None, {}
+
+    def token(self, query, body, **_):
+        return 200, {
+            'access_token': uuid.uuid4().hex,
+            'expires': int(time.time()) + 3600,
+            'expires_in': 3600,
+            'token_type': 'Bearer',
+            'identifier': 'client_credentials',
+        }
+
+    def list_products(self, query, body, **_):
+        return 200, _page(list(self.data.products.values()), query)
+
+    def create_product(self, query, body, **_):
+        return 201, {'data': self.data.create_product(body['data'])}
+
+    def get_product(self, query, body, id):
+        product = self.data.products.get(id)
+        if product is None:
+            return 404, {'errors': [{'status': 404, 'title': 'Not Found'}]}
+        return 200, {'data': product}
+
+    def update_product(self, query, body, id):
+        product = self.data.products.get(id)
+        if product is None:
+            return 404, {'errors': [{'status': 404, 'title': 'Not Found'}]}
+        product.update(
+            {key: value for key, value in body['data'].items()
+             if key not in ('id', 'type')}
+        )
+        return 200, {'data': product}
+
+    def delete_product(self, query, body, id):
+        self.data.products.pop(id, None)
+        return 204, None
+
+    def set_main_image(self, query, body, id):
+        product = self.data.products.get(id)
+        if product is None:
+            return 404, {'errors': [{'status': 404, 'title': 'Not Found'}]}
+        product['relationships']['main_image'] = {'data': body['data']}
+        return 200, {'data': body['data']}
+
+    def get_file(self, query, body, id):
+        file = self.data.files.get(id)
+        if file is None:
+            return 404, {'errors': [{'status': 404, 'title': 'Not Found'}]}
+        return 200, {'data': file}
+
+    def create_file(self, query, body, **_):
+        return 201, {'data': self.data.create_file(body['file_location'])}
+
+    def get_cart(self, query, body, ref):
+        return 200, self.data.cart_response(ref)
+
+    def add_to_cart(self, query, body, ref):
+        item = self.data.add_to_cart(
+            ref, body['data']['id'], int(body['data']['quantity'])
+        )
+        if item is None:
+            return 400, {'errors': [{'status': 400, 'title': 'Bad Request'}]}
+        return 201, self.data.cart_response(ref)
+
+    def clear_cart(self, query, body, ref):
+        self.data.carts.pop(ref, None)
+        return 200, {'data': []}
+
+    def update_cart_item(self, query, body, ref, id):
+        quantity = int(body['data']['quantity'])
+        items = self.data.carts[ref]
+        for item in items:
+            if item['id'] == id:
+                if quantity > 0:
+                    self.data.set_cart_quantity(item, quantity)
+                else:
+                    items.remove(item)
+                break
+        return 200, self.data.cart_response(ref)
+
+    def list_customers(self, query, body, **_):
+        customers = self.data.customers
+        email_filter = re.match(r'eq\(email,(.*)\)', query.get('filter', [''])[0])
+        if email_filter:
+            customers = [customer for customer in customers
+                         if customer['email'] == email_filter.group(1)]
+        return 200, {'data': customers}
+
+    def create_customer(self, query, body, **_):
+        customer = {'type': 'customer', 'id': str(uuid.uuid4()),
+                    'name': body['data']['name'],
+                    'email': body['data']['email']}
+        self.data.customers.append(customer)
+        return 201, {'data': customer}
+
+    def list_flows(self, query, body, **_):
+        return 200, {'data': list(self.data.flows.values())}
+
+    def create_flow(self, query, body, **_):
+        return 201, {'data': self.data.create_flow(body['data'])}
+
+    def create_field(self, query, body, **_):
+        field = {**body['data'], 'id': str(uuid.uuid4())}
+        self.data.fields.append(field)
+        return 201, {'data': field}
+
+    def list_entries(self, query, body, slug):
+        return 200, _page(list(self.data.entries[slug].values()), query)
+
+    def create_entry(self, query, body, slug):
+        return 201, {'data': self.data.create_entry(slug, body['data'])}
+
+    def update_entry(self, query, body, slug, id):
+        entry = self.data.entries[slug].get(id)
+        if entry is None:
+            return 404, {'errors': [{'status': 404, 'title': 'Not Found'}]}
+        entry.update(
+            {key: value for key, value in body['data'].items() if key != 'type'}
+        )
+        return 200, {'data': entry}
+
+    def delete_entry(self, query, body, slug, id):
+        self.data.entries[slug].pop(id, None)
+        return 204, None
+
+
+class Recorder:
+    """Пишет реальные ответы в JSON Lines и воспроизводит их."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._replay = collections.defaultdict(list)
+        self._positions = collections.defaultdict(itertools.count)
+
+    def record(self, method, path, status, latency, body):
+        record = {
+            'method': method, 'path': path, 'template': path_template(path),
+            'status': status, 'latency_ms': round(latency * 1000, 1),
+            'body': body,
+        }
+        with self.lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    self._replay[(record['method'], record['template'])].append(
+                        record
+                    )
+
+    def replay(self, method, path):
+        records = self._replay.get((method, path_template(path)))
+        if not records:
+            return None
+        with self.lock:
+            position = next(self._positions[(method, path_template(path))])
+        return records[position % len(records)]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+            self, address=('127.0.0.1', 0), latency_ms=0.0, jitter_ms=0.0,
+            error_rate=0.0, record_to=None, replay_from=None,
+            upstream_url='https://api.moltin.com',
+            geocoder_upstream_url='https://geocode-maps.yandex.ru/1.x',
+            seed=None, menu_path='menu.json', addresses_path='addresses.json'
+    ):
+        super().__init__(address, StubRequestHandler)
+        self.data = StubData(menu_path, addresses_path)
+        self.routes = Routes(self.data)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.upstream_url = upstream_url.rstrip('/')
+        self.geocoder_upstream_url = geocoder_upstream_url.rstrip('/')
+        self.recorder = None
+        if record_to:
+            self.recorder = Recorder(record_to)
+        elif replay_from:
+            self.recorder = Recorder(replay_from)
+            self.recorder.load()
+        self.replaying = bool(replay_from)
+        self.stats_lock = threading.Lock()
+        self.calls = collections.Counter()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, method: str, path: str):
+        with self.stats_lock:
+            self.calls[f'{method} {path_template(path)}'] += 1
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return dict(self.calls)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.calls.clear()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw_body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if not raw_body:
+            return raw_body, {}
+        if content_type.startswith('application/json'):
+            return raw_body, json.loads(raw_body)
+        if content_type.startswith('multipart/form-data'):
+            found = re.search(
+                rb'name="(?P<name>[^"]+)"\r\n\r\n(?P<value>.*?)\r\n--',
+                raw_body, re.S,
+            )
+            if found:
+                return raw_body, {found['name'].decode(): found['value'].decode()}
+            return raw_body, {}
+        return raw_body, {
+            key: values[0] for key, values in parse_qs(raw_body.decode()).items()
+        }
+
+    def _reply(self, status: int, payload):
+        body = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        url = urlsplit(self.path)
+        raw_body, body = self._read_body()
+
+        if url.path == '/__stats':
+            self._reply(200, server.stats())
+            return
+        if url.path == '/__reset':
+            server.reset_stats()
+            self._reply(200, {})
+            return
+
+        server.count(self.command, url.path)
+        delay = server.latency_ms + server.random.uniform(0, server.jitter_ms)
+        if server.replaying:
+            record = server.recorder.replay(self.command, url.path)
+            if record is None:
+                self._reply(404, {'errors': [{'title': 'Not recorded'}]})
+                return
+            time.sleep((delay or record['latency_ms']) / 1000)
+            self._reply(record['status'], record['body'])
+            return
+        if delay:
+            time.sleep(delay / 1000)
+        if server.error_rate and server.random.random() < server.error_rate:
+            self._reply(500, {'errors': [{'status': 500, 'title': 'Injected'}]})
+            return
+        if server.recorder is not None:
+            self._proxy(url, raw_body)
+            return
+
+        query = parse_qs(url.query)
+        if url.path == GEOCODER_PATH:
+            self._reply(200, _geocode(server.data, query.get('geocode', [''])[0]))
+            return
+        if url.path != '/oauth/access_token' \
+                and not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._reply(401, {'errors': [{'status': 401, 'title': 'Unauthorized'}]})
+            return
+        handler, params = server.routes.resolve(self.command, url.path)
+        if handler is None:
+            self._reply(404, {'errors': [{'status': 404, 'title': 'Not Found'}]})
+            return
+        with server.data.lock:
+            status, payload = handler(query, body, **params)
+        self._reply(status, payload)
+
+    def _proxy(self, url, raw_body):
+        server = self.server
+        headers = {
+            key: value for key, value in self.headers.items()
+            if key.lower() in ('authorization', 'content-type', 'accept')
+        }
+        if url.path == GEOCODER_PATH:
+            upstream_url = server.geocoder_upstream_url \
+                + self.path[len(GEOCODER_PATH):]
+        else:
+            upstream_url = f'{server.upstream_url}{self.path}'
+        started_at = time.perf_counter()
+        response = requests.request(
+            self.command, upstream_url, headers=headers, data=raw_body,
+        )
+        latency = time.perf_counter() - started_at
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        server.recorder.record(
+            self.command, url.path, response.status_code, latency, payload
+        )
+        self._reply(response.status_code, payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Локальная заглушка Moltin API и геокодера Яндекса. '
+                    'Боту нужно задать MOLTIN_API_URL=http://HOST:PORT и '
+                    'YANDEX_GEOCODER_URL=http://HOST:PORT/geocoder/1.x'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='задержка каждого ответа, мс')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='случайная добавка к задержке, до N мс')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='доля ответов с ошибкой 500, от 0 до 1')
+    parser.add_argument('--seed', type=int, help='seed для задержек и ошибок')
+    parser.add_argument('--record', metavar='FILE',
+                        help='проксировать запросы в --upstream и '
+                             '--geocoder-upstream и записывать ответы')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='отвечать записанными ранее ответами')
+    parser.add_argument('--upstream', default='https://api.moltin.com')
+    parser.add_argument('--geocoder-upstream',
+                        default='https://geocode-maps.yandex.ru/1.x')
+    args = parser.parse_args()
+
+    server = StubServer(
+        (args.host, args.port), latency_ms=args.latency,
+        jitter_ms=args.jitter, error_rate=args.error_rate,
+        record_to=args.record, replay_from=args.replay,
+        upstream_url=args.upstream,
+        geocoder_upstream_url=args.geocoder_upstream, seed=args.seed,
+    )
+    print(f'Заглушка слушает {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import os
+
+import redis
+from dotenv import load_dotenv
+
+import moltin
+from bulk import RateLimiter, run_parallel
+from catalog import ProductCatalog
+from load_test_data import load_pizzerias, load_products
+from token_manager import get_access_token
+
+
+COORDINATE_TOLERANCE = 1e-6
+
+
+def get_product_changes(product_data: dict, product: dict) -> dict:
+    changes = {}
+    for field in ('name', 'description'):
+        if product.get(field) != product_data[field]:
+            changes[field] = product_data[field]
+    if product['price'][0]['amount'] != product_data['price']:
+        changes['price'] = [{
+            'amount': product_data['price'],
+            'currency': 'RUB',
+            'includes_tax': True,
+        }]
+    return changes
+
+
+def get_pizzeria_changes(pizzeria_data: dict, pizzeria: dict) -> dict:
+    changes = {}
+    if pizzeria.get('address') != pizzeria_data['address']:
+        changes['address'] = pizzeria_data['address']
+    for field in ('lat', 'lon'):
+        if pizzeria.get(field) is None or abs(
+                float(pizzeria[field]) - pizzeria_data[field]
+        ) > COORDINATE_TOLERANCE:
+            changes[field] = pizzeria_data[field]
+    return changes
+
+
+def diff(source: list, remote: list, key: str, get_changes) -> tuple:
+    """
+    Сравнивает данные из JSON с данными в Moltin по ключу key.
+    Возвращает списки: что создать, что изменить (запись, изменения)
+    и что удалить, включая дубликаты от прошлых загрузок.
+    """
+    remote_index, deletes = {}, []
+    for item in remote:
+        if item.get(key) in remote_index:
+            deletes.append(item)
+        else:
+            remote_index[item.get(key)] = item
+    creates, updates = [], []
+    for item_data in source:
+        item = remote_index.pop(item_data[key], None)
+        if item is None:
+            creates.append(item_data)
+            continue
+        changes = get_changes(item_data, item)
+        if changes:
+            updates.append((item, changes))
+    deletes += remote_index.values()
+    return creates, updates, deletes
+
+
+def single_call(call):
+    """Действие из одного запроса к Moltin."""
+    def run(argument, rate_limiter):
+        rate_limiter.acquire()
+        return call(argument)
+    return run
+
+
+def create_product(product_data: dict, rate_limiter):
+    rate_limiter.acquire()
+    product_id = moltin.create_product(get_access_token(), product_data)
+    rate_limiter.acquire()
+    image_id = moltin.create_file(get_access_token(), product_data['image_url'])
+    rate_limiter.acquire()
+    moltin.set_main_image_relationship(get_access_token(), product_id, image_id)
+
+
+def plan_products(path: str) -> list:
+    products = moltin.iter_products(get_access_token(), concurrency=4)
+    creates, updates, deletes = diff(
+        load_products(path), products, 'sku', get_product_changes
+    )
+    return (
+        [(f"создать товар {data['sku']}", create_product, data)
+         for data in creates]
+        + [(f"изменить товар {product['sku']}: {', '.join(changes)}",
+            single_call(lambda args: moltin.update_product(
+                get_access_token(), *args
+            )),
+            (product['id'], changes))
+           for product, changes in updates]
+        + [(f"удалить товар {product.get('sku')}",
+            single_call(lambda product_id: moltin.delete_product(
+                get_access_token(), product_id
+            )),
+            product['id'])
+           for product in deletes]
+    )
+
+
+def plan_pizzerias(path: str) -> list:
+    pizzerias = moltin.iter_flow_entries(
+        get_access_token(), 'pizzeria', concurrency=4
+    )
+    creates, updates, deletes = diff(
+        load_pizzerias(path), pizzerias, 'alias', get_pizzeria_changes
+    )
+    return (
+        [(f"создать пиццерию {data['alias']}",
+          single_call(
+              lambda data: moltin.create_pizzeria(get_access_token(), data)
+          ),
+          data)
+         for data in creates]
+        + [(f"изменить пиццерию {pizzeria['alias']}: {', '.join(changes)}",
+            single_call(lambda args: moltin.update_flow_entry(
+                get_access_token(), 'pizzeria', *args
+            )),
+            (pizzeria['id'], changes))
+           for pizzeria, changes in updates]
+        + [(f"удалить пиццерию {pizzeria.get('alias')}",
+            single_call(lambda entry_id: moltin.delete_flow_entry(
+                get_access_token(), 'pizzeria', entry_id
+            )),
+            pizzeria['id'])
+           for pizzeria in deletes]
+    )
+
+
+def apply_plan(title: str, plan: list, rate_limiter, workers: int, dry_run: bool):
+    for description, _, _ in plan:
+        print(description)
+    if not plan:
+        print(f'{title}: изменений нет')
+    if dry_run or not plan:
+        return
+
+    def apply(action):
+        # Actions acquire the limiter before each request they make.
+        _, func, argument = action
+        func(argument, rate_limiter)
+
+    run_parallel(title, plan, apply, workers)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description='Синхронизирует товары и пиццерии в Moltin '
+                    'с menu.json и addresses.json'
+    )
+    parser.add_argument('--menu', default='menu.json')
+    parser.add_argument('--addresses', default='addresses.json')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=20)
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='только показать изменения, ничего не записывать',
+    )
+    args = parser.parse_args()
+
+    rate_limiter = RateLimiter(args.rate)
+    moltin.configure(pool_size=args.workers)
+
+    product_plan = plan_products(args.menu)
+    apply_plan(
+        'Товары', product_plan, rate_limiter, args.workers, args.dry_run
+    )
+    apply_plan(
+        'Пиццерии', plan_pizzerias(args.addresses), rate_limiter,
+        args.workers, args.dry_run
+    )
+
+    if product_plan and not args.dry_run and os.getenv('REDIS_URL'):
+        ProductCatalog(
+            redis_client=redis.Redis.from_url(os.environ['REDIS_URL'])
+        ).invalidate()
+        # Running bots keep their in-memory copy until CATALOG_TTL expires.
+        print('Кэш каталога в Redis сброшен. Запущенные боты покажут '
+              'новое меню после истечения CATALOG_TTL или после перезапуска')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Выполнение связанных шагов в общем ограниченном пуле потоков.
+
+Шаг запускается, как только готовы шаги, от которых он зависит;
+независимые шаги идут одновременно. Результаты зависимостей передаются
+шагу именованными аргументами с именами этих шагов:
+
+    graph = TaskGraph('success_payment')
+    graph.add('summary', get_summary, chat_id)
+    graph.add('courier_message', send_summary, bot, after=('summary',))
+    get_task_executor().submit(graph)
+
+Если шаг упал, зависящие от него шаги не запускаются.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+
+logger = logging.getLogger(__file__)
+
+StepTiming = namedtuple('StepTiming', ['waited', 'ran'])  # seconds
+_Step = namedtuple('_Step', ['name', 'func', 'args', 'kwargs', 'after'])
+
+
+class DependencyFailed(Exception):
+    pass
+
+
+class TaskGraph:
+    def __init__(self, name: str):
+        self.name = name
+        self.steps = {}
+
+    def add(self, name: str, func, *args, after: tuple = (), **kwargs):
+        """
+        Добавляет шаг. Зависимости должны быть добавлены раньше,
+        поэтому циклов в графе быть не может.
+        """
+        if name in self.steps:
+            raise ValueError(f'{self.name}: step {name!r} already added')
+        unknown = [dependency for dependency in after if dependency not in self.steps]
+        if unknown:
+            raise ValueError(f'{self.name}: {name!r} depends on unknown {unknown}')
+        self.steps[name] = _Step(name, func, args, kwargs, tuple(after))
+        return self
+
+
+class GraphRun:
+    """Результаты, ошибки и время каждого шага одного запуска графа."""
+
+    def __init__(self, graph: TaskGraph):
+        self.graph = graph
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+        self.future = Future()
+        self._lock = threading.Lock()
+        self._waiting_for = {
+            name: set(step.after) for name, step in graph.steps.items()
+        }
+        self._remaining = len(graph.steps)
+
+    def ready_steps(self) -> list:
+        return [
+            self.graph.steps[name]
+            for name, dependencies in self._waiting_for.items()
+            if not dependencies
+        ]
+
+    def complete(self, name: str, result, error, timing: StepTiming) -> tuple:
+        """
+        Запоминает итог шага. Возвращает шаги, которые теперь можно
+        запустить, и признак того, что это был последний шаг.
+        """
+        with self._lock:
+            if error is None:
+                self.results[name] = result
+            else:
+                self.errors[name] = error
+            self.timings[name] = timing
+            self._remaining -= 1
+            del self._waiting_for[name]
+            ready = []
+            for dependent, dependencies in self._waiting_for.items():
+                if name in dependencies:
+                    dependencies.discard(name)
+                    if not dependencies:
+                        ready.append(self.graph.steps[dependent])
+            return ready, self._remaining == 0
+
+    def describe(self) -> str:
+        return ', '.join(
+            f'{name} {timing.ran * 1000:.1f} ms '
+            f'(waited {timing.waited * 1000:.1f} ms)'
+            + (' failed' if name in self.errors else '')
+            for name, timing in self.timings.items()
+        )
+
+
+class TaskGraphExecutor:
+    """Запускает графы в общем пуле из max_workers потоков."""
+
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='task-graph',
+        )
+        self._running = 0
+        self._idle = threading.Condition()
+
+    def submit(self, graph: TaskGraph) -> Future:
+        """Возвращает Future, который завершится объектом GraphRun."""
+        run = GraphRun(graph)
+        if not graph.steps:
+            run.future.set_result(run)
+            return run.future
+        with self._idle:
+            self._running += 1
+        for step in run.ready_steps():
+            self._start(run, step)
+        return run.future
+
+    def wait(self, timeout: float = None) -> bool:
+        """Ждёт, пока не закончатся все запущенные графы."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._running, timeout)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _start(self, run: GraphRun, step: _Step):
+        try:
+            self._executor.submit(
+                self._run_step, run, step, time.perf_counter()
+            )
+        except RuntimeError as err:
+            # The pool is shut down: fail the step here, otherwise the run
+            # never finishes and wait() blocks forever.
+            logger.error('%s: step %s not started: %s',
+                         run.graph.name, step.name, err)
+            self._complete(run, step, None, err, StepTiming(0, 0))
+
+    def _complete(self, run: GraphRun, step: _Step, result, error,
+                  timing: StepTiming):
+        ready, finished = run.complete(step.name, result, error, timing)
+        for next_step in ready:
+            self._start(run, next_step)
+        if finished:
+            self._finish(run)
+
+    def _run_step(self, run: GraphRun, step: _Step, submitted_at: float):
+        started_at = time.perf_counter()
+        result, error = None, None
+        failed = [name for name in step.after if name in run.errors]
+        if failed:
+            error = DependencyFailed(f'{step.name} skipped, failed: {failed}')
+        else:
+            dependencies = {name: run.results[name] for name in step.after}
+            try:
+                with metrics.track_step(run.graph.name, step.name):
+                    result = step.func(*step.args, **step.kwargs, **dependencies)
+            except Exception as err:
+                error = err
+                logger.exception('%s: step %s failed', run.graph.name, step.name)
+        finished_at = time.perf_counter()
+
+        self._complete(
+            run, step, result, error,
+            StepTiming(started_at - submitted_at, finished_at - started_at),
+        )
+
+    def _finish(self, run: GraphRun):
+        logger.debug('%s: %s', run.graph.name, run.describe())
+        run.future.set_result(run)
+        with self._idle:
+            self._running -= 1
+            self._idle.notify_all()
@@ -1,47 +1,62 @@
+import functools
 import os
 import logging
+import queue
 import redis
 import time
-import json
 
 import requests
 from telegram import (
-    InlineKeyboardButton, InlineKeyboardMarkup,
+    Bot, InlineKeyboardButton, InlineKeyboardMarkup,
     ReplyKeyboardMarkup, KeyboardButton, LabeledPrice, ReplyKeyboardRemove,
 )
 from telegram import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import Filters, Updater, PreCheckoutQueryHandler
 from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler
+from telegram.utils.request import Request
 from textwrap import dedent
 from dotenv import load_dotenv
 
+import cart_mirror
+import geofunctions
+import metrics
 import moltin
-from geofunctions import fetch_coordinates, get_distance
+import profiling
+from catalog import ProductCatalog
+from menu_keyboards import MenuKeyboards
+from chat_scheduler import ChatScheduler, Debouncer
+from geocode_cache import GeocodeCache
+from job_scheduler import JobScheduler
+from photo_cache import PhotoCache
+from screens import Screen, render
+from session_store import SessionStore
+from task_graph import TaskGraph, TaskGraphExecutor
+from webhook import WebhookServer
+from pizzeria_locator import PizzeriaLocator
+from token_manager import get_access_token
 
 
 logger = logging.getLogger(__file__)
 _database = None
+_catalog = None
+_menu_keyboards = None
+_photo_cache = None
+_geocode_cache = None
+_session_store = None
+_scheduler = None
+_cart_edits_debouncer = None
+_profiler = None
+_task_executor = None
+_job_scheduler = None
+_pizzeria_locator = None
 
 
-def token_generator():
-    token_response = moltin.get_token()
-    expires = token_response['expires']
-    token = token_response['access_token']
-    while True:
-        if expires < time.time() + 60:
-            print('new token acquired at', time.ctime())
-            token_response = moltin.get_token()
-            expires = token_response['expires']
-            token = token_response['access_token']
-        yield token
+def get_cart_summary(session, chat_id):
+    return format_cart_summary(cart_mirror.get_cart(session, chat_id))
 
 
-def get_access_token():
-    return next(token_generator())
-
-
-def get_cart_summary(chat_id):
-    cart_items = moltin.get_cart_items(get_access_token(), chat_id)
+def format_cart_summary(cart_items):
     total = cart_items['meta']['display_price']['with_tax']['amount']
     cart_summary = dedent(
         ''.join(
@@ -58,9 +73,9 @@ def get_cart_summary(chat_id):
     return total, cart_summary
 
 
-def show_cart(bot, update):
+def show_cart(bot, update, session):
     query = update.callback_query
-    total, cart_summary = get_cart_summary(query.message.chat_id)
+    total, cart_summary = get_cart_summary(session, query.message.chat_id)
     keyboard = [[InlineKeyboardButton('В магазин', callback_data='menu')]]
     if total > 0:
         keyboard += [
@@ -69,96 +84,82 @@ def show_cart(bot, update):
             [InlineKeyboardButton('Оформить заказ', callback_data='checkout')],
         ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.message.reply_text(
-        cart_summary,
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.MARKDOWN
-    )
-    bot.delete_message(
-        chat_id=query.message.chat_id,
-        message_id=query.message.message_id
+    render(
+        bot,
+        session,
+        Screen(cart_summary, reply_markup, parse_mode=ParseMode.MARKDOWN),
+        message=query.message,
     )
 
 
-def show_menu(bot, update, callback=True, offset=0):
+def show_menu(bot, update, session, callback=True, offset=0):
     if callback:
-        query = update.callback_query
+        message = update.callback_query.message
     else:
-        query = update
-    products = moltin.get_products(get_access_token(), offset=offset)
-    keyboard = []
-    for product in products['data']:
-        price = product['price'][0]['amount']
-        if price and product['status'] == 'live':
-            keyboard.append(
-                [InlineKeyboardButton(
-                    f"{product['name']}: ₽{price:.2f}",
-                    callback_data=f"{product['id']}:{price:.2f}"
-                )]
-            )
-    page = products['meta']['page']
-    if page['total'] > 1:
-        if page['current'] == 1:
-            keyboard.append([InlineKeyboardButton(
-                '>>>', callback_data=page['offset'] + page['limit'],
-            )])
-        elif 1 < page['current'] < page['total']:
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        '<<<',
-                        callback_data=page['offset'] - page['limit'],
-                    ),
-                    InlineKeyboardButton(
-                        '>>>',
-                        callback_data=page['offset'] + page['limit']
-                    ),
-                ]
-            )
-        elif page['current'] == page['total']:
-            keyboard.append([InlineKeyboardButton(
-                '<<<', callback_data=page['offset'] - page['limit'],
-            )])
-
-    keyboard.append([InlineKeyboardButton('Корзина', callback_data='cart')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    query.message.reply_text(
-        'Пожалуйста, выберите пиццу:',
-        reply_markup=reply_markup
-    )
-    bot.delete_message(
-        chat_id=query.message.chat_id,
-        message_id=query.message.message_id
+        message = update.message
+    reply_markup = get_menu_keyboards().get(offset)
+
+    render(
+        bot,
+        session,
+        Screen('Пожалуйста, выберите пиццу:', reply_markup),
+        # Only the bot's own messages can be edited
+        message=message if callback else None,
     )
+    if not callback:
+        bot.delete_message(
+            chat_id=message.chat_id,
+            message_id=message.message_id
+        )
 
 
-def start(bot, update, job_queue):
+def start(bot, update, job_queue, session):
     update.message.reply_text(
         'Добро пожаловать!',
         reply_markup=ReplyKeyboardRemove()
     )
-    show_menu(bot, update, callback=False)
+    show_menu(bot, update, session, callback=False)
     return "HANDLE_MENU"
 
 
-def handle_menu(bot, update, job_queue):
-    db = get_database_connection()
+def send_product_photo(bot, chat_id, image_id, caption, reply_markup):
+    photo_cache = get_photo_cache()
+    file_id = photo_cache.get(image_id)
+    if file_id:
+        try:
+            return bot.send_photo(
+                chat_id=chat_id, photo=file_id, caption=caption,
+                reply_markup=reply_markup,
+            )
+        except BadRequest:
+            # file_id is no longer valid for this bot, upload the image again
+            photo_cache.forget(image_id)
+    message = bot.send_photo(
+        chat_id=chat_id,
+        photo=moltin.get_image_url(get_access_token(), image_id),
+        caption=caption,
+        reply_markup=reply_markup,
+    )
+    if message.photo:
+        photo_cache.set(image_id, message.photo[-1].file_id)
+    return message
+
+
+def handle_menu(bot, update, job_queue, session):
     query = update.callback_query
     if query.data == 'cart':
-        show_cart(bot, update)
+        show_cart(bot, update, session)
         return 'HANDLE_CART'
     elif query.data.isdigit():
-        show_menu(bot, update, offset=int(query.data))
+        show_menu(bot, update, session, offset=int(query.data))
         return "HANDLE_MENU"
     product_id, price = query.data.split(':')
-    product = moltin.get_product(get_access_token(), product_id)
-    main_image = product['relationships']['main_image']['data']
+    product = get_catalog().get_product(product_id)
+    main_image = product.get('relationships', {}).get('main_image', {}).get('data')
     if main_image:
         image_id = main_image['id']
     else:
         image_id = os.getenv('DEFAULT_IMAGE_ID')
-    image_url = moltin.get_image_url(get_access_token(), image_id)
     description = f"{product.get('name')}\n" \
                   f"{product.get('description', 'нет описания')}"
     keyboard = [
@@ -169,9 +170,10 @@ def handle_menu(bot, update, job_queue):
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    bot.send_photo(
+    send_product_photo(
+        bot,
         chat_id=query.message.chat_id,
-        photo=image_url,
+        image_id=image_id,
         caption=f'{description}\n₽{price}',
         reply_markup=reply_markup,
     )
@@ -182,25 +184,24 @@ def handle_menu(bot, update, job_queue):
     return 'HANDLE_DESCRIPTION'
 
 
-def handle_description(bot, update, job_queue):
-    db = get_database_connection()
+def handle_description(bot, update, job_queue, session):
     query = update.callback_query
     if query.data == 'menu':
-        show_menu(bot, update)
+        show_menu(bot, update, session)
         return "HANDLE_MENU"
     elif query.data == 'cart':
-        show_cart(bot, update)
+        show_cart(bot, update, session)
         return 'HANDLE_CART'
     else:
         product_id = query.data
-        product = moltin.get_product(get_access_token(), product_id)
+        product = get_catalog().get_product(product_id)
         quantity = 1
         description = f"{product.get('name')}\n" \
                       f"{product.get('description', 'нет описания')}"
         price = product['price'][0]['amount']
 
-        cart_items = moltin.add_product_to_cart(
-            get_access_token(), query.message.chat_id, product_id, quantity
+        cart_items = cart_mirror.add_product(
+            session, query.message.chat_id, product_id, quantity
         ).get('data')
         if not cart_items:
             bot.answer_callback_query(
@@ -228,26 +229,26 @@ def handle_description(bot, update, job_queue):
         return 'HANDLE_DESCRIPTION'
 
 
-def handle_cart(bot, update, job_queue):
-    db = get_database_connection()
+def handle_cart(bot, update, job_queue, session):
     query = update.callback_query
     if query.data == 'menu':
-        show_menu(bot, update)
+        show_menu(bot, update, session)
         return "HANDLE_MENU"
     elif query.data == 'change':
-        show_change_cart(bot, update, job_queue)
+        show_change_cart(bot, update, session)
         return "HANDLE_CHANGE_CART"
     elif query.data == 'clear':
-        moltin.delete_cart_items(get_access_token(), query.message.chat_id)
-        show_menu(bot, update)
+        cart_mirror.clear(session, query.message.chat_id)
+        show_menu(bot, update, session)
         return "HANDLE_MENU"
     elif query.data == 'checkout':
-        _, cart_summary = get_cart_summary(query.message.chat_id)
-        bot.edit_message_text(
-            chat_id=query.message.chat_id,
-            message_id=query.message.message_id,
-            text=cart_summary,
-            parse_mode=ParseMode.MARKDOWN
+        _, cart_summary = get_cart_summary(session, query.message.chat_id)
+        # Same cart text without the buttons.
+        render(
+            bot,
+            session,
+            Screen(cart_summary, parse_mode=ParseMode.MARKDOWN),
+            message=query.message,
         )
         update.callback_query.message.reply_text(
             'Сообщите, пожалуйста, ваш адрес или пришлите геолокацию'
@@ -255,11 +256,7 @@ def handle_cart(bot, update, job_queue):
         return 'WAITING_ADDRESS'
 
 
-def show_change_cart(bot, update, job_queue):
-    query = update.callback_query
-    cart_items = moltin.get_cart_items(
-        get_access_token(), query.message.chat_id
-    )
+def build_change_cart_screen(cart_items):
     total = cart_items['meta']['display_price']['with_tax']['formatted']
     keyboard = []
     for item in cart_items['data']:
@@ -283,37 +280,66 @@ def show_change_cart(bot, update, job_queue):
     keyboard.append([InlineKeyboardButton('Готово', callback_data='cart')])
 
     cart_summary = f'\nВсего: {total}'
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.callback_query.message.reply_text(
-        cart_summary,
-        reply_markup=reply_markup,
-    )
-    bot.delete_message(
-        chat_id=query.message.chat_id,
-        message_id=query.message.message_id
+    return Screen(cart_summary, InlineKeyboardMarkup(keyboard))
+
+
+def show_change_cart(bot, update, session):
+    query = update.callback_query
+    cart_items = cart_mirror.get_cart(session, query.message.chat_id)
+    render(
+        bot,
+        session,
+        build_change_cart_screen(cart_items),
+        message=query.message,
     )
 
 
-def handle_change_cart(bot, update, job_queue):
+def flush_cart_edits(chat_id):
+    session_store = get_session_store()
+    session = session_store.load(chat_id)
+    try:
+        cart_mirror.flush_pending(session, chat_id)
+    finally:
+        session_store.save(session)
+
+
+def schedule_cart_edits_flush(chat_id):
+    def submit_flush():
+        try:
+            get_scheduler().submit(chat_id, flush_cart_edits, chat_id)
+        except queue.Full:
+            logger.warning('chat %s: cart edits flush dropped', chat_id)
+
+    # The flush runs in the chat's scheduler lane, after any updates
+    # from this chat that are still queued.
+    get_cart_edits_debouncer().schedule(chat_id, submit_flush)
+
+
+def handle_change_cart(bot, update, job_queue, session):
     query = update.callback_query
+    chat_id = query.message.chat_id
     if query.data[0].isdigit():
         quantity, item_id = query.data.split(':')
-        moltin.update_cart_item(
-            get_access_token(),
-            query.message.chat_id,
-            item_id,
-            int(quantity),
+        cart_items = cart_mirror.set_quantity_locally(
+            session, chat_id, item_id, int(quantity)
         )
-        show_change_cart(bot, update, job_queue)
+        render(
+            bot,
+            session,
+            build_change_cart_screen(cart_items),
+            message=query.message,
+        )
+        schedule_cart_edits_flush(chat_id)
     elif query.data == 'cart':
-        show_cart(bot, update)
+        get_cart_edits_debouncer().cancel(chat_id)
+        cart_mirror.flush_pending(session, chat_id)
+        show_cart(bot, update, session)
         return 'HANDLE_CART'
-    
+
     return "HANDLE_CHANGE_CART"
 
 
-def handle_address(bot, update, job_queue):
-    db = get_database_connection()
+def handle_address(bot, update, job_queue, session):
     message = update.message
     delivery_data = {
         'cost': 0, 'address': 'not provided'
@@ -322,34 +348,32 @@ def handle_address(bot, update, job_queue):
         current_pos = (message.location.latitude, message.location.longitude)
     else:
         try:
-            current_pos = fetch_coordinates(
-                message.text, os.getenv('YANDEX_GEOCODER_APIKEY')
-            )
-            assert current_pos != (None, None)
-            delivery_data['address'] = message.text
+            current_pos = get_geocode_cache().get_coordinates(message.text)
         except requests.HTTPError:
             update.message.reply_text(
                 'Ошибка определения координат. Попробуйте еще раз'
             )
             return 'WAITING_ADDRESS'
-        except AssertionError:
+        if current_pos is None:
             update.message.reply_text(
                 'Адрес не найден. Попробуйте еще раз'
                 )
             return 'WAITING_ADDRESS'
+        delivery_data['address'] = message.text
 
-    pizzerias = moltin.get_pizzerias(get_access_token())['data']
-    distances = [
-        {
-            'address': pizzeria['address'],
-            'couriertg': pizzeria['couriertg'],
-            'distance': get_distance(
-                current_pos,
-                (pizzeria['lat'], pizzeria['lon'])
-            )
-        } for pizzeria in pizzerias
-    ]
-    nearest = min(distances, key=lambda x: x['distance'])
+    found = get_pizzeria_locator().find_nearest(current_pos)
+    if found is None:
+        logger.error('chat %s: no pizzerias loaded', message.chat_id)
+        message.reply_text(
+            'Не удалось найти пиццерию рядом с вами. Попробуйте позже'
+        )
+        return 'WAITING_ADDRESS'
+    pizzeria, distance = found
+    nearest = {
+        'address': pizzeria['address'],
+        'couriertg': pizzeria['couriertg'],
+        'distance': distance,
+    }
     delivery_data['location'] = current_pos
     delivery_data['pizzeria'] = nearest
     msg = f"Ближайшая пиццерия находится по адресу: {nearest['address']}."
@@ -380,7 +404,7 @@ def handle_address(bot, update, job_queue):
         )
         msg += " Возможен только самовывоз."
 
-    db.set(f'{message.chat_id}_delivery_data', json.dumps(delivery_data))
+    session.set('delivery_data', delivery_data)
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     update.message.reply_text(
@@ -390,12 +414,12 @@ def handle_address(bot, update, job_queue):
     return 'HANDLE_DELIVERY'
 
 
-def handle_delivery(bot, update, job_queue):
+def handle_delivery(bot, update, job_queue, session):
     query = update.callback_query
     if query.data in ('cancel', 'pickup'):
         msg = 'Ждем вас!'
         if query.data == 'cancel':
-            moltin.delete_cart_items(get_access_token(), query.message.chat_id)
+            cart_mirror.clear(session, query.message.chat_id)
             msg = 'Заказ отменен'
         reply_markup = ReplyKeyboardMarkup(
             [[KeyboardButton(text="/start")]],
@@ -410,9 +434,7 @@ def handle_delivery(bot, update, job_queue):
         return 'START'
     elif query.data.startswith('delivery'):
         delivery_cost = int(query.data.split(':')[1])
-        cart_items = moltin.get_cart_items(
-            get_access_token(), query.message.chat_id
-        )
+        cart_items = cart_mirror.verify(session, query.message.chat_id)
         prices = [LabeledPrice(
             f"{item['name']}, {item['quantity']}шт.",
             item['value']['amount'] * 100
@@ -437,23 +459,23 @@ def handle_delivery(bot, update, job_queue):
         return 'HANDLE_PRECHECKOUT'
 
 
-def ask_feedback(bot, job):
+def ask_feedback(bot, chat_id):
     keyboard = [[
         InlineKeyboardButton('Да', callback_data='yes'),
         InlineKeyboardButton('Нет', callback_data='no')
     ]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     bot.send_message(
-        job.context,
+        chat_id,
         'Сообщите, пожалуйста, вы получили заказ?',
         reply_markup=reply_markup,
     )
 
 
-def handle_feedback(bot, update, job_queue):
+def handle_feedback(bot, update, job_queue, session):
     query = update.callback_query
     if query.data == 'yes':
-        moltin.delete_cart_items(get_access_token(), query.message.chat_id)
+        cart_mirror.clear(session, query.message.chat_id)
         msg = 'Надеемся, что вам понравились наши пиццы!'
     elif query.data == 'no':
         msg = dedent(
@@ -478,7 +500,7 @@ def handle_feedback(bot, update, job_queue):
     return 'START'
 
 
-def handle_precheckout(bot, update, job_queue):
+def handle_precheckout(bot, update, job_queue, session):
     query = update.pre_checkout_query
     if query.invoice_payload != str(query.from_user.id):
         bot.answer_pre_checkout_query(
@@ -491,46 +513,58 @@ def handle_precheckout(bot, update, job_queue):
     return 'HANDLE_RECEIPT'
 
 
-def handle_success_payment(bot, update, job_queue):
-    db = get_database_connection()
-    query = update
-    delivery_data = json.loads(
-        db.get(f'{query.message.chat_id}_delivery_data').decode("utf-8")
-    )
-    moltin.create_customer_address(
-        get_access_token(),
-        address=delivery_data['address'],
-        lat=float(delivery_data['location'][0]),
-        lon=float(delivery_data['location'][1]),
-        tg_id=query.message.chat_id,
-    )
+def get_courier_message(chat_id, cart, delivery_cost):
+    if cart is None:
+        cart = moltin.get_cart_items(get_access_token(), chat_id)
+    _, msg = format_cart_summary(cart)
+    msg += f'\nСтоимость доставки: {delivery_cost}₽'
+    msg += f'\n[Связаться с клиентом](tg://user?id={chat_id})'
+    return msg
 
-    _, msg = get_cart_summary(query.message.chat_id)
-    msg += f'\nСтоимость доставки: {delivery_data["cost"]}₽'
-    msg += f'\n[Связаться с клиентом](tg://user?id={query.message.chat_id})'
 
-    bot.send_message(
-        delivery_data['pizzeria']['couriertg'],
-        msg,
-        parse_mode=ParseMode.MARKDOWN
-    )
-    bot.send_location(
-        delivery_data['pizzeria']['couriertg'],
-        latitude=float(delivery_data['location'][0]),
-        longitude=float(delivery_data['location'][1]),
+def send_courier_message(bot, courier_id, summary):
+    bot.send_message(courier_id, summary, parse_mode=ParseMode.MARKDOWN)
 
-    )
 
-    job_queue.run_once(ask_feedback, 3600, context=query.message.chat_id)
+def handle_success_payment(bot, update, job_queue, session):
+    query = update
+    chat_id = query.message.chat_id
+    delivery_data = session.get('delivery_data')
+    courier_id = delivery_data['pizzeria']['couriertg']
+    lat, lon = (float(coordinate) for coordinate in delivery_data['location'])
+
     query.message.reply_text(
         f'Оплата ₽{query.message.successful_payment.total_amount / 100:.2f} получена. '
         f'Спасибо за заказ! Ожидайте курьера в ближайшее время.'
     )
+    get_job_scheduler().schedule('ask_feedback', delay=3600, chat_id=chat_id)
+
+    # Адрес, сообщение и геопозиция для курьера отправляются в фоне.
+    # Шагам передаётся корзина, а не сессия: к их завершению сессия
+    # уже сохранена, и изменения в ней потерялись бы.
+    order = TaskGraph('success_payment')
+    order.add(
+        'customer_address', moltin.create_customer_address,
+        get_access_token(), address=delivery_data['address'],
+        lat=lat, lon=lon, tg_id=chat_id,
+    )
+    order.add(
+        'summary', get_courier_message,
+        chat_id, session.get('cart'), delivery_data['cost'],
+    )
+    order.add(
+        'courier_message', send_courier_message, bot, courier_id,
+        after=('summary',),
+    )
+    order.add(
+        'courier_location', bot.send_location, courier_id,
+        latitude=lat, longitude=lon,
+    )
+    get_task_executor().submit(order)
     return 'HANDLE_FEEDBACK'
 
 
 def handle_users_reply(bot, update, job_queue):
-    db = get_database_connection()
     if update.message:
         user_reply = update.message.text
         chat_id = update.message.chat_id
@@ -542,10 +576,23 @@ def handle_users_reply(bot, update, job_queue):
         chat_id = update.pre_checkout_query.from_user.id
     else:
         return
+    try:
+        # The future is ignored by the dispatcher, benchmarks wait on it.
+        return get_scheduler().submit(
+            chat_id, process_users_reply,
+            bot, update, job_queue, chat_id, user_reply,
+        )
+    except queue.Full:
+        logger.warning('chat %s: update dropped, lane queue is full', chat_id)
+
+
+def process_users_reply(bot, update, job_queue, chat_id, user_reply):
+    session_store = get_session_store()
+    session = session_store.load(chat_id)
     if user_reply == '/start':
         user_state = 'START'
     else:
-        user_state = db.get(chat_id).decode("utf-8")
+        user_state = session.state
 
     states_functions = {
         'START': start, 'HANDLE_MENU': handle_menu,
@@ -558,12 +605,14 @@ def handle_users_reply(bot, update, job_queue):
     state_handler = states_functions[user_state]
     # Если вы вдруг не заметите, что python-telegram-bot перехватывает ошибки.
     # Оставляю этот try...except, чтобы код не падал молча.
-    # Этот фрагмент можно переписать.
     try:
-        next_state = state_handler(bot, update, job_queue)
-        db.set(chat_id, next_state)
-    except Exception as err:
-        print(err)
+        with metrics.track_state(user_state), \
+                get_profiler().profile(user_state, chat_id):
+            next_state = state_handler(bot, update, job_queue, session)
+        session.state = next_state
+        session_store.save(session)
+    except Exception:
+        logger.exception('chat %s: %s failed', chat_id, user_state)
 
 
 def get_database_connection():
@@ -573,7 +622,7 @@ def get_database_connection():
     """
     global _database
     if _database is None:
-        _database = redis.Redis(
+        _database = metrics.InstrumentedRedis(
             connection_pool=redis.ConnectionPool.from_url(
                 os.environ['REDIS_URL']
             )
@@ -581,16 +630,120 @@ def get_database_connection():
     return _database
 
 
-def main():
-    load_dotenv()
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ChatScheduler(
+            lanes=int(os.getenv('SCHEDULER_LANES', os.getenv('TGBOT_WORKERS', 4))),
+            queue_size=int(os.getenv('SCHEDULER_QUEUE_SIZE', 100)),
+        )
+    return _scheduler
+
+
+def get_cart_edits_debouncer():
+    global _cart_edits_debouncer
+    if _cart_edits_debouncer is None:
+        _cart_edits_debouncer = Debouncer(
+            delay=float(os.getenv('CART_EDIT_DELAY', 1.5))
+        )
+    return _cart_edits_debouncer
+
+
+def get_job_scheduler():
+    global _job_scheduler
+    if _job_scheduler is None:
+        _job_scheduler = JobScheduler(
+            get_database_connection(),
+            batch_size=int(os.getenv('JOBS_BATCH_SIZE', 100)),
+            poll_interval=float(os.getenv('JOBS_POLL_INTERVAL', 1)),
+            visibility_timeout=float(os.getenv('JOBS_VISIBILITY_TIMEOUT', 60)),
+        )
+    return _job_scheduler
+
+
+def get_task_executor():
+    global _task_executor
+    if _task_executor is None:
+        _task_executor = TaskGraphExecutor(
+            max_workers=int(os.getenv('TASK_WORKERS', 4))
+        )
+    return _task_executor
+
+
+def get_profiler():
+    global _profiler
+    if _profiler is None:
+        _profiler = profiling.Profiler.from_env()
+    return _profiler
+
+
+def get_session_store():
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore(
+            get_database_connection(),
+            ttl=int(os.getenv('SESSION_TTL', 30 * 24 * 3600)),
+        )
+    return _session_store
+
+
+def get_catalog():
+    """
+    Возвращает общий для процесса кэш каталога товаров,
+    либо создаёт его, если он ещё не создан.
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = ProductCatalog(
+            ttl=int(os.getenv('CATALOG_TTL', 600)),
+            redis_client=get_database_connection(),
+        )
+    return _catalog
+
+
+def get_menu_keyboards():
+    global _menu_keyboards
+    if _menu_keyboards is None:
+        _menu_keyboards = MenuKeyboards(
+            get_catalog(), redis_client=get_database_connection()
+        )
+    return _menu_keyboards
+
+
+def get_photo_cache():
+    global _photo_cache
+    if _photo_cache is None:
+        _photo_cache = PhotoCache(get_database_connection())
+    return _photo_cache
+
+
+def get_geocode_cache():
+    global _geocode_cache
+    if _geocode_cache is None:
+        _geocode_cache = GeocodeCache(get_database_connection())
+    return _geocode_cache
+
 
-    updater = Updater(os.getenv("TGBOT_TOKEN"))
-    dispatcher = updater.dispatcher
+def get_pizzeria_locator():
+    global _pizzeria_locator
+    if _pizzeria_locator is None:
+        _pizzeria_locator = PizzeriaLocator()
+    return _pizzeria_locator
 
+
+class InstrumentedRequest(Request):
+    """Request бота, который замеряет каждый вызов Bot API."""
+
+    def post(self, url, data, timeout=None):
+        with metrics.track('telegram', url.rsplit('/', 1)[-1]):
+            return super().post(url, data, timeout)
+
+    def get(self, url, timeout=None):
+        with metrics.track('telegram', url.rsplit('/', 1)[-1]):
+            return super().get(url, timeout)
+
+
+def setup_dispatcher(dispatcher):
     dispatcher.add_handler(CallbackQueryHandler(
         handle_users_reply, pass_job_queue=True
     ))
@@ -610,8 +763,72 @@ def main():
         'start', handle_users_reply, pass_job_queue=True
     ))
 
-    updater.start_polling()
-    updater.idle()
+
+def run_webhook(updater, workers):
+    secret = os.environ['WEBHOOK_SECRET']
+    server = WebhookServer(
+        updater.dispatcher,
+        secret,
+        host=os.getenv('WEBHOOK_HOST', '127.0.0.1'),
+        port=int(os.getenv('WEBHOOK_PORT', 8443)),
+        path=os.getenv('WEBHOOK_PATH', '/telegram'),
+        workers=int(os.getenv('WEBHOOK_WORKERS', workers)),
+        queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)),
+    )
+    updater.bot.set_webhook(
+        url=f"{os.environ['WEBHOOK_URL'].rstrip('/')}/{secret}",
+        max_connections=int(os.getenv('WEBHOOK_WORKERS', workers)) * 2,
+    )
+    updater.job_queue.start()
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        updater.job_queue.stop()
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    workers = int(os.getenv('TGBOT_WORKERS', 4))
+    if os.getenv('METRICS_PORT'):
+        metrics.start_server(
+            int(os.environ['METRICS_PORT']),
+            host=os.getenv('METRICS_HOST', '127.0.0.1'),
+        )
+    moltin.configure(
+        pool_size=workers,
+        max_in_flight=int(os.getenv('MOLTIN_MAX_IN_FLIGHT', 100)),
+    )
+    geofunctions.configure(
+        pool_size=workers,
+        max_in_flight=int(os.getenv('GEOCODER_MAX_IN_FLIGHT', 100)),
+    )
+    bot = Bot(
+        os.getenv("TGBOT_TOKEN"),
+        request=InstrumentedRequest(con_pool_size=workers + 4),
+    )
+    updater = Updater(bot=bot, workers=workers)
+    setup_dispatcher(updater.dispatcher)
+    job_scheduler = get_job_scheduler()
+    job_scheduler.register('ask_feedback', functools.partial(ask_feedback, bot))
+    job_scheduler.start()
+
+    try:
+        if os.getenv('WEBHOOK_URL'):
+            run_webhook(updater, workers)
+        else:
+            updater.bot.delete_webhook()
+            updater.start_polling()
+            updater.idle()
+    finally:
+        job_scheduler.stop()
 
 
 if __name__ == '__main__':
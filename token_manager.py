@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+
+import moltin
+
+
+logger = logging.getLogger(__file__)
+
+
+class TokenManager:
+    """
+    Кэширует access token Moltin для всего процесса.
+    Токен обновляется в фоне заранее, до истечения срока `expires`,
+    а одновременные вызовы делят один запрос к /oauth/access_token.
+    """
+
+    def __init__(self, fetch_token=moltin.get_token, refresh_margin=300):
+        self._fetch_token = fetch_token
+        self._refresh_margin = refresh_margin
+        self._token = None
+        self._expires = 0
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._timer = None
+        self._stats = {'hits': 0, 'refreshes': 0, 'background_refreshes': 0,
+                       'failures': 0}
+
+    def _is_fresh(self) -> bool:
+        return self._token is not None \
+            and self._expires > time.time() + self._refresh_margin / 2
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    def _refresh(self):
+        try:
+            token_response = self._fetch_token()
+        except Exception:
+            self._count('failures')
+            raise
+        self._token = token_response['access_token']
+        self._expires = token_response['expires']
+        self._count('refreshes')
+        logger.info(
+            'new token acquired at %s, token stats: %s',
+            time.ctime(), self.stats()
+        )
+        self._schedule_background_refresh()
+
+    def _schedule_background_refresh(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._expires - time.time() - self._refresh_margin, 1)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._refresh_lock:
+            try:
+                self._refresh()
+                self._count('background_refreshes')
+            except Exception as err:
+                logger.warning('background token refresh failed: %s', err)
+                # Retry soon; foreground callers still refresh on demand.
+                self._timer = threading.Timer(30, self._background_refresh)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def get_token(self) -> str:
+        if self._is_fresh():
+            self._count('hits')
+            return self._token
+        with self._refresh_lock:
+            # Somebody else may have refreshed while we were waiting.
+            if self._is_fresh():
+                self._count('hits')
+                return self._token
+            self._refresh()
+            return self._token
+
+    def invalidate(self):
+        with self._refresh_lock:
+            self._token = None
+            self._expires = 0
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+_token_manager = TokenManager()
+
+
+def get_access_token() -> str:
+    return _token_manager.get_token()
+
+
+def get_token_stats() -> dict:
+    return _token_manager.stats()
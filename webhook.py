@@ -0,0 +1,112 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+
+logger = logging.getLogger(__file__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для приёма обновлений Telegram через вебхук.
+    Обновления складываются в ограниченную очередь и обрабатываются
+    пулом воркеров через dispatcher.process_update. TLS завершается
+    на обратном прокси перед сервером.
+    """
+
+    def __init__(
+            self, dispatcher, secret: str, host: str = '127.0.0.1',
+            port: int = 8443, path: str = '/telegram', workers: int = 4,
+            queue_size: int = 1000
+    ):
+        self.dispatcher = dispatcher
+        self.secret = secret
+        self.path = path.rstrip('/')
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def server_address(self) -> tuple:
+        return self._httpd.server_address
+
+    def is_authorized(self, path: str, headers) -> bool:
+        # compare_digest rejects str with non-ASCII characters, so compare
+        # bytes: a crafted path must get 403, not an exception.
+        header_secret = headers.get(SECRET_HEADER)
+        if header_secret is not None:
+            return path == self.path and hmac.compare_digest(
+                header_secret.encode(), self.secret.encode()
+            )
+        return hmac.compare_digest(
+            path.encode(), f'{self.path}/{self.secret}'.encode()
+        )
+
+    def _make_handler(self):
+        server = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not server.is_authorized(self.path, self.headers):
+                    self._reply(403)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    data = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400)
+                    return
+                try:
+                    server.updates.put_nowait(data)
+                except queue.Full:
+                    # Telegram retries updates that were not accepted.
+                    self._reply(503)
+                    return
+                self._reply(200)
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return WebhookHandler
+
+    def _work(self):
+        while True:
+            data = self.updates.get()
+            if data is None:
+                return
+            try:
+                update = Update.de_json(data, self.dispatcher.bot)
+                self.dispatcher.process_update(update)
+            except Exception:
+                logger.exception('failed to process update %s', data)
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        logger.info('webhook server listening on %s:%s', *self.server_address)
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for _ in self._threads:
+            self.updates.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []